@@ -0,0 +1,148 @@
+"""
+almacen_chunks.py - Almacén local del texto y el orden de los chunks
+cargar_pdf.py guarda aquí cada documento (id, orden, página, texto) en un
+SQLite compacto. consultar.py lo usa para ampliar cada fragmento recuperado
+con sus vecinos anterior y siguiente sin volver a llamar a Azure.
+"""
+
+import os
+import sqlite3
+import threading
+
+
+def unir_textos(anterior, siguiente, max_solape=200, min_solape=10):
+    """Concatena dos chunks consecutivos quitando el texto solapado entre ellos"""
+    for k in range(min(len(anterior), len(siguiente), max_solape), min_solape - 1, -1):
+        if anterior.endswith(siguiente[:k]):
+            return anterior + siguiente[k:]
+    return anterior + "\n" + siguiente
+
+
+class AlmacenChunks:
+    def __init__(self, ruta=None):
+        self.ruta = ruta or os.getenv("RAG_ALMACEN_CHUNKS", "almacen_chunks.db")
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(self.ruta, check_same_thread=False)
+        with self._lock, self._conexion:
+            self._conexion.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                " source TEXT NOT NULL, ordinal INTEGER NOT NULL, id TEXT NOT NULL,"
+                " page INTEGER, content TEXT NOT NULL, PRIMARY KEY (source, ordinal))"
+            )
+            self._conexion.execute("CREATE INDEX IF NOT EXISTS chunks_id ON chunks (id)")
+
+    def guardar_documento(self, source, chunks):
+        """Reemplaza los chunks guardados de un documento (deben traer 'ordinal')"""
+        filas = [(source, c["ordinal"], c["id"], c.get("page"), c["content"]) for c in chunks]
+        with self._lock, self._conexion:
+            self._conexion.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            self._conexion.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?, ?)", filas)
+        return len(filas)
+
+    def agregar(self, chunks):
+        """Agrega o reemplaza chunks sueltos (p. ej. al restaurar un snapshot); ignora los que no traen 'ordinal'"""
+        filas = [(c["source"], c["ordinal"], c["id"], c.get("page"), c["content"])
+                 for c in chunks if c.get("ordinal") is not None and c.get("source")]
+        with self._lock, self._conexion:
+            self._conexion.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)", filas)
+        return len(filas)
+
+    def eliminar_documento(self, source):
+        with self._lock, self._conexion:
+            return self._conexion.execute("DELETE FROM chunks WHERE source = ?", (source,)).rowcount
+
+    def vaciar(self):
+        with self._lock, self._conexion:
+            return self._conexion.execute("DELETE FROM chunks").rowcount
+
+    def posiciones(self, ids):
+        """id -> (source, ordinal) de los ids presentes en el almacén"""
+        ids = list(ids)
+        if not ids:
+            return {}
+        marcas = ",".join("?" * len(ids))
+        with self._lock:
+            filas = self._conexion.execute(
+                f"SELECT id, source, ordinal FROM chunks WHERE id IN ({marcas})", ids
+            ).fetchall()
+        return {i: (s, o) for i, s, o in filas}
+
+    def rango(self, source, desde, hasta):
+        """Chunks de un documento con ordinal en [desde, hasta], en orden"""
+        with self._lock:
+            return self._conexion.execute(
+                "SELECT ordinal, page, content FROM chunks"
+                " WHERE source = ? AND ordinal BETWEEN ? AND ? ORDER BY ordinal",
+                (source, desde, hasta)
+            ).fetchall()
+
+    def expandir(self, contextos, ventana=1, presupuesto=None, costo=len):
+        """Amplía cada contexto con `ventana` chunks a cada lado
+
+        Los contextos que quedan solapados o contiguos dentro del mismo documento
+        se funden en uno (en la posición del mejor de ellos). Los que no están
+        en el almacén (p. ej. cargados antes de existir) se devuelven igual.
+
+        presupuesto: máximo de `costo` (p. ej. tokens estimados) del total. Los
+        contextos se amplían en orden de relevancia; si uno no cabe con toda la
+        ventana se prueba con menos vecinos y, si no, se deja sin ampliar.
+        """
+        if ventana <= 0 or not contextos:
+            return contextos
+        posiciones = self.posiciones(c["id"] for c in contextos if c.get("id"))
+
+        # Rangos por documento, en el orden de relevancia
+        grupos = []
+        for ctx in contextos:
+            posicion = posiciones.get(ctx.get("id"))
+            if posicion is None:
+                grupos.append({"contexto": ctx, "miembros": [ctx]})
+                continue
+            source, ordinal = posicion
+            desde, hasta = ordinal - ventana, ordinal + ventana
+            for grupo in grupos:
+                if grupo.get("source") == source and desde <= grupo["hasta"] + 1 and hasta >= grupo["desde"] - 1:
+                    grupo["desde"] = min(grupo["desde"], desde)
+                    grupo["hasta"] = max(grupo["hasta"], hasta)
+                    grupo["ordinales"].append(ordinal)
+                    grupo["miembros"].append(ctx)
+                    break
+            else:
+                grupos.append({"contexto": ctx, "source": source, "desde": desde, "hasta": hasta,
+                               "ordinales": [ordinal], "miembros": [ctx]})
+
+        total = sum(costo(c["content"]) for c in contextos)
+        expandidos = []
+        for grupo in grupos:
+            if "source" not in grupo:
+                expandidos.append(grupo["contexto"])
+                continue
+            filas = self.rango(grupo["source"], grupo["desde"], grupo["hasta"])
+            base = sum(costo(c["content"]) for c in grupo["miembros"])
+            primero, ultimo = min(grupo["ordinales"]), max(grupo["ordinales"])
+            for v in range(ventana, -1, -1):
+                ctx = self._unir(grupo["contexto"], [f for f in filas if primero - v <= f[0] <= ultimo + v])
+                extra = costo(ctx["content"]) - base
+                if presupuesto is None or total + extra <= presupuesto or extra <= 0:
+                    total += extra
+                    expandidos.append(ctx)
+                    break
+            else:
+                expandidos.extend(grupo["miembros"])
+        return expandidos
+
+    def _unir(self, ctx, filas):
+        """Un contexto con el texto de varias filas consecutivas (sin solapes) y su rango de páginas"""
+        if not filas:
+            return ctx
+        texto = filas[0][2]
+        for _, _, contenido in filas[1:]:
+            texto = unir_textos(texto, contenido)
+        paginas = sorted({p for _, p, _ in filas if p is not None})
+        pagina = (f"{paginas[0]}-{paginas[-1]}" if len(paginas) > 1
+                  else (paginas[0] if paginas else ctx.get("page")))
+        return dict(ctx, content=texto, page=pagina)
+
+    def cerrar(self):
+        with self._lock:
+            self._conexion.close()
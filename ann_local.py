@@ -0,0 +1,435 @@
+"""
+ann_local.py - Índice aproximado de vecinos (IVF-PQ) para índices locales grandes
+Con millones de chunks de 1536 dimensiones el coseno exacto de IndiceLocal deja
+de ser barato. Este índice agrupa los vectores en `nlist` listas (k-means) y
+guarda de cada uno un código PQ de `m` bytes; una consulta solo recorre las
+`nprobe` listas más cercanas y reordena los mejores candidatos con el coseno
+exacto. nprobe y el factor de reordenado permiten cambiar recall por latencia.
+
+Formato (un directorio, todos los .npy mapeables con np.load(mmap_mode="r")):
+    manifest.json     versión, parámetros, fuentes
+    ids.json          id de chunk por fila
+    centroides.npy    (nlist, d) float32          libros.npy   (m, 256, d/m) float32
+    codigos.npy       (n, m) uint8                listas.npy   (n,) int32
+    fuentes.npy       (n,) int32                  inicio.npy   (nlist + 1,) int64
+    vectores.npy      (n, d) float16 (opcional, para reordenar sin IndiceLocal)
+
+Las filas se guardan ordenadas por lista. Las altas posteriores a la carga van
+a una cola en memoria y las bajas se marcan; guardar() compacta ambas.
+
+Uso:
+    python ann_local.py construir local:<ruta>|snapshot:<ruta> [nlist] [m]
+    python ann_local.py evaluar local:<ruta>|snapshot:<ruta> [consultas]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+VERSION_FORMATO = 1
+TAMANO_BLOQUE = 16384
+CODIGOS_POR_SUBESPACIO = 256
+
+
+def normalizar(vectores):
+    v = np.asarray(vectores, dtype=np.float32)
+    return v / (np.linalg.norm(v, axis=1, keepdims=True) + 1e-12)
+
+
+def asignar(x, centroides, esferico=False):
+    """Centroide más cercano de cada fila (producto interno si es esférico, L2 si no)"""
+    resultado = np.empty(len(x), dtype=np.int32)
+    sesgo = None if esferico else -0.5 * np.einsum("ij,ij->i", centroides, centroides)
+    for i in range(0, len(x), TAMANO_BLOQUE):
+        puntajes = x[i:i + TAMANO_BLOQUE] @ centroides.T
+        if sesgo is not None:
+            puntajes += sesgo
+        resultado[i:i + TAMANO_BLOQUE] = np.argmax(puntajes, axis=1)
+    return resultado
+
+
+def kmeans(x, k, iteraciones=12, esferico=False, semilla=0):
+    """k-means de Lloyd vectorizado; los grupos que se vacían se reinician al azar"""
+    rng = np.random.default_rng(semilla)
+    k = min(k, len(x))
+    centroides = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iteraciones):
+        asignacion = asignar(x, centroides, esferico)
+        cuentas = np.bincount(asignacion, minlength=k)
+        llenos = np.flatnonzero(cuentas)
+        orden = np.argsort(asignacion, kind="stable")
+        inicios = np.concatenate([[0], np.cumsum(cuentas)[:-1]])[llenos]
+        centroides[llenos] = np.add.reduceat(x[orden], inicios, axis=0) / cuentas[llenos, None]
+        vacios = np.flatnonzero(cuentas == 0)
+        if len(vacios):
+            centroides[vacios] = x[rng.choice(len(x), len(vacios), replace=False)]
+        if esferico:
+            centroides = normalizar(centroides)
+    return centroides
+
+
+class IndiceANN:
+    """IVF-PQ sobre vectores normalizados (puntaje = coseno), con altas y bajas por id"""
+
+    def __init__(self, dimensiones=1536, nlist=None, m=None, nprobe=None, reordenar=None,
+                 guardar_vectores=True, hilos=None):
+        self.dimensiones = dimensiones
+        self.nlist = nlist or int(os.getenv("RAG_ANN_NLIST", "0"))   # 0 = según el tamaño
+        self.m = m or int(os.getenv("RAG_ANN_M", "96"))
+        if dimensiones % self.m:
+            raise ValueError(f"m={self.m} debe dividir las {dimensiones} dimensiones")
+        self.nprobe = nprobe or int(os.getenv("RAG_ANN_NPROBE", "16"))
+        self.reordenar = reordenar or int(os.getenv("RAG_ANN_REORDENAR", "4"))
+        self.guardar_vectores = guardar_vectores
+        self.hilos = hilos or int(os.getenv("RAG_ANN_HILOS", "0")) or os.cpu_count()
+
+        self.centroides = None
+        self.libros = None
+        self.nombres_fuentes = []
+        self._codigo_fuente = {}
+
+        # Base ordenada por lista (posiblemente memmap) y cola de altas en memoria
+        self._base = self._segmento_vacio()
+        self.inicio = None
+        self._cola = []
+        self._cola_unida = None
+
+        self.ids = []
+        self.posicion = {}
+        self.vivos = np.zeros(0, dtype=bool)
+
+    def _segmento_vacio(self):
+        return {
+            "codigos": np.zeros((0, self.m), dtype=np.uint8),
+            "listas": np.zeros(0, dtype=np.int32),
+            "fuentes": np.zeros(0, dtype=np.int32),
+            "vectores": np.zeros((0, self.dimensiones), dtype=np.float16) if self.guardar_vectores else None,
+        }
+
+    def __len__(self):
+        return len(self.posicion)
+
+    @property
+    def entrenado(self):
+        return self.centroides is not None
+
+    # ----------------------------------------------------------- entrenamiento
+    def entrenar(self, vectores, muestra=None):
+        """Centroides de las listas y libros PQ (sobre los residuos) a partir de una muestra"""
+        muestra = muestra or int(os.getenv("RAG_ANN_MUESTRA", "100000"))
+        rng = np.random.default_rng(0)
+        filas = np.sort(rng.choice(len(vectores), min(muestra, len(vectores)), replace=False))
+        x = normalizar(vectores[filas])
+
+        if not self.nlist:
+            self.nlist = int(np.clip(np.sqrt(len(vectores)), 1, max(len(x) // 32, 1)))
+        inicio = time.perf_counter()
+        self.centroides = kmeans(x, self.nlist, esferico=True)
+        self.nlist = len(self.centroides)
+        residuos = x - self.centroides[asignar(x, self.centroides, esferico=True)]
+
+        # Un libro de códigos por subespacio, entrenados en paralelo
+        ancho = self.dimensiones // self.m
+        with ThreadPoolExecutor(max_workers=self.hilos) as executor:
+            libros = list(executor.map(
+                lambda j: kmeans(np.ascontiguousarray(residuos[:, j * ancho:(j + 1) * ancho]),
+                                 CODIGOS_POR_SUBESPACIO, semilla=j),
+                range(self.m)
+            ))
+        self.libros = np.zeros((self.m, CODIGOS_POR_SUBESPACIO, ancho), dtype=np.float32)
+        for j, libro in enumerate(libros):
+            self.libros[j, :len(libro)] = libro
+        self.inicio = np.zeros(self.nlist + 1, dtype=np.int64)
+        print(f"🧭 ANN entrenado: {self.nlist} listas, m={self.m}, muestra {len(x)} "
+              f"({time.perf_counter() - inicio:.1f}s)")
+
+    def _codificar(self, bloque):
+        x = normalizar(bloque)
+        listas = asignar(x, self.centroides, esferico=True)
+        residuos = x - self.centroides[listas]
+        ancho = self.dimensiones // self.m
+        codigos = np.empty((len(x), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codigos[:, j] = asignar(np.ascontiguousarray(residuos[:, j * ancho:(j + 1) * ancho]), self.libros[j])
+        vectores = x.astype(np.float16) if self.guardar_vectores else None
+        return codigos, listas, vectores
+
+    # ------------------------------------------------------------ altas y bajas
+    def _fuente(self, nombre):
+        codigo = self._codigo_fuente.get(nombre)
+        if codigo is None:
+            codigo = self._codigo_fuente[nombre] = len(self.nombres_fuentes)
+            self.nombres_fuentes.append(nombre)
+        return codigo
+
+    def agregar(self, ids, vectores, fuentes=None):
+        """Alta (o reemplazo) de chunks por id; la codificación se reparte en hilos"""
+        if not self.entrenado:
+            raise RuntimeError("El índice ANN no está entrenado (usa construir() o entrenar())")
+        ids = list(ids)
+        if not ids:
+            return 0
+        self.eliminar([i for i in ids if i in self.posicion])
+
+        bloques = range(0, len(ids), TAMANO_BLOQUE)
+        with ThreadPoolExecutor(max_workers=self.hilos) as executor:
+            codificados = list(executor.map(lambda i: self._codificar(vectores[i:i + TAMANO_BLOQUE]), bloques))
+
+        fuentes = list(fuentes) if fuentes is not None else [None] * len(ids)
+        self._cola.append({
+            "codigos": np.concatenate([c for c, _, _ in codificados]),
+            "listas": np.concatenate([l for _, l, _ in codificados]),
+            "fuentes": np.array([self._fuente(f) for f in fuentes], dtype=np.int32),
+            "vectores": np.concatenate([v for _, _, v in codificados]) if self.guardar_vectores else None,
+        })
+        self._cola_unida = None
+
+        primera = len(self.ids)
+        self.ids.extend(ids)
+        self.posicion.update((chunk_id, primera + i) for i, chunk_id in enumerate(ids))
+        self.vivos = np.concatenate([self.vivos, np.ones(len(ids), dtype=bool)])
+        return len(ids)
+
+    def eliminar(self, ids):
+        """Baja por id (se marca; guardar() o compactar() libera el espacio)"""
+        eliminados = 0
+        for chunk_id in ids:
+            fila = self.posicion.pop(chunk_id, None)
+            if fila is not None:
+                self.vivos[fila] = False
+                eliminados += 1
+        return eliminados
+
+    def _segmento_cola(self):
+        if self._cola_unida is None:
+            if not self._cola:
+                self._cola_unida = self._segmento_vacio()
+            else:
+                self._cola_unida = {
+                    campo: (None if self._cola[0][campo] is None
+                            else np.concatenate([s[campo] for s in self._cola]))
+                    for campo in self._cola[0]
+                }
+            self._cola = [self._cola_unida] if self._cola else []
+        return self._cola_unida
+
+    def _tomar(self, campo, filas):
+        """Valores de un campo para filas globales (base y cola)"""
+        base, cola = self._base[campo], self._segmento_cola()[campo]
+        n_base = len(self._base["listas"])
+        en_base = filas < n_base
+        valores = np.empty((len(filas),) + base.shape[1:], dtype=base.dtype)
+        valores[en_base] = base[filas[en_base]]
+        valores[~en_base] = cola[filas[~en_base] - n_base]
+        return valores
+
+    def compactar(self):
+        """Une base y cola sin las filas eliminadas, ordenadas por lista"""
+        vivas = np.flatnonzero(self.vivos)
+        orden = vivas[np.argsort(self._tomar("listas", vivas), kind="stable")]
+
+        self._base = {campo: (None if valor is None else self._tomar(campo, orden))
+                      for campo, valor in self._base.items()}
+        self.ids = [self.ids[i] for i in orden]
+        self.posicion = {chunk_id: i for i, chunk_id in enumerate(self.ids)}
+        self.vivos = np.ones(len(self.ids), dtype=bool)
+        cuentas = np.bincount(self._base["listas"], minlength=self.nlist)
+        self.inicio = np.concatenate([[0], np.cumsum(cuentas)]).astype(np.int64)
+        self._cola, self._cola_unida = [], None
+
+    def construir(self, ids, vectores, fuentes=None):
+        """Entrena, codifica en paralelo y deja la base compactada"""
+        inicio = time.perf_counter()
+        self.entrenar(vectores)
+        self.agregar(ids, vectores, fuentes)
+        self.compactar()
+        print(f"✅ ANN construido: {len(self)} vectores en {time.perf_counter() - inicio:.1f}s "
+              f"({self.hilos} hilos)")
+        return self
+
+    # ---------------------------------------------------------------- búsqueda
+    def _candidatos(self, q, n, fuentes, nprobe):
+        """Filas vivas de las listas más cercanas a q y sus puntajes PQ (las n mejores)"""
+        vacio = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        if not self.entrenado or not len(self):
+            return vacio
+        codigos_fuente = None
+        if fuentes is not None:
+            codigos_fuente = [self._codigo_fuente[f] for f in fuentes if f in self._codigo_fuente]
+            if not codigos_fuente:
+                return vacio
+
+        cercania = self.centroides @ q
+        n_base = len(self._base["listas"])
+        listas_cola = self._segmento_cola()["listas"]
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        while True:
+            sondeadas = np.argpartition(-cercania, nprobe - 1)[:nprobe]
+            filas = np.concatenate(
+                [np.arange(self.inicio[l], self.inicio[l + 1]) for l in sondeadas]
+                + [n_base + np.flatnonzero(np.isin(listas_cola, sondeadas))]
+            ).astype(np.int64)
+            filas = filas[self.vivos[filas]]
+            if codigos_fuente is not None:
+                filas = filas[np.isin(self._tomar("fuentes", filas), codigos_fuente)]
+            # Con filtros muy selectivos se sondean más listas hasta reunir candidatos
+            if len(filas) >= n or nprobe >= self.nlist:
+                break
+            nprobe = min(nprobe * 4, self.nlist)
+        if not len(filas):
+            return vacio
+
+        # Distancia asimétrica: q·centroide + suma por subespacio de q·código (tabla m x 256)
+        tabla = np.einsum("mcd,md->mc", self.libros, q.reshape(self.m, -1))
+        puntajes = (cercania[self._tomar("listas", filas)]
+                    + tabla[np.arange(self.m), self._tomar("codigos", filas)].sum(axis=1))
+        n = min(n, len(filas))
+        mejores = np.argpartition(-puntajes, n - 1)[:n]
+        mejores = mejores[np.argsort(-puntajes[mejores])]
+        return filas[mejores], puntajes[mejores]
+
+    def candidatos(self, vector, n, fuentes=None, nprobe=None):
+        """Ids aproximadamente más cercanos y sus puntajes PQ, como mucho n"""
+        q = normalizar(np.asarray(vector, dtype=np.float32)[None, :])[0]
+        filas, puntajes = self._candidatos(q, n, fuentes, nprobe)
+        return [self.ids[f] for f in filas], puntajes
+
+    def buscar(self, vector, k=10, fuentes=None, nprobe=None):
+        """Top k (id, coseno); con vectores guardados reordena k*reordenar candidatos exactos"""
+        q = normalizar(np.asarray(vector, dtype=np.float32)[None, :])[0]
+        filas, puntajes = self._candidatos(q, k * self.reordenar, fuentes, nprobe)
+        if self.guardar_vectores and len(filas):
+            puntajes = self._tomar("vectores", filas).astype(np.float32) @ q
+            orden = np.argsort(-puntajes)[:k]
+            filas, puntajes = filas[orden], puntajes[orden]
+        return [(self.ids[f], float(p)) for f, p in zip(filas[:k], puntajes[:k])]
+
+    # ------------------------------------------------------------ persistencia
+    def guardar(self, ruta):
+        """Compacta y escribe el directorio (en uno temporal que luego lo reemplaza)"""
+        self.compactar()
+        temporal = f"{ruta}.tmp"
+        shutil.rmtree(temporal, ignore_errors=True)
+        os.makedirs(temporal)
+        arrays = {"centroides": self.centroides, "libros": self.libros, "inicio": self.inicio}
+        arrays.update({c: v for c, v in self._base.items() if v is not None})
+        for nombre, valor in arrays.items():
+            np.save(os.path.join(temporal, f"{nombre}.npy"), np.asarray(valor))
+        with open(os.path.join(temporal, "ids.json"), "w", encoding="utf-8") as f:
+            json.dump(self.ids, f, ensure_ascii=False)
+        with open(os.path.join(temporal, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "version": VERSION_FORMATO,
+                "dimensiones": self.dimensiones,
+                "nlist": self.nlist,
+                "m": self.m,
+                "nprobe": self.nprobe,
+                "reordenar": self.reordenar,
+                "vectores": self.guardar_vectores,
+                "total": len(self.ids),
+                "fuentes": self.nombres_fuentes
+            }, f, indent=2, ensure_ascii=False)
+        shutil.rmtree(ruta, ignore_errors=True)
+        os.rename(temporal, ruta)
+
+    @classmethod
+    def cargar(cls, ruta, nprobe=None):
+        """Abre un índice guardado; códigos y vectores quedan mapeados, no en memoria"""
+        with open(os.path.join(ruta, "manifest.json"), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != VERSION_FORMATO:
+            raise ValueError(f"Versión de índice ANN no soportada: {manifest.get('version')}")
+        with open(os.path.join(ruta, "ids.json"), "r", encoding="utf-8") as f:
+            ids = json.load(f)
+
+        indice = cls(dimensiones=manifest["dimensiones"], nlist=manifest["nlist"], m=manifest["m"],
+                     nprobe=nprobe or manifest["nprobe"], reordenar=manifest["reordenar"],
+                     guardar_vectores=manifest["vectores"])
+        abrir = lambda nombre: np.load(os.path.join(ruta, f"{nombre}.npy"), mmap_mode="r")
+        indice.centroides = np.array(abrir("centroides"))
+        indice.libros = np.array(abrir("libros"))
+        indice.inicio = np.array(abrir("inicio"))
+        indice._base = {c: (abrir(c) if c != "vectores" or indice.guardar_vectores else None)
+                        for c in ("codigos", "listas", "fuentes", "vectores")}
+        indice.nombres_fuentes = manifest["fuentes"]
+        indice._codigo_fuente = {f: i for i, f in enumerate(indice.nombres_fuentes)}
+        indice.ids = ids
+        indice.posicion = {chunk_id: i for i, chunk_id in enumerate(ids)}
+        indice.vivos = np.ones(len(ids), dtype=bool)
+        return indice
+
+
+def ruta_ann(origen):
+    """Directorio del índice ANN que acompaña a un índice local o a un snapshot"""
+    if origen.startswith("snapshot:"):
+        return os.path.join(origen[len("snapshot:"):], "ann")
+    return f"{origen[len('local:'):] if origen.startswith('local:') else origen}.ann"
+
+
+def abrir_origen(origen):
+    """IndiceLocal de 'local:<ruta>' o 'snapshot:<ruta>' (sin ANN adjunto)"""
+    from indice_local import IndiceLocal
+    from snapshot_indice import cargar_snapshot_local
+
+    if origen.startswith("snapshot:"):
+        return cargar_snapshot_local(origen[len("snapshot:"):], con_ann=False)
+    return IndiceLocal.cargar(origen[len("local:"):] if origen.startswith("local:") else origen, con_ann=False)
+
+
+def construir_desde_local(indice, **parametros):
+    """IndiceANN sin vectores propios (IndiceLocal reordena con su matriz)"""
+    filas = [i for i, vivo in enumerate(indice.vivos) if vivo]
+    ann = IndiceANN(dimensiones=indice.dimensiones, guardar_vectores=False, **parametros)
+    matriz = indice.matriz()
+    vectores = matriz if len(filas) == len(matriz) else matriz[filas]
+    return ann.construir(
+        [indice.documentos[i]["id"] for i in filas],
+        vectores,
+        [indice.documentos[i].get("source") for i in filas]
+    )
+
+
+def evaluar(indice, consultas=200, k=10, nprobes=(1, 4, 16, 64)):
+    """Recall@k y latencia del ANN frente al coseno exacto, para varios nprobe"""
+    matriz = indice.matriz()
+    rng = np.random.default_rng(1)
+    filas = rng.choice(len(matriz), min(consultas, len(matriz)), replace=False)
+    preguntas = normalizar(matriz[np.sort(filas)])
+    preguntas += rng.normal(0, 0.01, preguntas.shape).astype(np.float32)
+    exactos = [set(np.argsort(-(matriz @ q))[:k].tolist()) for q in preguntas]
+
+    print(f"\n📏 ANN vs exacto: {len(preguntas)} consultas, k={k}, {len(indice.ann)} vectores")
+    for nprobe in nprobes:
+        aciertos, tiempos = 0, []
+        for q, exacto in zip(preguntas, exactos):
+            inicio = time.perf_counter()
+            ids, _ = indice.ann.candidatos(q, k * indice.ann.reordenar, nprobe=nprobe)
+            filas = [indice.posicion[i] for i in ids]
+            filas = [filas[j] for j in np.argsort(-(matriz[filas] @ q))[:k]] if filas else []
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+            aciertos += len(exacto & set(filas))
+        print(f"   • nprobe={nprobe:<4} recall@{k}={aciertos / (len(preguntas) * k):.3f}  "
+              f"p50={np.percentile(tiempos, 50):.2f}ms  p95={np.percentile(tiempos, 95):.2f}ms")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("construir", "evaluar"):
+        print("Uso: python ann_local.py construir|evaluar local:<ruta>|snapshot:<ruta> [nlist|consultas] [m]")
+        sys.exit(1)
+
+    accion, origen = sys.argv[1], sys.argv[2]
+    indice = abrir_origen(origen)
+    if accion == "construir":
+        nlist = int(sys.argv[3]) if len(sys.argv) > 3 else None
+        m = int(sys.argv[4]) if len(sys.argv) > 4 else None
+        ann = construir_desde_local(indice, nlist=nlist, m=m)
+        ann.guardar(ruta_ann(origen))
+        print(f"💾 Índice ANN guardado en: {ruta_ann(origen)}")
+    else:
+        indice.usar_ann(IndiceANN.cargar(ruta_ann(origen)))
+        evaluar(indice, consultas=int(sys.argv[3]) if len(sys.argv) > 3 else 200)
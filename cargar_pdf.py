@@ -5,8 +5,9 @@ Solo ejecutar cuando necesites agregar nuevos documentos
 
 import os
 import sys
+import mmap
+import multiprocessing
 import PyPDF2
-from openai import AzureOpenAI
 from azure.search.documents import SearchClient
 from azure.search.documents.indexes import SearchIndexClient
 from azure.search.documents.indexes.models import (
@@ -23,21 +24,164 @@ from dotenv import load_dotenv
 import hashlib
 from datetime import datetime
 import json
+from concurrent.futures import ProcessPoolExecutor
+from subida_indice import SubidorDocumentos, MAX_BYTES_LOTE, tamano_serializado
+from enrutado_fuentes import EnrutadorFuentes
+from consumo_tokens import RegistroConsumo, PresupuestoExcedido, estimar_tokens
+from estadisticas_indice import escapar_odata
+from recorrido_indice import recorrer_paginas
+from perfilado import Perfilador
+from almacen_chunks import AlmacenChunks
+from coalescencia import UnVuelo
+from pool_openai import crear_cliente_openai
+from planificador import Planificador
+from limpieza_texto import limpiar_paginas
+from diario_carga import DiarioCarga, SUBIDO, CARGA_INCOMPLETA
 
 # Cargar variables de entorno
 load_dotenv()
 
+def construir_indice(nombre, id_ordenable=True):
+    """Define el esquema del índice (campos y búsqueda vectorial)
+
+    id_ordenable: 'id' sortable permite recorrer el índice por rangos de clave
+    (ver recorrido_indice.py); en un índice existente no se puede cambiar.
+    """
+    fields = [
+        SearchField(
+            name="id",
+            type=SearchFieldDataType.String,
+            key=True,
+            filterable=True,
+            sortable=id_ordenable
+        ),
+        SearchField(
+            name="content",
+            type=SearchFieldDataType.String,
+            searchable=True,
+        ),
+        SearchField(
+            name="content_vector",
+            type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
+            searchable=True,
+            vector_search_dimensions=1536,
+            vector_search_profile_name="vector-profile"
+        ),
+        SearchField(
+            name="source",
+            type=SearchFieldDataType.String,
+            filterable=True,
+            facetable=True
+        ),
+        SearchField(
+            name="page",
+            type=SearchFieldDataType.Int32,
+            filterable=True,
+        ),
+        SearchField(
+            name="fecha_carga",
+            type=SearchFieldDataType.DateTimeOffset,
+            filterable=True,
+            sortable=True
+        ),
+        SearchField(
+            name="ordinal",
+            type=SearchFieldDataType.Int32,
+            filterable=True,
+            sortable=True
+        )
+    ]
+
+    vector_search = VectorSearch(
+        algorithms=[
+            HnswAlgorithmConfiguration(
+                name="hnsw-algo",
+                parameters={
+                    "m": 4,
+                    "efConstruction": 400,
+                    "efSearch": 500,
+                    "metric": "cosine"
+                }
+            )
+        ],
+        profiles=[
+            VectorSearchProfile(
+                name="vector-profile",
+                algorithm_configuration_name="hnsw-algo"
+            )
+        ]
+    )
+
+    index = SearchIndex(
+        name=nombre,
+        fields=fields,
+        vector_search=vector_search
+    )
+    return index
+
+def asegurar_indice(index_client, nombre):
+    """Crea el índice si no existe; si existe, solo le agrega los campos que falten
+
+    Los atributos de un campo existente (p. ej. 'id' no sortable en índices
+    anteriores) no se pueden modificar: se conservan tal cual.
+    """
+    try:
+        index = index_client.get_index(nombre)
+    except ResourceNotFoundError:
+        index = construir_indice(nombre)
+        index_client.create_or_update_index(index)
+        return index
+    existentes = {f.name for f in index.fields}
+    faltan = [f for f in construir_indice(nombre).fields if f.name not in existentes]
+    if faltan:
+        index.fields.extend(faltan)
+        index_client.create_or_update_index(index)
+    return index
+
+def dividir_pagina(text, page_num, pdf_name, fecha, chunk_size=500, overlap=100, min_longitud=50):
+    """Divide el texto de una página en chunks con overlap (ids estables por página)"""
+    chunks = []
+    for i in range(0, len(text), chunk_size - overlap):
+        chunk_text = text[i:i + chunk_size]
+        
+        if len(chunk_text.strip()) > min_longitud:
+            chunk_id = hashlib.md5(
+                f"{pdf_name}_{page_num}_{i}_{chunk_text[:20]}".encode()
+            ).hexdigest()
+            
+            chunks.append({
+                "id": chunk_id,
+                "content": chunk_text,
+                "source": pdf_name,
+                "page": page_num + 1,
+                "fecha_carga": fecha
+            })
+    return chunks
+
+def extraer_paginas(pdf_path, inicio, fin):
+    """Texto de las páginas [inicio, fin) abriendo el PDF de forma independiente
+
+    Se ejecuta en procesos separados: cada uno mapea el archivo en memoria
+    (las páginas se comparten con la caché del sistema) y lee solo su rango.
+    """
+    with open(pdf_path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as datos:
+            pdf_reader = PyPDF2.PdfReader(datos)
+            return [pdf_reader.pages[n].extract_text() for n in range(inicio, fin)]
+
+def rangos_paginas(total_pages, partes):
+    """Rangos contiguos [inicio, fin) de tamaño parecido que cubren todas las páginas"""
+    partes = max(1, min(partes, total_pages))
+    limites = [total_pages * k // partes for k in range(partes + 1)]
+    return [(limites[k], limites[k + 1]) for k in range(partes)]
+
 class CargadorPDF:
     def __init__(self):
         """Inicializa clientes de Azure"""
         print("🔧 Inicializando conexiones...")
         
-        # Cliente de OpenAI para embeddings
-        self.openai_client = AzureOpenAI(
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-            api_key=os.getenv("AZURE_OPENAI_KEY"),
-            api_version="2024-02-15-preview"
-        )
+        # Cliente de OpenAI para embeddings (o pool de despliegues, ver pool_openai.py)
+        self.openai_client = crear_cliente_openai()
         
         # Clientes de Azure Search
         self.search_endpoint = os.getenv("AZURE_SEARCH_ENDPOINT")
@@ -55,6 +199,35 @@ class CargadorPDF:
             credential=AzureKeyCredential(self.search_key)
         )
         
+        # Centroides por documento para el enrutado en dos etapas
+        self.enrutador = EnrutadorFuentes(self.index_name, self.search_endpoint, self.search_key)
+        
+        # Turnos compartidos con consultar.py (RAG_PLANIFICADOR_TPM): la carga
+        # usa la cuota que dejan libre las preguntas
+        self.planificador = Planificador()
+        
+        # Tokens y costo por documento, ejecución y sesión (con presupuestos)
+        self.consumo = RegistroConsumo(planificador=self.planificador, clase="ingesta")
+        
+        # Perfilado opcional por etapas (RAG_PERFILADO=1)
+        self.perfil = Perfilador("cargar_pdf")
+        
+        # Embeddings idénticos simultáneos (p. ej. texto repetido entre documentos) comparten la petición
+        self.vuelos = UnVuelo()
+        
+        # Limpieza de cabeceras, pies y espacios antes de dividir en chunks (RAG_LIMPIEZA=0 la desactiva)
+        self.limpieza = os.getenv("RAG_LIMPIEZA", "1") == "1"
+        
+        # Diario reanudable: estado de cada chunk y embeddings ya pagados
+        self.diario = DiarioCarga()
+        
+        # Texto y orden de los chunks, para ampliar resultados con sus vecinos al consultar
+        self.almacen = AlmacenChunks()
+        
+        # Procesos para extraer un PDF grande (RAG_PROCESOS_EXTRACCION, por defecto
+        # uno por núcleo; la vigilancia los reparte entre sus hilos)
+        self.procesos_extraccion = int(os.getenv("RAG_PROCESOS_EXTRACCION", "0")) or os.cpu_count() or 1
+        
         # Archivo de registro
         self.log_file = "carga_documentos_log.txt"
         
@@ -71,6 +244,11 @@ class CargadorPDF:
         """Verifica si el índice existe, si no lo crea"""
         try:
             index = self.index_client.get_index(self.index_name)
+            if "ordinal" not in {f.name for f in index.fields}:
+                # Índices anteriores: agregar un campo es compatible con los documentos existentes
+                # (los atributos de 'id' se conservan: no se pueden modificar)
+                id_ordenable = any(f.name == "id" and f.sortable for f in index.fields)
+                self.index_client.create_or_update_index(construir_indice(self.index_name, id_ordenable))
             doc_count = self.obtener_conteo_documentos()
             self.log_actividad(f"✅ Índice '{self.index_name}' existe con {doc_count} documentos")
             return True
@@ -81,71 +259,7 @@ class CargadorPDF:
     
     def crear_indice(self):
         """Crea el índice con la configuración necesaria"""
-        fields = [
-            SearchField(
-                name="id",
-                type=SearchFieldDataType.String,
-                key=True,
-                filterable=True
-            ),
-            SearchField(
-                name="content",
-                type=SearchFieldDataType.String,
-                searchable=True,
-            ),
-            SearchField(
-                name="content_vector",
-                type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
-                searchable=True,
-                vector_search_dimensions=1536,
-                vector_search_profile_name="vector-profile"
-            ),
-            SearchField(
-                name="source",
-                type=SearchFieldDataType.String,
-                filterable=True,
-                facetable=True
-            ),
-            SearchField(
-                name="page",
-                type=SearchFieldDataType.Int32,
-                filterable=True,
-            ),
-            SearchField(
-                name="fecha_carga",
-                type=SearchFieldDataType.DateTimeOffset,
-                filterable=True,
-                sortable=True
-            )
-        ]
-        
-        vector_search = VectorSearch(
-            algorithms=[
-                HnswAlgorithmConfiguration(
-                    name="hnsw-algo",
-                    parameters={
-                        "m": 4,
-                        "efConstruction": 400,
-                        "efSearch": 500,
-                        "metric": "cosine"
-                    }
-                )
-            ],
-            profiles=[
-                VectorSearchProfile(
-                    name="vector-profile",
-                    algorithm_configuration_name="hnsw-algo"
-                )
-            ]
-        )
-        
-        index = SearchIndex(
-            name=self.index_name,
-            fields=fields,
-            vector_search=vector_search
-        )
-        
-        self.index_client.create_or_update_index(index)
+        self.index_client.create_or_update_index(construir_indice(self.index_name))
         self.log_actividad(f"✅ Índice '{self.index_name}' creado exitosamente")
     
     def obtener_conteo_documentos(self):
@@ -175,124 +289,353 @@ class CargadorPDF:
         except:
             return False
     
-    def procesar_pdf(self, pdf_path, chunk_size=500):
-        """Extrae texto del PDF y lo divide en chunks"""
+    def extraer_textos(self, pdf_path, procesos=None, log=None):
+        """Texto de cada página, en orden
+        
+        Los PDFs grandes se reparten por rangos de páginas entre varios procesos
+        (self.procesos_extraccion) a partir de RAG_MIN_PAGINAS_PARALELO páginas.
+        """
+        log = log or self.log_actividad
+        with open(pdf_path, 'rb') as file:
+            total_pages = len(PyPDF2.PdfReader(file).pages)
+        log(f"   Total de páginas: {total_pages}")
+        
+        procesos = procesos or self.procesos_extraccion
+        minimo = int(os.getenv("RAG_MIN_PAGINAS_PARALELO", "50"))
+        if procesos <= 1 or total_pages < minimo:
+            return extraer_paginas(pdf_path, 0, total_pages)
+        
+        # Varios rangos por proceso para repartir bien páginas de costo desigual;
+        # map conserva el orden de los rangos, así que el resultado sale en orden de página
+        rangos = rangos_paginas(total_pages, procesos * 4)
+        log(f"   ⚡ Extracción en {procesos} procesos ({len(rangos)} rangos de páginas)")
+        # spawn: un fork con hilos vivos (vigilancia, cobertura, SQLite) puede
+        # heredar bloqueos tomados y colgar al proceso hijo
+        contexto = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto) as executor:
+            partes = executor.map(extraer_paginas, [pdf_path] * len(rangos),
+                                  [r[0] for r in rangos], [r[1] for r in rangos])
+            return [text for parte in partes for text in parte]
+    
+    def procesar_pdf(self, pdf_path, chunk_size=500, procesos=None, log=None):
+        """Extrae texto del PDF y lo divide en chunks
+
+        log: función para los mensajes (por defecto log_actividad, que escribe en
+        el log de carga; las simulaciones pasan print)
+        """
+        log = log or self.log_actividad
         chunks = []
         pdf_name = os.path.basename(pdf_path)
         fecha_actual = datetime.now()
         
-        self.log_actividad(f"📄 Procesando: {pdf_name}")
+        log(f"📄 Procesando: {pdf_name}")
         
         try:
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                total_pages = len(pdf_reader.pages)
-                self.log_actividad(f"   Total de páginas: {total_pages}")
-                
-                for page_num in range(total_pages):
-                    page = pdf_reader.pages[page_num]
-                    text = page.extract_text()
-                    
-                    # Dividir en chunks con overlap
-                    overlap = 100
-                    text_length = len(text)
-                    
-                    for i in range(0, text_length, chunk_size - overlap):
-                        chunk_text = text[i:i + chunk_size]
-                        
-                        if len(chunk_text.strip()) > 50:
-                            chunk_id = hashlib.md5(
-                                f"{pdf_name}_{page_num}_{i}_{chunk_text[:20]}".encode()
-                            ).hexdigest()
-                            
-                            chunks.append({
-                                "id": chunk_id,
-                                "content": chunk_text,
-                                "source": pdf_name,
-                                "page": page_num + 1,
-                                "fecha_carga": fecha_actual
-                            })
-                
-                self.log_actividad(f"   ✅ {len(chunks)} chunks creados")
-                return chunks
+            textos = self.extraer_textos(pdf_path, procesos, log)
+            
+            # Sin cabeceras, pies y líneas repetidas entre páginas, y con espacios normalizados
+            originales = textos
+            if self.limpieza:
+                with self.perfil.etapa("limpieza"):
+                    textos, limpieza = limpiar_paginas(textos)
+            
+            # Dividir en chunks con overlap
+            for page_num, text in enumerate(textos):
+                chunks.extend(dividir_pagina(text, page_num, pdf_name, fecha_actual, chunk_size))
+            
+            if self.limpieza:
+                self.informar_limpieza(originales, chunks, limpieza, pdf_name, fecha_actual, chunk_size, log)
+            
+            # Orden del chunk dentro del documento
+            for ordinal, chunk in enumerate(chunks):
+                chunk["ordinal"] = ordinal
+            
+            log(f"   ✅ {len(chunks)} chunks creados")
+            return chunks
                 
         except Exception as e:
-            self.log_actividad(f"   ❌ Error procesando PDF: {str(e)}")
+            log(f"   ❌ Error procesando PDF: {str(e)}")
             return []
     
-    def generar_embeddings(self, text):
+    def informar_limpieza(self, originales, chunks, limpieza, pdf_name, fecha, chunk_size, log=None):
+        """Ahorro de la limpieza frente a dividir el texto tal cual (sin llamadas a Azure)"""
+        log = log or self.log_actividad
+        sin_limpiar = [c for n, text in enumerate(originales)
+                       for c in dividir_pagina(text, n, pdf_name, fecha, chunk_size)]
+        tokens_antes = sum(estimar_tokens(c["content"]) for c in sin_limpiar)
+        tokens_despues = sum(estimar_tokens(c["content"]) for c in chunks)
+        ahorro = 1 - limpieza["caracteres_despues"] / max(limpieza["caracteres_antes"], 1)
+        log(
+            f"   🧹 Limpieza: {limpieza['lineas_eliminadas']} líneas repetidas quitadas "
+            f"({limpieza['patrones']} patrones), {ahorro:.1%} menos texto | "
+            f"chunks {len(sin_limpiar)} → {len(chunks)} "
+            f"({len(sin_limpiar) - len(chunks)} embeddings menos, ~{tokens_antes - tokens_despues} tokens)"
+        )
+    
+    def generar_embeddings(self, text, documento=None):
         """Genera embeddings usando Azure OpenAI"""
         try:
-            response = self.openai_client.embeddings.create(
-                input=text,
-                model=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
-            )
+            response = self.vuelos.ejecutar("embedding", text, lambda: self.consumo.medir(
+                "embedding",
+                lambda: self.openai_client.embeddings.create(
+                    input=text,
+                    model=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+                ),
+                estimar_tokens(text),
+                documento=documento
+            ))
             return response.data[0].embedding
+        except PresupuestoExcedido:
+            raise
         except Exception as e:
             self.log_actividad(f"   ❌ Error generando embedding: {str(e)}")
             return None
     
     def cargar_chunks(self, chunks):
-        """Genera embeddings y carga chunks al índice"""
+        """Genera embeddings y carga chunks al índice
+
+        La subida ocurre en segundo plano mientras se generan los embeddings:
+        los lotes se cortan por tamaño en bytes y solo se reintentan los
+        documentos que fallan. Cada embedding se anota en el diario en cuanto
+        llega; los chunks que ya lo tienen (carga reanudada) no se vuelven a
+        embeber y los ya subidos no se vuelven a enviar.
+        """
         self.log_actividad(f"🔄 Generando embeddings para {len(chunks)} chunks...")
         
-        chunks_con_embeddings = []
+        subidor = SubidorDocumentos(self.search_client, log=self.log_actividad)
+        con_embeddings = 0
         errores = 0
+        enviados = []
         
-        for i, chunk in enumerate(chunks):
-            if i % 10 == 0:
-                self.log_actividad(f"   Procesando chunk {i+1}/{len(chunks)}")
-            
-            embedding = self.generar_embeddings(chunk["content"])
-            if embedding:
-                chunk["content_vector"] = embedding
-                chunks_con_embeddings.append(chunk)
-            else:
-                errores += 1
+        with self.perfil.etapa("embeddings"):
+            for i, chunk in enumerate(chunks):
+                if chunk.pop("_estado", None) == SUBIDO:
+                    continue
+                if i % 10 == 0:
+                    self.log_actividad(f"   Procesando chunk {i+1}/{len(chunks)}")
+                
+                if chunk.get("content_vector") is None:
+                    try:
+                        embedding = self.generar_embeddings(chunk["content"], documento=chunk["source"])
+                    except PresupuestoExcedido as e:
+                        # Se sube lo ya procesado y se detiene la carga
+                        self.log_actividad(f"⛔ {e}: se detiene la carga en el chunk {i+1}/{len(chunks)}")
+                        errores += len(chunks) - i
+                        break
+                    if not embedding:
+                        errores += 1
+                        continue
+                    chunk["content_vector"] = embedding
+                    self.diario.marcar_embebido(chunk["id"], embedding)
+                subidor.agregar(chunk)
+                enviados.append(chunk["id"])
+                con_embeddings += 1
         
-        if chunks_con_embeddings:
-            # Cargar en lotes de 100
-            batch_size = 100
-            total_cargados = 0
-            
-            for i in range(0, len(chunks_con_embeddings), batch_size):
-                batch = chunks_con_embeddings[i:i + batch_size]
-                try:
-                    result = self.search_client.upload_documents(documents=batch)
-                    total_cargados += len(batch)
-                    self.log_actividad(f"   ✅ Lote {i//batch_size + 1}: {len(batch)} documentos cargados")
-                except Exception as e:
-                    self.log_actividad(f"   ❌ Error cargando lote: {str(e)}")
-            
-            self.log_actividad(f"✅ Total cargados: {total_cargados} chunks")
+        with self.perfil.etapa("subida"):
+            resumen = subidor.finalizar()
+        fallidos = {fallo["key"] for fallo in resumen["fallidos"]}
+        self.diario.marcar_subidos([i for i in enviados if i not in fallidos])
+        resumen["errores_embedding"] = errores
+        with self.perfil.etapa("enrutado"):
+            self.actualizar_enrutado(chunks)
+        
+        for source in {chunk["source"] for chunk in chunks}:
+            if source in self.consumo.por_documento:
+                self.log_actividad(f"💰 {source}: {self.consumo.resumen(self.consumo.por_documento[source])}")
+        self.consumo.guardar()
+        
+        if con_embeddings or not errores:
+            self.log_actividad(
+                f"✅ Total cargados: {resumen['subidos']} chunks "
+                f"({resumen['docs_s']:.1f} docs/s, {resumen['bytes_s']/1024:.1f} KB/s, "
+                f"{resumen['lotes']} lotes, {resumen['reintentos']} reintentos)"
+            )
+            for fallo in resumen["fallidos"][:10]:
+                self.log_actividad(f"   ❌ {fallo['key']}: [{fallo['status']}] {fallo['error']}")
+            if resumen["fallidos"]:
+                self.log_actividad(f"⚠️ Chunks no cargados: {len(resumen['fallidos'])}")
             if errores > 0:
                 self.log_actividad(f"⚠️ Chunks con errores: {errores}")
         else:
             self.log_actividad("❌ No se pudieron procesar chunks")
+        
+        return resumen
+    
+    def actualizar_enrutado(self, chunks):
+        """Recalcula los centroides de los documentos recién cargados"""
+        por_fuente = {}
+        for chunk in chunks:
+            if chunk.get("content_vector"):
+                por_fuente.setdefault(chunk["source"], []).append(chunk["content_vector"])
+        
+        for source, vectores in por_fuente.items():
+            try:
+                self.enrutador.asegurar_indice()
+                n = self.enrutador.actualizar_fuente(source, vectores)
+                self.log_actividad(f"   🧭 Enrutado actualizado para {source} ({n} vectores)")
+            except Exception as e:
+                self.log_actividad(f"   ⚠️ No se pudo actualizar el enrutado de {source}: {e}")
+    
+    def ids_documento(self, pdf_name):
+        """IDs de todos los chunks de un documento"""
+        ids = set()
+        for pagina in recorrer_paginas(
+            self.search_client,
+            select=["id"],
+            campo_particion=None,
+            filtro=f"source eq '{escapar_odata(pdf_name)}'"
+        ):
+            ids.update(doc["id"] for doc in pagina)
+        return ids
+    
+    def eliminar_chunks(self, ids, batch_size=1000):
+        ids = list(ids)
+        for i in range(0, len(ids), batch_size):
+            self.search_client.delete_documents(documents=[{"id": d} for d in ids[i:i + batch_size]])
+        return len(ids)
+    
+    def eliminar_documento(self, pdf_name):
+        """Elimina todos los chunks de un documento y su entrada de enrutado"""
+        total = self.eliminar_chunks(self.ids_documento(pdf_name))
+        self.almacen.eliminar_documento(pdf_name)
+        self.diario.olvidar(pdf_name)
+        try:
+            self.enrutador.eliminar_fuente(pdf_name)
+        except Exception as e:
+            self.log_actividad(f"   ⚠️ No se pudo actualizar el enrutado de {pdf_name}: {e}")
+        self.log_actividad(f"🗑️ {pdf_name}: {total} chunks eliminados")
+        return total
     
-    def cargar_pdf(self, pdf_path, forzar=False):
-        """Proceso principal para cargar un PDF"""
+    def cargar_pdf(self, pdf_path, forzar=False, interactivo=True, verificar_indice=True):
+        """Proceso principal para cargar un PDF
+        
+        Sin modo interactivo un PDF ya cargado se reemplaza sin preguntar. Al
+        recargar, los chunks que ya no existen en la nueva versión se eliminan
+        cuando la nueva versión está subida entera.
+
+        Devuelve True si el documento quedó cargado, CARGA_INCOMPLETA si faltan
+        chunks (errores, cuota o presupuesto: se reanuda desde el diario) y False
+        si no se cargó nada.
+        """
         if not os.path.exists(pdf_path):
             self.log_actividad(f"❌ No se encuentra el archivo: {pdf_path}")
             return False
         
         # Verificar/crear índice
-        self.verificar_crear_indice()
+        if verificar_indice:
+            self.verificar_crear_indice()
+        
+        # Carga anterior interrumpida del mismo archivo
+        pdf_name = os.path.basename(pdf_path)
+        pendientes = self.diario.pendiente(pdf_path)
         
         # Verificar si ya existe
-        if not forzar and self.verificar_pdf_existe(pdf_path):
-            self.log_actividad(f"⚠️ El PDF '{os.path.basename(pdf_path)}' ya está cargado")
+        existe = self.verificar_pdf_existe(pdf_path)
+        if existe and not forzar and interactivo and not pendientes:
+            self.log_actividad(f"⚠️ El PDF '{pdf_name}' ya está cargado")
             respuesta = input("¿Deseas cargarlo de nuevo? (s/n): ")
             if respuesta.lower() != 's':
                 return False
+        anteriores = self.ids_documento(pdf_name) if existe else set()
         
         # Procesar y cargar
-        chunks = self.procesar_pdf(pdf_path)
+        if pendientes:
+            chunks = pendientes
+            progreso = self.diario.progreso(pdf_name)
+            self.log_actividad(
+                f"⏯️ Reanudando {pdf_name}: {progreso.get(SUBIDO, 0)} subidos, "
+                f"{progreso.get('embebido', 0)} con embedding, {progreso.get('extraido', 0)} pendientes"
+            )
+        else:
+            with self.perfil.etapa("extraccion"):
+                chunks = self.procesar_pdf(pdf_path)
+            if chunks:
+                self.diario.registrar_extraccion(pdf_path, chunks)
         if chunks:
-            self.cargar_chunks(chunks)
+            with self.perfil.etapa("carga"):
+                resumen = self.cargar_chunks(chunks)
+            self.almacen.guardar_documento(pdf_name, chunks)
+            if resumen["fallidos"] or resumen["errores_embedding"]:
+                # La versión anterior sigue en el índice hasta completar la nueva
+                self.log_actividad(f"⏸️ Carga incompleta de {pdf_name}: se puede reanudar con --reanudar")
+                return CARGA_INCOMPLETA
+            self.diario.marcar_completo(pdf_name)
+            obsoletos = anteriores - {chunk["id"] for chunk in chunks}
+            if obsoletos:
+                self.eliminar_chunks(obsoletos)
+                self.log_actividad(f"   🧹 {len(obsoletos)} chunks de la versión anterior eliminados")
             return True
         return False
     
+    def reanudar(self, carpetas=()):
+        """Retoma las cargas interrumpidas y sigue con los PDFs aún no cargados de las carpetas"""
+        rutas = [r for r in self.diario.documentos_incompletos() if os.path.exists(r)]
+        self.verificar_crear_indice()
+        for carpeta in carpetas:
+            for f in sorted(os.listdir(carpeta)):
+                ruta = os.path.abspath(os.path.join(carpeta, f))
+                if (f.endswith('.pdf') and ruta not in rutas and not self.diario.completado(ruta)
+                        and not self.verificar_pdf_existe(ruta)):
+                    rutas.append(ruta)
+        
+        self.log_actividad(f"⏯️ {len(rutas)} PDFs por cargar o reanudar")
+        for ruta in rutas:
+            self.cargar_pdf(ruta, interactivo=False, verificar_indice=False)
+        if self.planificador.activo:
+            self.log_actividad(f"⏳ Espera en cola: {self.planificador.resumen()}")
+    
+    def estimar_carga(self, rutas, chunk_size=500):
+        """Simulación (sin llamadas a Azure): tokens, llamadas, tiempo y costo de cargar PDFs
+
+        rutas: archivos PDF y/o carpetas. El tiempo usa la latencia media de
+        embeddings registrada en cargas anteriores (o RAG_LATENCIA_EMBEDDING_MS).
+        """
+        pdfs = []
+        for ruta in rutas:
+            if os.path.isdir(ruta):
+                pdfs.extend(os.path.join(ruta, f) for f in sorted(os.listdir(ruta)) if f.endswith('.pdf'))
+            else:
+                pdfs.append(ruta)
+        
+        latencia_ms = (self.consumo.latencia_media_ms("embedding")
+                       or float(os.getenv("RAG_LATENCIA_EMBEDDING_MS", "150")))
+        vector_vacio = [0.0] * 1536
+        total = {"documentos": 0, "chunks": 0, "tokens": 0, "llamadas_embedding": 0,
+                 "bytes_subida": 0, "llamadas_subida": 0, "tiempo_s": 0.0, "costo_usd": 0.0}
+        
+        print(f"\n🧮 ESTIMACIÓN DE CARGA ({len(pdfs)} PDFs, sin llamadas a Azure)")
+        print("-" * 60)
+        for pdf_path in pdfs:
+            # Solo en pantalla: una simulación no deja rastro en el log de carga
+            chunks = self.procesar_pdf(pdf_path, chunk_size=chunk_size, log=print)
+            if not chunks:
+                continue
+            tokens = sum(estimar_tokens(c["content"]) for c in chunks)
+            bytes_subida = sum(tamano_serializado(dict(c, content_vector=vector_vacio)) for c in chunks)
+            
+            total["documentos"] += 1
+            total["chunks"] += len(chunks)
+            total["tokens"] += tokens
+            total["llamadas_embedding"] += len(chunks)
+            total["bytes_subida"] += bytes_subida
+            total["llamadas_subida"] += -(-bytes_subida // MAX_BYTES_LOTE)
+            print(f"   • {os.path.basename(pdf_path)}: {len(chunks)} chunks, ~{tokens} tokens")
+        
+        # Un embedding por chunk en serie; la subida ocurre en paralelo
+        total["tiempo_s"] = total["llamadas_embedding"] * latencia_ms / 1000
+        total["costo_usd"] = total["tokens"] / 1000 * self.consumo.precios["embedding"]
+        
+        print("-" * 60)
+        print(f"   Documentos: {total['documentos']} | Chunks: {total['chunks']}")
+        print(f"   Tokens de embedding: ~{total['tokens']}")
+        print(f"   Llamadas: {total['llamadas_embedding']} embeddings, "
+              f"{total['llamadas_subida']} subidas ({total['bytes_subida']/1024/1024:.1f} MB)")
+        print(f"   Tiempo estimado: {total['tiempo_s']/60:.1f} min ({latencia_ms:.0f} ms por embedding)")
+        print(f"   Costo estimado: ${total['costo_usd']:.4f}")
+        if self.consumo.limite_ejecucion and total["tokens"] > self.consumo.limite_ejecucion:
+            print(f"   ⚠️ Supera el presupuesto por ejecución ({self.consumo.limite_ejecucion} tokens)")
+        return total
+    
     def listar_documentos(self):
         """Lista todos los documentos cargados"""
         try:
@@ -330,9 +673,10 @@ def main():
         print("1. Cargar un PDF")
         print("2. Cargar múltiples PDFs de una carpeta")
         print("3. Ver documentos cargados")
-        print("4. Salir")
+        print("4. Estimar costo de cargar PDFs (sin cargar)")
+        print("5. Salir")
         
-        opcion = input("\nSelecciona opción (1-4): ")
+        opcion = input("\nSelecciona opción (1-5): ")
         
         if opcion == "1":
             pdf_path = input("\nRuta del archivo PDF: ")
@@ -353,6 +697,14 @@ def main():
             cargador.listar_documentos()
             
         elif opcion == "4":
+            ruta = input("\nRuta del PDF o carpeta: ")
+            cargador.estimar_carga([ruta])
+            
+        elif opcion == "5":
+            print(f"💰 Consumo de la ejecución: {cargador.consumo.resumen()}")
+            print(f"🔗 Llamadas en vuelo compartidas: {cargador.vuelos.resumen()}")
+            if cargador.planificador.activo:
+                print(f"⏳ Espera en cola: {cargador.planificador.resumen()}")
             print("\n👋 ¡Hasta luego!")
             break
             
@@ -361,7 +713,14 @@ def main():
 
 if __name__ == "__main__":
     # Si se pasa un archivo como argumento, cargarlo directamente
-    if len(sys.argv) > 1:
+    if len(sys.argv) > 2 and sys.argv[1] == "--estimar":
+        CargadorPDF().estimar_carga(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == "--reanudar":
+        CargadorPDF().reanudar(sys.argv[2:])
+    elif len(sys.argv) > 2 and sys.argv[1] == "--vigilar":
+        from vigilar_carpetas import VigilanteCarpetas
+        VigilanteCarpetas(CargadorPDF(), sys.argv[2:]).ejecutar()
+    elif len(sys.argv) > 1:
         cargador = CargadorPDF()
         for pdf_file in sys.argv[1:]:
             cargador.cargar_pdf(pdf_file)
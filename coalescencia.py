@@ -0,0 +1,71 @@
+"""
+coalescencia.py - Agrupación de llamadas idénticas en vuelo (single-flight)
+Si varias peticiones iguales (mismo embedding, misma búsqueda, mismo chat)
+llegan mientras la primera sigue en curso, esperan su resultado en lugar de
+repetir la llamada a Azure. No es una caché: al terminar la llamada la clave
+se libera.
+"""
+
+import json
+import hashlib
+import threading
+from collections import defaultdict
+from concurrent.futures import Future
+
+
+def _serializable(valor):
+    if hasattr(valor, "as_dict"):
+        return valor.as_dict()
+    if hasattr(valor, "tolist"):
+        return valor.tolist()
+    return str(valor)
+
+
+def clave_llamada(*partes):
+    """Huella estable de los argumentos de una llamada (textos, vectores, consultas)"""
+    datos = json.dumps(partes, default=_serializable, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(datos.encode("utf-8")).hexdigest()
+
+
+class UnVuelo:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._en_vuelo = {}
+        self.contadores = defaultdict(lambda: {"llamadas": 0, "compartidas": 0})
+
+    def ejecutar(self, tipo, clave, funcion):
+        """Ejecuta funcion() o, si ya hay una idéntica en curso, espera su resultado"""
+        clave = (tipo, clave)
+        with self._lock:
+            self.contadores[tipo]["llamadas"] += 1
+            futuro = self._en_vuelo.get(clave)
+            if futuro is not None:
+                self.contadores[tipo]["compartidas"] += 1
+                lider = False
+            else:
+                futuro = self._en_vuelo[clave] = Future()
+                lider = True
+
+        if not lider:
+            return futuro.result()
+
+        try:
+            resultado = funcion()
+        except BaseException as e:
+            futuro.set_exception(e)
+            raise
+        else:
+            futuro.set_result(resultado)
+            return resultado
+        finally:
+            with self._lock:
+                self._en_vuelo.pop(clave, None)
+
+    def resumen(self):
+        """Texto con las llamadas compartidas (ahorradas) por tipo"""
+        with self._lock:
+            partes = [
+                f"{tipo}: {c['compartidas']}/{c['llamadas']} compartidas"
+                for tipo, c in sorted(self.contadores.items())
+            ]
+        return ", ".join(partes) if partes else "sin llamadas"
@@ -4,35 +4,292 @@ No carga documentos, solo consulta lo que ya está indexado
 """
 
 import os
-from openai import AzureOpenAI
 from azure.search.documents import SearchClient
+from azure.search.documents.indexes import SearchIndexClient
 from azure.search.documents.models import VectorizedQuery
 from azure.core.credentials import AzureKeyCredential
 from dotenv import load_dotenv
 from datetime import datetime
 import json
+import time
+from collections import OrderedDict
+import unicodedata
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait
+from indice_local import IndiceLocal, fusion_rrf
+from snapshot_indice import cargar_snapshot_local
+from enrutado_fuentes import EnrutadorFuentes, filtro_fuentes
+from estadisticas_indice import escapar_odata
+from recorrido_indice import recorrer_paginas
+from consumo_tokens import RegistroConsumo, PresupuestoExcedido, estimar_tokens
+from perfilado import Perfilador
+from almacen_chunks import AlmacenChunks
+from coalescencia import UnVuelo, clave_llamada
+from pool_openai import crear_cliente_openai
+from planificador import Planificador
+from plazos import Plazo, PlazoVencido, Cobertura, SIN_PLAZO, opciones_timeout
 
 # Cargar variables de entorno
 load_dotenv()
 
+SIN_INFORMACION = "No encontré información relevante para responder tu pregunta."
+ARCHIVO_CALIBRACION = "calibracion_relevancia.json"
+
+def seleccionar_mmr(vector_pregunta, vectores, k, lambda_mmr=0.5, costos=None, presupuesto=None):
+    """Maximal Marginal Relevance vectorizado
+
+    Elige hasta k candidatos equilibrando relevancia con la pregunta y
+    novedad respecto a los ya elegidos. Si se da un presupuesto, solo se
+    consideran candidatos cuyo costo (tokens) aún cabe. Devuelve índices.
+    """
+    V = np.asarray(vectores, dtype=np.float32)
+    if len(V) == 0:
+        return []
+    V = V / (np.linalg.norm(V, axis=1, keepdims=True) + 1e-12)
+    q = np.asarray(vector_pregunta, dtype=np.float32)
+    q = q / (np.linalg.norm(q) + 1e-12)
+
+    relevancia = V @ q
+    max_sim = np.full(len(V), -np.inf, dtype=np.float32)
+    disponibles = np.ones(len(V), dtype=bool)
+    costos = np.zeros(len(V)) if costos is None else np.asarray(costos, dtype=np.float64)
+    restante = np.inf if presupuesto is None else float(presupuesto)
+
+    elegidos = []
+    while len(elegidos) < k:
+        candidatos = disponibles & (costos <= restante)
+        if not candidatos.any():
+            break
+        novedad = np.where(np.isfinite(max_sim), max_sim, 0.0)
+        puntaje = lambda_mmr * relevancia - (1 - lambda_mmr) * novedad
+        puntaje[~candidatos] = -np.inf
+        mejor = int(np.argmax(puntaje))
+
+        elegidos.append(mejor)
+        disponibles[mejor] = False
+        restante -= costos[mejor]
+        max_sim = np.maximum(max_sim, V @ V[mejor])
+
+    return elegidos
+
+def similitudes_coseno(vector_pregunta, vectores):
+    """Coseno entre la pregunta y cada candidato (no depende de la fusión ni del índice)"""
+    V = np.asarray(vectores, dtype=np.float32)
+    if len(V) == 0:
+        return np.zeros(0, dtype=np.float32)
+    q = np.asarray(vector_pregunta, dtype=np.float32)
+    return (V @ q) / ((np.linalg.norm(V, axis=1) + 1e-12) * (np.linalg.norm(q) + 1e-12))
+
+def profundidad_adaptativa(similitudes, minimo=2, maximo=8, factor_salto=3.0, salto_minimo=0.02):
+    """Cuántos fragmentos usar según la distribución de similitudes
+
+    Si entre las posiciones minimo..maximo hay un salto claro (mayor que
+    factor_salto veces el salto mediano y que salto_minimo) se corta ahí;
+    si las similitudes son planas se usan maximo. Siempre dentro de los límites.
+    """
+    orden = np.sort(np.asarray(similitudes, dtype=np.float32))[::-1][:maximo]
+    if len(orden) <= minimo:
+        return len(orden)
+    saltos = orden[:-1] - orden[1:]
+    referencia = float(np.median(saltos)) + 1e-6
+    candidatos = saltos[minimo - 1:]
+    mejor = int(np.argmax(candidatos))
+    if candidatos[mejor] >= max(factor_salto * referencia, salto_minimo):
+        return minimo + mejor
+    return len(orden)
+
+def cargar_umbral_relevancia(archivo=ARCHIVO_CALIBRACION):
+    """Umbral de similitud por debajo del cual no se llama al modelo (None = desactivado)
+
+    RAG_UMBRAL_RELEVANCIA tiene prioridad; si no, se usa el calibrado con --calibrar.
+    """
+    valor = os.getenv("RAG_UMBRAL_RELEVANCIA")
+    if valor:
+        return float(valor)
+    if os.path.exists(archivo):
+        with open(archivo, "r", encoding="utf-8") as f:
+            return json.load(f).get("umbral")
+    return None
+
+def normalizar_pregunta(pregunta):
+    """Forma canónica para detectar preguntas repetidas (mayúsculas, tildes, espacios, signos finales)"""
+    sin_tildes = "".join(
+        c for c in unicodedata.normalize("NFKD", pregunta) if not unicodedata.combining(c)
+    )
+    return " ".join(sin_tildes.lower().split()).strip("¿?¡!. ")
+
+def leer_preguntas(ruta):
+    """Lee preguntas en streaming: texto plano (una por línea) o JSONL
+
+    En JSONL cada línea es {"pregunta": ..., "id": ..., "filtro": ...}; id y filtro son opcionales.
+    Las líneas JSON inválidas o sin "pregunta" se omiten con un aviso.
+    """
+    with open(ruta, "r", encoding="utf-8") as f:
+        for numero, linea in enumerate(f, 1):
+            linea = linea.strip()
+            if not linea:
+                continue
+            if linea.startswith("{"):
+                try:
+                    datos = json.loads(linea)
+                except ValueError as e:
+                    print(f"⚠️ Línea {numero}: JSON inválido ({e}), se omite")
+                    continue
+                if not isinstance(datos.get("pregunta"), str) or not datos["pregunta"].strip():
+                    print(f"⚠️ Línea {numero}: sin \"pregunta\", se omite")
+                    continue
+                datos.setdefault("id", numero)
+                yield datos
+            else:
+                yield {"id": numero, "pregunta": linea}
+
+def fusionar_resultados(listas, metodo="rrf", k=60):
+    """Fusiona resultados de varios índices en un solo ranking
+
+    - rrf: Reciprocal Rank Fusion (solo usa posiciones, robusto a escalas distintas)
+    - normalizado: puntajes min-max por índice; si un chunk aparece en varios se queda el mayor
+    """
+    documentos = {}
+    if metodo == "rrf":
+        claves = []
+        for nombre, resultados in listas:
+            lista = []
+            for r in resultados:
+                clave = r.get("id") or f"{nombre}:{len(lista)}"
+                documentos.setdefault(clave, dict(r, shard=nombre))
+                lista.append(clave)
+            claves.append(lista)
+        puntajes = fusion_rrf(claves, k=k)
+    else:
+        puntajes = {}
+        for nombre, resultados in listas:
+            valores = [r.get("@search.score") or 0.0 for r in resultados]
+            if not valores:
+                continue
+            minimo, maximo = min(valores), max(valores)
+            for i, (r, v) in enumerate(zip(resultados, valores)):
+                clave = r.get("id") or f"{nombre}:{i}"
+                normalizado = (v - minimo) / (maximo - minimo) if maximo > minimo else 1.0
+                if normalizado >= puntajes.get(clave, -1.0):
+                    puntajes[clave] = normalizado
+                    documentos[clave] = dict(r, shard=nombre)
+
+    orden = sorted(puntajes, key=puntajes.get, reverse=True)
+    return [dict(documentos[c], **{"@search.score": puntajes[c]}) for c in orden]
+
+def construir_mensajes(pregunta, contextos):
+    """Mensajes del chat: instrucciones + contexto citado + pregunta"""
+    # Construir el contexto
+    contexto_texto = "\n\n".join([
+        f"[Fuente: {ctx['source']}, Página {ctx['page']}]\n{ctx['content']}"
+        for ctx in contextos
+    ])
+    
+    return [
+        {
+            "role": "system",
+            "content": """Eres un asistente experto que responde preguntas basándote ÚNICAMENTE 
+            en el contexto proporcionado. Si la información no está en el contexto, 
+            indica claramente que no tienes esa información. 
+            Cita las fuentes cuando sea relevante."""
+        },
+        {
+            "role": "user",
+            "content": f"""Contexto de los documentos:
+{contexto_texto}
+
+Pregunta: {pregunta}
+
+Por favor, proporciona una respuesta completa y precisa basándote en el contexto anterior."""
+        }
+    ]
+
+def listar_fuentes(contextos):
+    """'documento (pág. N)' únicos, en el orden de los contextos"""
+    fuentes = []
+    for ctx in contextos:
+        fuente_info = f"{ctx['source']} (pág. {ctx['page']})"
+        if fuente_info not in fuentes:
+            fuentes.append(fuente_info)
+    return fuentes
+
+
+def respuesta_parcial(contextos, max_fragmentos=3, longitud=300):
+    """Respuesta sin generar cuando se agota el plazo: los fragmentos más relevantes, recortados"""
+    lineas = ["⏱️ No hubo tiempo para generar la respuesta. Fragmentos más relevantes:"]
+    for ctx in contextos[:max_fragmentos]:
+        texto = " ".join(ctx["content"].split())
+        if len(texto) > longitud:
+            texto = texto[:longitud].rsplit(" ", 1)[0] + "…"
+        lineas.append(f"• {ctx['source']} (pág. {ctx['page']}): {texto}")
+    return "\n".join(lineas), listar_fuentes(contextos[:max_fragmentos])
+
 class ConsultorRAG:
-    def __init__(self):
-        """Inicializa conexiones con Azure"""
+    def __init__(self, indices=None, clase="interactiva"):
+        """Inicializa conexiones con Azure
+
+        indices: lista de nombres de índice, rutas 'local:<ruta>' de índices
+        locales guardados, 'snapshot:<carpeta>' o clientes ya construidos. Por defecto se lee
+        AZURE_SEARCH_INDEX_NAMES (separados por coma) o AZURE_SEARCH_INDEX_NAME_V2.
+        """
         print("🔌 Conectando al sistema RAG...")
         
-        # Cliente de OpenAI
-        self.openai_client = AzureOpenAI(
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-            api_key=os.getenv("AZURE_OPENAI_KEY"),
-            api_version="2024-02-15-preview"
-        )
+        # Cliente de OpenAI (o pool de despliegues si AZURE_OPENAI_POOL está configurado)
+        self.openai_client = crear_cliente_openai()
         
-        # Cliente de búsqueda
-        self.search_client = SearchClient(
-            endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"),
-            index_name=os.getenv("AZURE_SEARCH_INDEX_NAME_V2"),
-            credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_KEY"))
-        )
+        # Clientes de búsqueda (uno por índice/shard)
+        self.shards = self.crear_shards(indices)
+        self.search_client = next(iter(self.shards.values()))
+        self.campos_shard = self.obtener_campos_shards() if len(self.shards) > 1 else {}
+        self.fusion = os.getenv("RAG_FUSION", "rrf")
+        self.timeout_shard = float(os.getenv("RAG_TIMEOUT_SHARD", "5"))
+        self.executor = ThreadPoolExecutor(max_workers=max(4, len(self.shards)))
+        
+        # Selección diversa (MMR) sobre un conjunto ampliado de candidatos
+        self.diversidad = os.getenv("RAG_DIVERSIDAD", "0") == "1"
+        self.candidatos_mmr = int(os.getenv("RAG_CANDIDATOS_MMR", "30"))
+        self.lambda_mmr = float(os.getenv("RAG_LAMBDA_MMR", "0.5"))
+        self.max_tokens_contexto = int(os.getenv("RAG_MAX_TOKENS_CONTEXTO", "1500"))
+        
+        # Profundidad según el salto de similitudes y umbral para no llamar al modelo
+        self.profundidad_adaptativa = os.getenv("RAG_PROFUNDIDAD_ADAPTATIVA", "0") == "1"
+        self.profundidad_min = int(os.getenv("RAG_PROFUNDIDAD_MIN", "2"))
+        self.profundidad_max = int(os.getenv("RAG_PROFUNDIDAD_MAX", "8"))
+        self.umbral_relevancia = cargar_umbral_relevancia()
+        
+        # Ampliación local de cada fragmento con sus chunks vecinos (0 = desactivada)
+        self.ventana_vecinos = int(os.getenv("RAG_VENTANA_VECINOS", "0"))
+        self.almacen = AlmacenChunks() if self.ventana_vecinos else None
+        
+        # Enrutado en dos etapas: primero documentos, luego chunks dentro de ellos
+        self.max_fuentes = int(os.getenv("RAG_MAX_FUENTES", "3"))
+        self.enrutador = None
+        if os.getenv("RAG_ENRUTADO", "0") == "1" and len(self.shards) == 1:
+            self.enrutador = EnrutadorFuentes(next(iter(self.shards)))
+        
+        # Precarga en memoria del documento filtrado (ver precargar_documento)
+        self.precarga_activa = os.getenv("RAG_PRECARGA", "1") == "1"
+        self.max_chunks_precarga = int(os.getenv("RAG_PRECARGA_MAX_CHUNKS", "20000"))
+        self.documento_precargado = None
+        self.precarga = None
+        self.consultas_precarga = 0
+        
+        # Turnos compartidos con otros procesos (RAG_PLANIFICADOR_TPM): las
+        # preguntas interactivas pasan antes que los lotes y la carga de PDFs
+        self.planificador = Planificador()
+        
+        # Tokens y costo por consulta, ejecución y sesión (con presupuestos)
+        self.consumo = RegistroConsumo(planificador=self.planificador, clase=clase)
+        
+        # Perfilado opcional por etapas (RAG_PERFILADO=1)
+        self.perfil = Perfilador("consultar")
+        
+        # Llamadas idénticas simultáneas comparten una sola petición a Azure
+        self.vuelos = UnVuelo()
+        
+        # Plazo por consulta (0 = sin plazo) y respaldo de embeddings y búsquedas lentas
+        self.plazo_consulta = float(os.getenv("RAG_PLAZO_CONSULTA", "30"))
+        self.cobertura = Cobertura()
         
         # Archivo para guardar historial
         self.historial_file = f"historial_consultas_{datetime.now().strftime('%Y%m%d')}.txt"
@@ -40,6 +297,50 @@ class ConsultorRAG:
         # Verificar conexión
         self.verificar_conexion()
         
+    def crear_shards(self, indices=None):
+        """Crea un cliente por índice a consultar"""
+        if indices is None:
+            nombres = os.getenv("AZURE_SEARCH_INDEX_NAMES")
+            if nombres:
+                indices = [n.strip() for n in nombres.split(",") if n.strip()]
+            else:
+                indices = [os.getenv("AZURE_SEARCH_INDEX_NAME_V2")]
+        
+        shards = {}
+        for indice in indices:
+            if not isinstance(indice, str):
+                shards[getattr(indice, "nombre", f"shard-{len(shards)}")] = indice
+            elif indice.startswith("local:"):
+                shards[indice] = IndiceLocal.cargar(indice[len("local:"):])
+            elif indice.startswith("snapshot:"):
+                shards[indice] = cargar_snapshot_local(indice[len("snapshot:"):])
+            else:
+                shards[indice] = SearchClient(
+                    endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"),
+                    index_name=indice,
+                    credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_KEY"))
+                )
+        return shards
+    
+    def obtener_campos_shards(self):
+        """Campos de cada índice, para no pedir en `select` campos que no existen (p. ej. 'source')"""
+        campos = {}
+        index_client = None
+        for nombre, cliente in self.shards.items():
+            try:
+                if hasattr(cliente, "campos"):
+                    campos[nombre] = set(cliente.campos())
+                else:
+                    if index_client is None:
+                        index_client = SearchIndexClient(
+                            endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"),
+                            credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_KEY"))
+                        )
+                    campos[nombre] = {f.name for f in index_client.get_index(nombre).fields}
+            except Exception as e:
+                print(f"⚠️ No se pudo leer el esquema de '{nombre}': {e}")
+        return campos
+    
     def verificar_conexion(self):
         """Verifica que hay documentos en el índice"""
         try:
@@ -80,28 +381,115 @@ class ConsultorRAG:
         """Guarda la pregunta y respuesta en el historial"""
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
+        # Una sola escritura por entrada: las consultas en paralelo del lote no se mezclan
         with open(self.historial_file, "a", encoding="utf-8") as f:
-            f.write(f"\n{'='*60}\n")
-            f.write(f"Fecha: {timestamp}\n")
-            f.write(f"Pregunta: {pregunta}\n")
-            f.write(f"Respuesta: {respuesta}\n")
-            f.write(f"Fuentes: {', '.join(fuentes)}\n")
-            f.write(f"{'='*60}\n")
+            f.write(
+                f"\n{'='*60}\n"
+                f"Fecha: {timestamp}\n"
+                f"Pregunta: {pregunta}\n"
+                f"Respuesta: {respuesta}\n"
+                f"Fuentes: {', '.join(fuentes)}\n"
+                f"{'='*60}\n"
+            )
+    
+    def generar_embedding(self, texto, plazo=SIN_PLAZO):
+        """Genera el embedding de un texto (con respaldo si tarda más de lo habitual)"""
+        embedding_response = self.vuelos.ejecutar("embedding", texto, lambda: self.cobertura.ejecutar(
+            "embedding",
+            lambda intento: self.consumo.medir(
+                "embedding",
+                lambda: self.openai_client.embeddings.create(
+                    input=texto,
+                    model=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT"),
+                    **opciones_timeout(intento.enviar(), "timeout")
+                ),
+                estimar_tokens(texto),
+                consulta=texto,
+                plazo=intento.plazo
+            ),
+            plazo
+        ))
+        return embedding_response.data[0].embedding
+    
+    def generar_embeddings_lote(self, textos, tamano_lote=None):
+        """Genera embeddings para muchos textos con pocas llamadas (respeta el orden)"""
+        tamano_lote = tamano_lote or int(os.getenv("RAG_LOTE_EMBEDDINGS", "256"))
+        vectores = []
+        for i in range(0, len(textos), tamano_lote):
+            bloque = textos[i:i + tamano_lote]
+            respuesta = self.consumo.medir(
+                "embedding",
+                lambda: self.openai_client.embeddings.create(
+                    input=bloque,
+                    model=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+                ),
+                sum(estimar_tokens(t) for t in bloque)
+            )
+            vectores.extend(d.embedding for d in sorted(respuesta.data, key=lambda d: d.index))
+        return vectores
+    
+    def generar_embeddings_tolerante(self, textos, tamano_lote=None):
+        """Como generar_embeddings_lote, pero un error no detiene el lote
+
+        Si falla la llamada de un bloque (p. ej. un texto demasiado largo hace que
+        Azure rechace las 256 entradas, o un 5xx transitorio) sus textos se piden
+        de uno en uno; los que siguen fallando quedan como None.
+        """
+        tamano_lote = tamano_lote or int(os.getenv("RAG_LOTE_EMBEDDINGS", "256"))
+        vectores = []
+        for i in range(0, len(textos), tamano_lote):
+            bloque = textos[i:i + tamano_lote]
+            try:
+                vectores.extend(self.generar_embeddings_lote(bloque, tamano_lote))
+                continue
+            except PresupuestoExcedido:
+                raise
+            except Exception as e:
+                print(f"⚠️ Falló el lote de {len(bloque)} embeddings ({e}): se piden de uno en uno")
+            for texto in bloque:
+                try:
+                    vectores.append(self.generar_embedding(texto))
+                except PresupuestoExcedido:
+                    raise
+                except Exception as e:
+                    print(f"❌ Sin embedding para '{texto[:50]}': {e}")
+                    vectores.append(None)
+        return vectores
     
-    def buscar_contexto(self, pregunta, top_k=5, filtro_documento=None):
-        """Busca información relevante en el índice"""
+    def buscar_contexto(self, pregunta, top_k=5, filtro_documento=None, diversidad=None, vector=None,
+                        con_similitud=None, plazo=SIN_PLAZO):
+        """Busca información relevante en el índice
+
+        vector: embedding de la pregunta ya calculado (p. ej. en modo batch)
+        con_similitud: añade a cada contexto su coseno con la pregunta ('similitud');
+        por defecto, si lo necesitan la profundidad adaptativa o el umbral
+        plazo: Plazo de la consulta; si vence se lanza PlazoVencido
+        """
+        if diversidad is None:
+            diversidad = self.diversidad
+        adaptativa = self.profundidad_adaptativa
+        if con_similitud is None:
+            con_similitud = adaptativa or self.umbral_relevancia is not None
+        
         try:
             # Generar embedding de la pregunta
-            embedding_response = self.openai_client.embeddings.create(
-                input=pregunta,
-                model=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
-            )
-            pregunta_vector = embedding_response.data[0].embedding
+            with self.perfil.etapa("embedding"):
+                pregunta_vector = vector if vector is not None else self.generar_embedding(pregunta, plazo)
+            
+            # En modo diverso se piden más candidatos (con sus vectores) y se filtran localmente
+            n_resultados = top_k
+            if diversidad:
+                n_resultados = max(top_k, self.candidatos_mmr)
+            elif adaptativa:
+                n_resultados = max(top_k, self.profundidad_max)
+            campos = ["id", "content", "page", "source"]
+            if diversidad or con_similitud:
+                campos.append("content_vector")
             
             # Crear consulta vectorial
             vector_query = VectorizedQuery(
                 vector=pregunta_vector,
-                k_nearest_neighbors=top_k,
+                k_nearest_neighbors=n_resultados,
                 fields="content_vector"
             )
             
@@ -109,109 +497,301 @@ class ConsultorRAG:
             filter_str = None
             if filtro_documento:
                 filter_str = f"source eq '{filtro_documento}'"
+            elif self.enrutador is not None:
+                fuentes = self.rutear(pregunta_vector)
+                if fuentes:
+                    filter_str = filtro_fuentes(fuentes)
             
-            # Realizar búsqueda híbrida
-            results = self.search_client.search(
+            # Realizar búsqueda híbrida (en memoria si el documento filtrado está precargado)
+            busqueda = dict(
                 search_text=pregunta,
                 vector_queries=[vector_query],
                 filter=filter_str,
-                select=["content", "page", "source"],
-                top=top_k
+                select=campos,
+                top=n_resultados
             )
+            if self.precarga is not None and filtro_documento == self.documento_precargado:
+                self.consultas_precarga += 1
+                results = self.precarga.search(**busqueda)
+            else:
+                results = self.buscar_en_shards(plazo=plazo, **busqueda)
+                if not results and filter_str is not None and not filtro_documento:
+                    # Enrutado desactualizado (p. ej. documentos borrados o migrados): todo el índice
+                    print("⚠️ Sin resultados en los documentos enrutados, se busca en todo el índice")
+                    busqueda["filter"] = None
+                    results = self.buscar_en_shards(plazo=plazo, **busqueda)
             
             # Recopilar resultados
             contextos = []
+            vectores = []
             for result in results:
                 contextos.append({
+                    "id": result.get("id"),
                     "content": result["content"],
-                    "page": result["page"],
-                    "source": result.get("source", "documento")
+                    "page": result.get("page"),
+                    "source": result.get("source") or "documento"
                 })
+                if diversidad or con_similitud:
+                    vectores.append(result["content_vector"])
+            
+            if con_similitud and contextos:
+                for ctx, similitud in zip(contextos, similitudes_coseno(pregunta_vector, vectores)):
+                    ctx["similitud"] = float(similitud)
+            
+            # Menos fragmentos si hay un salto claro de similitud, más si es plana
+            if adaptativa and contextos:
+                similitudes = [c["similitud"] for c in contextos]
+                top_k = profundidad_adaptativa(similitudes, self.profundidad_min, self.profundidad_max)
+                if not diversidad:
+                    corte = sorted(similitudes, reverse=True)[top_k - 1]
+                    contextos = [c for c in contextos if c["similitud"] >= corte][:top_k]
+            
+            if diversidad and contextos:
+                elegidos = seleccionar_mmr(
+                    pregunta_vector,
+                    vectores,
+                    k=top_k,
+                    lambda_mmr=self.lambda_mmr,
+                    costos=[estimar_tokens(c["content"]) for c in contextos],
+                    presupuesto=self.max_tokens_contexto
+                )
+                contextos = [contextos[i] for i in elegidos]
+            
+            if self.almacen is not None:
+                contextos = self.almacen.expandir(contextos, self.ventana_vecinos,
+                                                  presupuesto=self.max_tokens_contexto, costo=estimar_tokens)
             
             return contextos
             
+        except (PresupuestoExcedido, PlazoVencido):
+            raise
         except Exception as e:
             print(f"❌ Error en la búsqueda: {e}")
             return []
     
-    def generar_respuesta(self, pregunta, contextos):
-        """Genera una respuesta usando GPT-4o"""
-        if not contextos:
-            return "No encontré información relevante para responder tu pregunta.", []
-        
-        # Construir el contexto
-        contexto_texto = "\n\n".join([
-            f"[Fuente: {ctx['source']}, Página {ctx['page']}]\n{ctx['content']}"
-            for ctx in contextos
-        ])
-        
-        # Preparar mensajes
-        messages = [
-            {
-                "role": "system",
-                "content": """Eres un asistente experto que responde preguntas basándote ÚNICAMENTE 
-                en el contexto proporcionado. Si la información no está en el contexto, 
-                indica claramente que no tienes esa información. 
-                Cita las fuentes cuando sea relevante."""
-            },
-            {
-                "role": "user",
-                "content": f"""Contexto de los documentos:
-{contexto_texto}
+    def precargar_documento(self, documento):
+        """Copia a un IndiceLocal los chunks y vectores de un documento
 
-Pregunta: {pregunta}
-
-Por favor, proporciona una respuesta completa y precisa basándote en el contexto anterior."""
-            }
-        ]
+        Mientras el filtro siga activo, las preguntas sobre ese documento se
+        resuelven en memoria (BM25 + coseno) sin ida y vuelta a Azure AI Search;
+        solo se sigue pidiendo el embedding de la pregunta. Devuelve los chunks
+        precargados (0 si el documento no existe o es demasiado grande).
+        """
+        self.liberar_precarga()
+        if not self.precarga_activa:
+            return 0
         
+        inicio = time.perf_counter()
+        filtro = f"source eq '{escapar_odata(documento)}'"
+        campos = ["id", "content", "page", "source", "content_vector"]
+        chunks = {}
         try:
-            # Generar respuesta
-            response = self.openai_client.chat.completions.create(
-                model=os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT"),
-                messages=messages,
-                temperature=0.3,
-                max_tokens=800
+            for nombre, cliente in self.shards.items():
+                campos_shard = self.campos_shard.get(nombre)
+                if campos_shard is not None and "source" not in campos_shard:
+                    continue  # no puede filtrar por documento
+                for pagina in recorrer_paginas(cliente, select=campos, campo_particion=None, filtro=filtro):
+                    for chunk in pagina:
+                        if chunk.get("content_vector") is not None:
+                            chunks[chunk["id"]] = {k: chunk.get(k) for k in campos}
+                    if len(chunks) > self.max_chunks_precarga:
+                        print(f"⚠️ '{documento}' tiene más de {self.max_chunks_precarga} chunks: "
+                              f"se sigue buscando en el índice")
+                        return 0
+        except Exception as e:
+            print(f"⚠️ No se pudo precargar '{documento}', se busca en el índice: {e}")
+            return 0
+        
+        if not chunks:
+            return 0
+        
+        dimensiones = len(next(iter(chunks.values()))["content_vector"])
+        self.precarga = IndiceLocal(nombre=f"precarga:{documento}", dimensiones=dimensiones)
+        self.precarga.upload_documents(list(chunks.values()))
+        self.documento_precargado = documento
+        print(f"📥 {len(chunks)} chunks de '{documento}' precargados en "
+              f"{time.perf_counter() - inicio:.1f}s: las preguntas se responden en local")
+        return len(chunks)
+    
+    def liberar_precarga(self):
+        """Descarta el documento precargado (al quitar o cambiar el filtro)"""
+        if self.precarga is None:
+            return
+        print(f"🧹 Precarga de '{self.documento_precargado}' liberada "
+              f"({self.consultas_precarga} búsquedas en local)")
+        self.precarga = None
+        self.documento_precargado = None
+        self.consultas_precarga = 0
+    
+    def rutear(self, pregunta_vector):
+        """Documentos más relevantes para la pregunta ([] = buscar en todo el índice)"""
+        try:
+            return self.enrutador.rutear(pregunta_vector, self.max_fuentes)
+        except Exception as e:
+            print(f"⚠️ Enrutado no disponible, se busca en todo el índice: {e}")
+            return []
+    
+    def buscar_en_shards(self, top=5, plazo=SIN_PLAZO, **kwargs):
+        """Ejecuta la búsqueda en todos los índices en paralelo y fusiona los resultados
+
+        Un índice que no responde dentro de timeout_shard (o del plazo de la
+        consulta, si es menor) se omite para no bloquear la respuesta.
+        """
+        if len(self.shards) == 1:
+            return self.buscar_en_shard(next(iter(self.shards)), self.search_client, dict(kwargs, top=top), plazo)
+        
+        futuros = {}
+        for nombre, cliente in self.shards.items():
+            argumentos = dict(kwargs, top=top)
+            if argumentos.get("select"):
+                argumentos["select"] = list(dict.fromkeys(argumentos["select"] + ["id"]))
+            campos = self.campos_shard.get(nombre)
+            if campos is not None:
+                if argumentos.get("filter") and "source" not in campos:
+                    continue  # no puede filtrar por documento
+                if argumentos.get("select"):
+                    argumentos["select"] = [c for c in argumentos["select"] if c in campos]
+            futuros[self.executor.submit(self.buscar_en_shard, nombre, cliente, argumentos, plazo)] = nombre
+        
+        restante = plazo.restante()
+        timeout = self.timeout_shard if restante is None else min(self.timeout_shard, restante)
+        hechos, pendientes = wait(futuros, timeout=timeout)
+        for futuro in pendientes:
+            futuro.cancel()
+            print(f"⚠️ El índice '{futuros[futuro]}' no respondió en {timeout:.1f}s, se omite")
+        if not hechos:
+            plazo.comprobar("search")
+        
+        listas = []
+        for futuro in hechos:
+            try:
+                listas.append((futuros[futuro], futuro.result()))
+            except PlazoVencido:
+                print(f"⚠️ El índice '{futuros[futuro]}' no respondió dentro del plazo, se omite")
+            except Exception as e:
+                print(f"⚠️ Error en el índice '{futuros[futuro]}': {e}")
+        
+        return fusionar_resultados(listas, metodo=self.fusion)[:top]
+    
+    def buscar_en_shard(self, nombre, cliente, argumentos, plazo=SIN_PLAZO):
+        """Búsqueda en un índice; búsquedas idénticas en curso comparten la petición
+
+        Si tarda más de lo habitual sale una segunda petición igual (ver plazos.py).
+        """
+        return self.vuelos.ejecutar(
+            "search",
+            clave_llamada(nombre, argumentos),
+            lambda: self.cobertura.ejecutar(
+                "search",
+                lambda intento: list(cliente.search(
+                    **argumentos, **opciones_timeout(intento.enviar(), "timeout", "read_timeout")
+                )),
+                plazo
             )
+        )
+    
+    def generar_respuesta(self, pregunta, contextos, plazo=SIN_PLAZO):
+        """Genera una respuesta usando GPT-4o (PlazoVencido si no termina a tiempo)"""
+        if not contextos:
+            return SIN_INFORMACION, []
+        
+        messages = construir_mensajes(pregunta, contextos)
+        
+        try:
+            # Generar respuesta (se reservan el prompt estimado y el máximo de salida)
+            # El chat no se cubre con una segunda petición: solo se limita al plazo
+            response = self.vuelos.ejecutar("chat", clave_llamada(messages), lambda: self.cobertura.ejecutar(
+                "chat",
+                lambda intento: self.consumo.medir(
+                    "chat",
+                    lambda: self.openai_client.chat.completions.create(
+                        model=os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT"),
+                        messages=messages,
+                        temperature=0.3,
+                        max_tokens=800,
+                        **opciones_timeout(intento.enviar(), "timeout")
+                    ),
+                    sum(estimar_tokens(m["content"]) for m in messages) + 800,
+                    consulta=pregunta,
+                    plazo=intento.plazo
+                ),
+                plazo,
+                cubrir=False
+            ))
             
             respuesta = response.choices[0].message.content
             
             # Obtener fuentes únicas
-            fuentes = []
-            for ctx in contextos:
-                fuente_info = f"{ctx['source']} (pág. {ctx['page']})"
-                if fuente_info not in fuentes:
-                    fuentes.append(fuente_info)
-            
-            return respuesta, fuentes
+            return respuesta, listar_fuentes(contextos)
             
+        except (PresupuestoExcedido, PlazoVencido):
+            raise
         except Exception as e:
             print(f"❌ Error generando respuesta: {e}")
             return "Error al generar la respuesta.", []
     
-    def consultar(self, pregunta, filtro_documento=None):
-        """Proceso completo de consulta"""
+    def consultar(self, pregunta, filtro_documento=None, vector=None):
+        """Proceso completo de consulta
+
+        Todo (embedding, búsqueda y chat) debe terminar dentro de RAG_PLAZO_CONSULTA
+        segundos; si el plazo vence con fragmentos ya encontrados se devuelve una
+        respuesta parcial con ellos ("parcial": True).
+        """
         print("\n🔍 Buscando información relevante...")
+        plazo = Plazo(self.plazo_consulta)
+        contextos = []
+        parcial = False
         
-        # Buscar contexto
-        contextos = self.buscar_contexto(pregunta, filtro_documento=filtro_documento)
-        
-        if not contextos:
-            print("❌ No se encontró información relevante")
+        try:
+            # Buscar contexto
+            with self.perfil.etapa("busqueda"):
+                contextos = self.buscar_contexto(
+                    pregunta, filtro_documento=filtro_documento, vector=vector, plazo=plazo
+                )
+            
+            if not contextos:
+                print("❌ No se encontró información relevante")
+                return None
+            
+            print(f"✅ Encontrados {len(contextos)} fragmentos relevantes")
+            
+            mejor = max((c.get("similitud", 1.0) for c in contextos), default=0.0)
+            if self.umbral_relevancia is not None and mejor < self.umbral_relevancia:
+                # Ningún fragmento es lo bastante parecido: no vale la pena llamar al modelo
+                print(f"⏭️ Mejor similitud {mejor:.3f} < umbral {self.umbral_relevancia:.3f}: "
+                      f"se responde sin generar")
+                respuesta, fuentes = SIN_INFORMACION, []
+            else:
+                print("🤖 Generando respuesta...")
+                
+                # Generar respuesta
+                with self.perfil.etapa("respuesta"):
+                    respuesta, fuentes = self.generar_respuesta(pregunta, contextos, plazo)
+        except PresupuestoExcedido as e:
+            print(f"⛔ Consulta rechazada: {e}")
             return None
+        except PlazoVencido as e:
+            print(f"⏱️ {e}")
+            if not contextos:
+                return None
+            print("✂️ Se devuelve una respuesta parcial con los fragmentos encontrados")
+            respuesta, fuentes = respuesta_parcial(contextos)
+            parcial = True
+        finally:
+            consumo = self.consumo.por_consulta.pop(pregunta, None)
+            self.consumo.guardar()
         
-        print(f"✅ Encontrados {len(contextos)} fragmentos relevantes")
-        print("🤖 Generando respuesta...")
-        
-        # Generar respuesta
-        respuesta, fuentes = self.generar_respuesta(pregunta, contextos)
+        if consumo:
+            print(f"💰 {self.consumo.resumen(consumo)}")
         
         # Guardar en historial
         self.guardar_historial(pregunta, respuesta, fuentes)
         
         return {
             "respuesta": respuesta,
-            "fuentes": fuentes
+            "fuentes": fuentes,
+            "consumo": consumo,
+            "parcial": parcial
         }
 
 def modo_interactivo():
@@ -226,6 +806,8 @@ def modo_interactivo():
     print("  • 'historial' - Ver preguntas anteriores")
     print("  • 'documentos' - Ver documentos disponibles")
     print("  • 'filtrar:nombre.pdf' - Buscar solo en un documento específico")
+    print("  • 'quitar filtro' - Volver a buscar en todos los documentos")
+    print("  • 'diversidad' - Activar/desactivar selección diversa (MMR) de fragmentos")
     print("\n")
     
     filtro_activo = None
@@ -241,6 +823,11 @@ def modo_interactivo():
         if pregunta.lower() == 'salir':
             print("\n👋 ¡Hasta luego!")
             print(f"📝 Historial guardado en: {consultor.historial_file}")
+            print(f"💰 Consumo de la ejecución: {consultor.consumo.resumen()}")
+            print(f"🔗 Llamadas en vuelo compartidas: {consultor.vuelos.resumen()}")
+            print(f"🛡️ Plazos y respaldos: {consultor.cobertura.resumen()}")
+            if consultor.planificador.activo:
+                print(f"⏳ Espera en cola: {consultor.planificador.resumen()}")
             break
             
         elif pregunta.lower() == 'historial':
@@ -259,12 +846,20 @@ def modo_interactivo():
         elif pregunta.lower().startswith('filtrar:'):
             filtro_activo = pregunta.split(':', 1)[1].strip()
             print(f"✅ Filtro activado para: {filtro_activo}")
+            consultor.precargar_documento(filtro_activo)
             continue
             
         elif pregunta.lower() == 'quitar filtro':
             filtro_activo = None
+            consultor.liberar_precarga()
             print("✅ Filtro desactivado")
             continue
+            
+        elif pregunta.lower() == 'diversidad':
+            consultor.diversidad = not consultor.diversidad
+            estado = "activada" if consultor.diversidad else "desactivada"
+            print(f"✅ Selección diversa (MMR) {estado}")
+            continue
         
         # Realizar consulta
         resultado = consultor.consultar(pregunta, filtro_documento=filtro_activo)
@@ -279,9 +874,16 @@ def modo_interactivo():
                 print(f"   • {fuente}")
             print("-"*60)
 
-def modo_batch(preguntas_file):
-    """Procesa un archivo con múltiples preguntas"""
-    consultor = ConsultorRAG()
+def modo_batch(preguntas_file, tamano_bloque=256):
+    """Procesa un archivo con múltiples preguntas
+
+    Las preguntas se leen y escriben en streaming por bloques. En cada bloque
+    los embeddings se piden en lote y las preguntas repetidas (tras normalizar)
+    comparten embedding, búsqueda y respuesta. Con RAG_LOTE_CONCURRENCIA > 1 las
+    preguntas únicas del bloque se consultan en paralelo (la salida mantiene el orden).
+    Entrada .jsonl -> salida .jsonl; texto plano -> salida de texto como antes.
+    """
+    consultor = ConsultorRAG(clase="lote")
     
     if not os.path.exists(preguntas_file):
         print(f"❌ No se encuentra el archivo: {preguntas_file}")
@@ -289,32 +891,167 @@ def modo_batch(preguntas_file):
     
     print(f"\n📋 Procesando preguntas desde: {preguntas_file}")
     
-    with open(preguntas_file, "r", encoding="utf-8") as f:
-        preguntas = f.readlines()
+    salida_jsonl = preguntas_file.endswith(".jsonl")
+    extension = "jsonl" if salida_jsonl else "txt"
+    resultados_file = f"respuestas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
     
-    resultados_file = f"respuestas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+    # (pregunta normalizada, filtro) -> resultado ya calculado; LRU acotada para
+    # que la memoria no crezca con el tamaño del archivo
+    cache = OrderedDict()
+    max_cache = max(int(os.getenv("RAG_CACHE_RESPUESTAS", "10000")), tamano_bloque)
+    concurrencia = max(1, int(os.getenv("RAG_LOTE_CONCURRENCIA", "1")))
+    total_preguntas = 0
+    llamadas_embeddings = 0
+    busquedas = 0
     
-    with open(resultados_file, "w", encoding="utf-8") as f:
-        for i, pregunta in enumerate(preguntas, 1):
-            pregunta = pregunta.strip()
-            if not pregunta:
-                continue
-                
-            print(f"\n[{i}/{len(preguntas)}] Procesando: {pregunta[:50]}...")
-            resultado = consultor.consultar(pregunta)
+    def procesar_bloque(bloque, f):
+        nonlocal total_preguntas, llamadas_embeddings, busquedas
+        
+        # Preguntas nuevas y únicas del bloque
+        nuevas = {}
+        for item in bloque:
+            clave = (normalizar_pregunta(item["pregunta"]), item.get("filtro"))
+            if clave in cache:
+                cache.move_to_end(clave)  # no se expulsa mientras se procesa el bloque
+            elif clave not in nuevas:
+                nuevas[clave] = item["pregunta"]
+        
+        # Un solo lote de embeddings para todas ellas
+        vectores = {}
+        if nuevas:
+            lote = int(os.getenv("RAG_LOTE_EMBEDDINGS", "256"))
+            with consultor.perfil.etapa("embeddings_lote"):
+                vectores = dict(zip(nuevas, consultor.generar_embeddings_tolerante(list(nuevas.values()), lote)))
+            llamadas_embeddings += (len(nuevas) + lote - 1) // lote
+        
+        def resolver(clave, item):
+            if vectores[clave] is None:
+                return None  # sin embedding: la pregunta queda sin respuesta
+            return consultor.consultar(item["pregunta"], filtro_documento=item.get("filtro"), vector=vectores[clave])
+        
+        # Preguntas únicas en paralelo; se escriben después en el orden del archivo
+        calculados = {}
+        if concurrencia > 1 and len(nuevas) > 1:
+            primeros = {}
+            for item in bloque:
+                clave = (normalizar_pregunta(item["pregunta"]), item.get("filtro"))
+                if clave in nuevas:
+                    primeros.setdefault(clave, item)
+            with ThreadPoolExecutor(max_workers=concurrencia) as executor:
+                futuros = {clave: executor.submit(resolver, clave, item) for clave, item in primeros.items()}
+                calculados = {clave: futuro.result() for clave, futuro in futuros.items()}
+        
+        for item in bloque:
+            total_preguntas += 1
+            pregunta = item["pregunta"]
+            clave = (normalizar_pregunta(pregunta), item.get("filtro"))
             
-            if resultado:
+            print(f"\n[{total_preguntas}] Procesando: {pregunta[:50]}...")
+            if clave not in cache:
+                resultado = calculados.pop(clave) if clave in calculados else resolver(clave, item)
+                if vectores[clave] is not None:
+                    busquedas += 1
+                cache[clave] = resultado
+                if len(cache) > max_cache:
+                    cache.popitem(last=False)
+            else:
+                print("♻️ Pregunta repetida: se reutiliza la respuesta")
+                cache.move_to_end(clave)
+            resultado = cache[clave]
+            
+            if salida_jsonl:
+                f.write(json.dumps({
+                    "id": item["id"],
+                    "pregunta": pregunta,
+                    "respuesta": resultado["respuesta"] if resultado else None,
+                    "fuentes": resultado["fuentes"] if resultado else [],
+                    "consumo": resultado.get("consumo") if resultado else None,
+                    "parcial": resultado.get("parcial", False) if resultado else False
+                }, ensure_ascii=False) + "\n")
+            elif resultado:
                 f.write(f"\n{'='*60}\n")
-                f.write(f"PREGUNTA {i}: {pregunta}\n")
+                f.write(f"PREGUNTA {item['id']}: {pregunta}\n")
                 f.write(f"RESPUESTA: {resultado['respuesta']}\n")
                 f.write(f"FUENTES: {', '.join(resultado['fuentes'])}\n")
+            f.flush()
+    
+    with open(resultados_file, "w", encoding="utf-8") as f:
+        try:
+            bloque = []
+            for item in leer_preguntas(preguntas_file):
+                bloque.append(item)
+                if len(bloque) >= tamano_bloque:
+                    procesar_bloque(bloque, f)
+                    bloque = []
+            if bloque:
+                procesar_bloque(bloque, f)
+        except PresupuestoExcedido as e:
+            print(f"\n⛔ Lote detenido: {e}")
+        finally:
+            consultor.consumo.guardar()
     
+    if total_preguntas:
+        print(f"\n📊 {total_preguntas} preguntas, {busquedas} únicas | "
+              f"embeddings/pregunta: {llamadas_embeddings/total_preguntas:.3f} | "
+              f"búsquedas/pregunta: {busquedas/total_preguntas:.3f}")
+    print(f"💰 Consumo de la ejecución: {consultor.consumo.resumen()}")
+    print(f"🔗 Llamadas en vuelo compartidas: {consultor.vuelos.resumen()}")
+    print(f"🛡️ Plazos y respaldos: {consultor.cobertura.resumen()}")
+    if consultor.planificador.activo:
+        print(f"⏳ Espera en cola: {consultor.planificador.resumen()}")
     print(f"\n✅ Respuestas guardadas en: {resultados_file}")
 
+def calibrar_umbral(preguntas_file, tolerancia=0.05):
+    """Calibra RAG_UMBRAL_RELEVANCIA con preguntas etiquetadas (solo búsqueda, sin chat)
+
+    JSONL con {"pregunta": ..., "respondible": true/false} (o "esperado": [] para
+    las que no tienen respuesta en los documentos). El umbral deja fuera como
+    mucho `tolerancia` de las preguntas respondibles; se informa cuántas sin
+    respuesta se ahorrarían la llamada al modelo.
+    """
+    consultor = ConsultorRAG(clase="lote")
+    respondibles, sin_respuesta = [], []
+    
+    for item in leer_preguntas(preguntas_file):
+        contextos = consultor.buscar_contexto(
+            item["pregunta"], filtro_documento=item.get("filtro"), diversidad=False, con_similitud=True
+        )
+        mejor = max((c["similitud"] for c in contextos), default=0.0)
+        respondible = item.get("respondible", bool(item.get("esperado", True)))
+        (respondibles if respondible else sin_respuesta).append(mejor)
+    consultor.consumo.guardar()
+    
+    if not respondibles:
+        print("❌ Hacen falta preguntas respondibles para calibrar")
+        return None
+    
+    umbral = float(np.quantile(respondibles, tolerancia))
+    omitidas = sum(s < umbral for s in sin_respuesta)
+    calibracion = {
+        "umbral": round(umbral, 4),
+        "tolerancia": tolerancia,
+        "respondibles": len(respondibles),
+        "sin_respuesta": len(sin_respuesta),
+        "sin_respuesta_omitidas": omitidas,
+        "fecha": datetime.now().isoformat()
+    }
+    with open(ARCHIVO_CALIBRACION, "w", encoding="utf-8") as f:
+        json.dump(calibracion, f, indent=2, ensure_ascii=False)
+    
+    print(f"\n🎯 Umbral de relevancia: {umbral:.4f} "
+          f"(similitud máxima de las respondibles: p50 {np.median(respondibles):.3f})")
+    print(f"   • Respondibles que no pasarían: {sum(s < umbral for s in respondibles)}/{len(respondibles)}")
+    if sin_respuesta:
+        print(f"   • Sin respuesta que se ahorran el modelo: {omitidas}/{len(sin_respuesta)}")
+    print(f"💾 Guardado en {ARCHIVO_CALIBRACION} (RAG_UMBRAL_RELEVANCIA tiene prioridad)")
+    return calibracion
+
 if __name__ == "__main__":
     import sys
     
-    if len(sys.argv) > 1:
+    if len(sys.argv) > 2 and sys.argv[1] == "--calibrar":
+        calibrar_umbral(sys.argv[2])
+    elif len(sys.argv) > 1:
         # Modo batch: procesar archivo de preguntas
         modo_batch(sys.argv[1])
     else:
@@ -0,0 +1,280 @@
+"""
+consumo_tokens.py - Contabilidad de tokens y costo con presupuestos
+Registra los tokens de cada llamada (embeddings y chat), los agrega por documento,
+por consulta, por ejecución y por sesión (día), los persiste en JSON y aplica
+presupuestos: limita el ritmo (tokens por minuto) o rechaza el trabajo.
+El archivo lo comparten todos los procesos (consultas, batch, carga y
+vigilancia): cada guardado suma su parte bajo un bloqueo entre procesos y lo
+reescribe de forma atómica.
+Si se le da un planificador, cada llamada espera además su turno en la clase
+de prioridad del proceso (ver planificador.py).
+"""
+
+import os
+import json
+import time
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from planificador import SIN_TURNO
+from plazos import SIN_PLAZO
+
+
+def estimar_tokens(texto):
+    """Estimación rápida de tokens (~4 caracteres por token)"""
+    return len(texto) // 4 + 1
+
+
+class PresupuestoExcedido(Exception):
+    """Se alcanzó el presupuesto de tokens configurado"""
+
+
+@contextmanager
+def _bloqueo_archivo(ruta):
+    """Bloqueo exclusivo entre procesos sobre <ruta>.lock (fcntl en POSIX, msvcrt en Windows)"""
+    with open(f"{ruta}.lock", "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK se rinde a los 10 s: se sigue esperando
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _entero_env(nombre):
+    valor = os.getenv(nombre)
+    return int(valor) if valor else None
+
+
+class RegistroConsumo:
+    def __init__(self, archivo="consumo_tokens.json", sesion=None,
+                 limite_ejecucion=None, limite_sesion=None, limite_tpm=None,
+                 planificador=None, clase="interactiva"):
+        self.archivo = archivo
+        self.planificador = planificador
+        self.clase = clase
+        self.sesion = sesion or datetime.now().strftime("%Y%m%d")
+
+        # Presupuestos (None = sin límite)
+        self.limite_ejecucion = limite_ejecucion or _entero_env("RAG_PRESUPUESTO_TOKENS_EJECUCION")
+        self.limite_sesion = limite_sesion or _entero_env("RAG_PRESUPUESTO_TOKENS_SESION")
+        self.limite_tpm = limite_tpm or _entero_env("RAG_LIMITE_TPM")
+
+        # Precios por 1K tokens (USD), configurables
+        self.precios = {
+            "embedding": float(os.getenv("RAG_PRECIO_EMBEDDING_1K", "0.0001")),
+            "prompt": float(os.getenv("RAG_PRECIO_PROMPT_1K", "0.005")),
+            "completion": float(os.getenv("RAG_PRECIO_COMPLETION_1K", "0.015")),
+        }
+
+        self._lock = threading.Lock()
+        self._ventana = deque()  # (instante, tokens) del último minuto
+        self._reservado = 0      # tokens estimados de las llamadas en curso
+        self.ejecucion = self._vacio()
+        self.por_documento = defaultdict(self._vacio)
+        self.por_consulta = defaultdict(self._vacio)
+
+        self._latencias = {"embedding": {"ms": 0.0, "llamadas": 0}, "chat": {"ms": 0.0, "llamadas": 0}}
+        self._guardado = self._vacio()
+        self._latencias_guardadas = {t: dict(v) for t, v in self._latencias.items()}
+
+        self._historico = self._leer()
+        self._base_sesion = self._historico["sesiones"].get(self.sesion, self._vacio())
+
+    @staticmethod
+    def _vacio():
+        return {"embedding_tokens": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                "llamadas": 0, "latencia_ms": 0.0, "costo_usd": 0.0}
+
+    def _leer(self, apartar_corrupto=False):
+        """Histórico del archivo; uno ilegible se aparta (no se sobrescribe) si apartar_corrupto"""
+        if os.path.exists(self.archivo):
+            try:
+                with open(self.archivo, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except ValueError:
+                if apartar_corrupto:
+                    apartado = f"{self.archivo}.corrupto-{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+                    os.replace(self.archivo, apartado)
+                    print(f"⚠️ {self.archivo} ilegible: se aparta como {apartado} y se empieza de nuevo")
+            except OSError:
+                pass
+        return {"sesiones": {}, "total": self._vacio()}
+
+    # ------------------------------------------------------------ presupuesto
+    def total_tokens(self, agregado):
+        return agregado["embedding_tokens"] + agregado["prompt_tokens"] + agregado["completion_tokens"]
+
+    def reservar(self, tokens_estimados, plazo=SIN_PLAZO):
+        """Comprueba presupuestos y reserva la estimación antes de una llamada
+
+        Rechaza (PresupuestoExcedido) si se superaría el límite de la ejecución o
+        de la sesión contando lo reservado por las llamadas en curso; espera si se
+        superaría el límite de tokens por minuto (como mucho hasta que venza
+        `plazo`: PlazoVencido). La reserva se salda en registrar (o liberar).
+        """
+        with self._lock:
+            usados = self.total_tokens(self.ejecucion) + self._reservado
+            if self.limite_ejecucion and usados + tokens_estimados > self.limite_ejecucion:
+                raise PresupuestoExcedido(
+                    f"Presupuesto de la ejecución agotado ({usados}/{self.limite_ejecucion} tokens)"
+                )
+            sesion = self.total_tokens(self._base_sesion) + usados
+            if self.limite_sesion and sesion + tokens_estimados > self.limite_sesion:
+                raise PresupuestoExcedido(
+                    f"Presupuesto de la sesión {self.sesion} agotado ({sesion}/{self.limite_sesion} tokens)"
+                )
+            self._reservado += tokens_estimados
+
+        try:
+            self._esperar_tpm(tokens_estimados, plazo)
+        except BaseException:
+            self.liberar(tokens_estimados)
+            raise
+
+    def liberar(self, tokens_estimados):
+        """Devuelve una reserva cuya llamada no llegó a completarse"""
+        with self._lock:
+            self._reservado -= tokens_estimados
+
+    def _esperar_tpm(self, tokens_estimados, plazo):
+        if not self.limite_tpm:
+            return
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                while self._ventana and ahora - self._ventana[0][0] >= 60:
+                    self._ventana.popleft()
+                en_ventana = sum(t for _, t in self._ventana)
+                if not self._ventana or en_ventana + tokens_estimados <= self.limite_tpm:
+                    self._ventana.append((ahora, tokens_estimados))
+                    return
+                espera = 60 - (ahora - self._ventana[0][0])
+            plazo.comprobar("el límite de tokens por minuto")
+            restante = plazo.restante()
+            time.sleep(min(max(espera, 0.05), 5, 5 if restante is None else restante))
+
+    # --------------------------------------------------------------- registro
+    def registrar(self, tipo, usage, latencia_ms=0.0, documento=None, consulta=None, reservado=0):
+        """Registra el `usage` de una respuesta de Azure OpenAI ('embedding' o 'chat')
+
+        reservado: estimación reservada para esta llamada, que se cambia por el consumo real
+        """
+        if usage is None:
+            if reservado:
+                self.liberar(reservado)
+            return
+        prompt = getattr(usage, "prompt_tokens", 0) or 0
+        completion = getattr(usage, "completion_tokens", 0) or 0
+
+        delta = self._vacio()
+        delta["llamadas"] = 1
+        delta["latencia_ms"] = latencia_ms
+        if tipo == "embedding":
+            delta["embedding_tokens"] = prompt
+            delta["costo_usd"] = prompt / 1000 * self.precios["embedding"]
+        else:
+            delta["prompt_tokens"] = prompt
+            delta["completion_tokens"] = completion
+            delta["costo_usd"] = (prompt / 1000 * self.precios["prompt"]
+                                  + completion / 1000 * self.precios["completion"])
+
+        with self._lock:
+            self._reservado -= reservado
+            latencia = self._latencias["embedding" if tipo == "embedding" else "chat"]
+            latencia["ms"] += latencia_ms
+            latencia["llamadas"] += 1
+
+            destinos = [self.ejecucion]
+            if documento:
+                destinos.append(self.por_documento[documento])
+            if consulta:
+                destinos.append(self.por_consulta[consulta])
+            for agregado in destinos:
+                for clave, valor in delta.items():
+                    agregado[clave] += valor
+
+    def medir(self, tipo, llamada, tokens_estimados, documento=None, consulta=None, plazo=SIN_PLAZO):
+        """Reserva presupuesto, ejecuta la llamada y registra su consumo real
+
+        plazo: las esperas de cuota y de turno se abandonan al vencer (PlazoVencido)
+        """
+        self.reservar(tokens_estimados, plazo)
+        try:
+            if self.planificador is None:
+                turno = SIN_TURNO
+            else:
+                turno = self.planificador.turno(self.clase, tokens_estimados, plazo)
+            with turno as admitido:
+                inicio = time.perf_counter()
+                respuesta = llamada()
+                usage = getattr(respuesta, "usage", None)
+                admitido.ajustar(getattr(usage, "total_tokens", None))
+        except BaseException:
+            self.liberar(tokens_estimados)
+            raise
+        self.registrar(tipo, usage, (time.perf_counter() - inicio) * 1000, documento, consulta,
+                       reservado=tokens_estimados)
+        return respuesta
+
+    def latencia_media_ms(self, tipo="embedding"):
+        """Latencia media histórica por llamada (para estimaciones)"""
+        total = self._historico.get("latencias", {}).get(tipo)
+        return total["ms"] / total["llamadas"] if total and total["llamadas"] else None
+
+    # ------------------------------------------------------------ persistencia
+    def guardar(self):
+        """Acumula en el archivo lo consumido desde el último guardado (por sesión y total)
+
+        Leer, sumar y escribir ocurre bajo un bloqueo entre procesos; el archivo se
+        escribe en uno temporal que lo reemplaza, así nunca queda a medio escribir.
+        """
+        with self._lock, _bloqueo_archivo(self.archivo):
+            historico = self._leer(apartar_corrupto=True)
+            sesion = historico["sesiones"].setdefault(self.sesion, self._vacio())
+            for clave, valor in self.ejecucion.items():
+                delta = valor - self._guardado[clave]
+                sesion[clave] += delta
+                historico["total"][clave] = historico["total"].get(clave, 0) + delta
+
+            latencias = historico.setdefault("latencias", {})
+            for tipo, actual in self._latencias.items():
+                acumulado = latencias.setdefault(tipo, {"ms": 0.0, "llamadas": 0})
+                acumulado["ms"] += actual["ms"] - self._latencias_guardadas[tipo]["ms"]
+                acumulado["llamadas"] += actual["llamadas"] - self._latencias_guardadas[tipo]["llamadas"]
+
+            historico["actualizado"] = datetime.now().isoformat()
+            temporal = f"{self.archivo}.{os.getpid()}.tmp"
+            with open(temporal, "w", encoding="utf-8") as f:
+                json.dump(historico, f, indent=2, ensure_ascii=False)
+            os.replace(temporal, self.archivo)
+
+            # Lo que otras ejecuciones hayan sumado a la sesión cuenta para el presupuesto
+            self._historico = historico
+            self._base_sesion = {c: sesion[c] - self.ejecucion[c] for c in sesion}
+            self._guardado = dict(self.ejecucion)
+            self._latencias_guardadas = {t: dict(v) for t, v in self._latencias.items()}
+
+    def resumen(self, agregado=None):
+        """Texto corto con tokens y costo de un agregado (por defecto la ejecución)"""
+        a = agregado or self.ejecucion
+        return (f"{a['embedding_tokens']} tokens embedding, {a['prompt_tokens']} prompt, "
+                f"{a['completion_tokens']} completion, {a['llamadas']} llamadas, "
+                f"${a['costo_usd']:.4f}")
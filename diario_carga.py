@@ -0,0 +1,159 @@
+"""
+diario_carga.py - Diario persistente y reanudable de la carga de PDFs
+Registra por chunk su estado (extraido -> embebido -> subido) y guarda cada
+embedding en cuanto llega, en un SQLite en modo WAL. Si la carga se interrumpe,
+la siguiente ejecución retoma el documento sin volver a extraerlo ni a pagar
+por los embeddings ya generados.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+import numpy as np
+
+EXTRAIDO = "extraido"
+EMBEBIDO = "embebido"
+SUBIDO = "subido"
+
+# Resultado de CargadorPDF.cargar_pdf cuando quedan chunks sin subir (se reanuda)
+CARGA_INCOMPLETA = "incompleta"
+
+
+def firma_archivo(ruta):
+    """Tamaño y fecha de modificación: si cambian, el diario del documento no sirve"""
+    info = os.stat(ruta)
+    return f"{info.st_size}:{int(info.st_mtime)}"
+
+
+class DiarioCarga:
+    def __init__(self, ruta=None):
+        self.ruta = ruta or os.getenv("RAG_DIARIO_CARGA", "diario_carga.db")
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(self.ruta, check_same_thread=False)
+        with self._lock, self._conexion:
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute("PRAGMA synchronous=NORMAL")
+            self._conexion.execute(
+                "CREATE TABLE IF NOT EXISTS documentos ("
+                " source TEXT PRIMARY KEY, ruta TEXT, firma TEXT, completo INTEGER DEFAULT 0,"
+                " actualizado TEXT)"
+            )
+            self._conexion.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                " id TEXT PRIMARY KEY, source TEXT NOT NULL, ordinal INTEGER, estado TEXT NOT NULL,"
+                " datos TEXT NOT NULL, vector BLOB)"
+            )
+            self._conexion.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source, ordinal)")
+
+    def _ahora(self):
+        return datetime.now().isoformat()
+
+    # ------------------------------------------------------------- documentos
+    def pendiente(self, ruta):
+        """Chunks guardados de una carga incompleta del mismo archivo, o None"""
+        source = os.path.basename(ruta)
+        with self._lock:
+            fila = self._conexion.execute(
+                "SELECT firma, completo FROM documentos WHERE source = ?", (source,)
+            ).fetchone()
+        if fila is None or fila[1] or fila[0] != firma_archivo(ruta):
+            return None
+        chunks = self.chunks(source)
+        return chunks or None
+
+    def documentos_incompletos(self):
+        """Rutas de los documentos cuya carga quedó a medias"""
+        with self._lock:
+            return [r for (r,) in self._conexion.execute(
+                "SELECT ruta FROM documentos WHERE completo = 0 ORDER BY actualizado"
+            )]
+
+    def completado(self, ruta):
+        """True si el archivo (con esta misma versión) ya se cargó entero"""
+        with self._lock:
+            fila = self._conexion.execute(
+                "SELECT firma, completo FROM documentos WHERE source = ?", (os.path.basename(ruta),)
+            ).fetchone()
+        return bool(fila and fila[1] and fila[0] == firma_archivo(ruta))
+
+    def registrar_extraccion(self, ruta, chunks):
+        """Nueva carga del documento: reemplaza lo anterior y guarda los chunks extraídos"""
+        source = os.path.basename(ruta)
+        filas = []
+        for chunk in chunks:
+            datos = {k: v for k, v in chunk.items() if k != "content_vector"}
+            filas.append((chunk["id"], source, chunk.get("ordinal"), EXTRAIDO,
+                          json.dumps(datos, default=str, ensure_ascii=False)))
+        with self._lock, self._conexion:
+            self._conexion.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO documentos VALUES (?, ?, ?, 0, ?)",
+                (source, os.path.abspath(ruta), firma_archivo(ruta), self._ahora())
+            )
+            self._conexion.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, NULL)", filas)
+
+    def marcar_completo(self, source):
+        """Documento cargado entero: se libera el espacio de sus chunks y vectores"""
+        with self._lock, self._conexion:
+            self._conexion.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            self._conexion.execute(
+                "UPDATE documentos SET completo = 1, actualizado = ? WHERE source = ?",
+                (self._ahora(), source)
+            )
+
+    def olvidar(self, source):
+        with self._lock, self._conexion:
+            self._conexion.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            self._conexion.execute("DELETE FROM documentos WHERE source = ?", (source,))
+
+    def vaciar(self):
+        """Olvida todos los documentos (p. ej. tras limpiar el índice entero)"""
+        with self._lock, self._conexion:
+            self._conexion.execute("DELETE FROM chunks")
+            return self._conexion.execute("DELETE FROM documentos").rowcount
+
+    # ----------------------------------------------------------------- chunks
+    def marcar_embebido(self, chunk_id, vector):
+        """Guarda el embedding en cuanto llega (un commit por chunk)"""
+        datos = np.asarray(vector, dtype=np.float32).tobytes()
+        with self._lock, self._conexion:
+            self._conexion.execute(
+                "UPDATE chunks SET estado = ?, vector = ? WHERE id = ?", (EMBEBIDO, datos, chunk_id)
+            )
+            self._conexion.execute(
+                "UPDATE documentos SET actualizado = ? WHERE source ="
+                " (SELECT source FROM chunks WHERE id = ?)", (self._ahora(), chunk_id)
+            )
+
+    def marcar_subidos(self, ids):
+        with self._lock, self._conexion:
+            self._conexion.executemany(
+                "UPDATE chunks SET estado = ? WHERE id = ?", [(SUBIDO, i) for i in ids]
+            )
+
+    def chunks(self, source):
+        """Chunks del documento en orden, con 'content_vector' y '_estado' si ya se embebieron"""
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT estado, datos, vector FROM chunks WHERE source = ? ORDER BY ordinal", (source,)
+            ).fetchall()
+        chunks = []
+        for estado, datos, vector in filas:
+            chunk = json.loads(datos)
+            if chunk.get("fecha_carga"):
+                chunk["fecha_carga"] = datetime.fromisoformat(chunk["fecha_carga"])
+            if vector is not None:
+                chunk["content_vector"] = np.frombuffer(vector, dtype=np.float32).tolist()
+            chunk["_estado"] = estado
+            chunks.append(chunk)
+        return chunks
+
+    def progreso(self, source):
+        """Número de chunks por estado"""
+        with self._lock:
+            return dict(self._conexion.execute(
+                "SELECT estado, COUNT(*) FROM chunks WHERE source = ? GROUP BY estado", (source,)
+            ).fetchall())
@@ -0,0 +1,260 @@
+"""
+duplicados.py - Detección de chunks y documentos casi duplicados por contenido
+MinHash/LSH sobre `content` + similitud vectorial por bloques (SimHash) sobre `content_vector`.
+Nunca compara todos contra todos: solo los candidatos que comparten banda o cubeta.
+"""
+
+import os
+import re
+import zlib
+import tempfile
+from collections import defaultdict
+
+import numpy as np
+
+from recorrido_indice import recorrer_paginas
+
+# Primo de Mersenne 2^31 - 1: a * h cabe en uint64 sin desbordar
+_PRIMO = np.uint64((1 << 31) - 1)
+
+
+class UnionFind:
+    """Conjuntos disjuntos sobre índices enteros 0..n-1"""
+
+    def __init__(self, n):
+        self.padre = np.arange(n, dtype=np.int64)
+
+    def buscar(self, x):
+        raiz = x
+        while self.padre[raiz] != raiz:
+            raiz = self.padre[raiz]
+        while self.padre[x] != raiz:
+            self.padre[x], x = raiz, self.padre[x]
+        return raiz
+
+    def unir(self, a, b):
+        ra, rb = self.buscar(a), self.buscar(b)
+        if ra == rb:
+            return False
+        if ra > rb:
+            ra, rb = rb, ra
+        self.padre[rb] = ra
+        return True
+
+
+def normalizar_texto(texto):
+    """Minúsculas y espacios colapsados"""
+    return re.sub(r"\s+", " ", (texto or "").lower()).strip()
+
+
+def shingles(texto, k=3):
+    """Hashes (crc32) de los k-gramas de palabras del texto"""
+    palabras = normalizar_texto(texto).split(" ")
+    if len(palabras) <= k:
+        grams = [" ".join(palabras)]
+    else:
+        grams = [" ".join(palabras[i:i + k]) for i in range(len(palabras) - k + 1)]
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in set(grams)), dtype=np.uint64)
+
+
+class DetectorDuplicados:
+    """Encuentra clusters de chunks casi duplicados recorriendo el índice una sola vez"""
+
+    def __init__(self, search_client, num_permutaciones=64, bandas=16,
+                 umbral_texto=0.8, umbral_vector=0.97, tablas_simhash=4,
+                 bits_simhash=12, umbral_documento=0.8, dimensiones=1536, semilla=42):
+        if num_permutaciones % bandas:
+            raise ValueError("num_permutaciones debe ser múltiplo de bandas")
+
+        self.search_client = search_client
+        self.num_permutaciones = num_permutaciones
+        self.bandas = bandas
+        self.umbral_texto = umbral_texto
+        self.umbral_vector = umbral_vector
+        self.tablas_simhash = tablas_simhash
+        self.bits_simhash = bits_simhash
+        self.umbral_documento = umbral_documento
+        self.dimensiones = dimensiones
+
+        rng = np.random.default_rng(semilla)
+        self._a = rng.integers(1, int(_PRIMO), num_permutaciones, dtype=np.uint64)
+        self._b = rng.integers(0, int(_PRIMO), num_permutaciones, dtype=np.uint64)
+        self._hiperplanos = rng.standard_normal(
+            (dimensiones, tablas_simhash * bits_simhash)
+        ).astype(np.float32)
+
+    def firma_minhash(self, texto):
+        """Firma MinHash (num_permutaciones valores uint32) de un texto"""
+        h = shingles(texto) % _PRIMO
+        # (permutaciones x shingles) -> mínimo por permutación
+        valores = (np.outer(self._a, h) + self._b[:, None]) % _PRIMO
+        return valores.min(axis=1).astype(np.uint32)
+
+    def codigos_simhash(self, vectores):
+        """Código SimHash por tabla para un bloque de vectores normalizados"""
+        bits = (vectores @ self._hiperplanos) > 0
+        bits = bits.reshape(len(vectores), self.tablas_simhash, self.bits_simhash)
+        pesos = (1 << np.arange(self.bits_simhash, dtype=np.uint32))
+        return (bits * pesos).sum(axis=2).astype(np.uint32)
+
+    def _candidatos_por_clave(self, claves):
+        """Grupos de filas que comparten clave (ordenando, sin comparar todo contra todo)"""
+        orden = np.argsort(claves, kind="stable")
+        ordenadas = claves[orden]
+        inicios = np.flatnonzero(np.r_[True, ordenadas[1:] != ordenadas[:-1]])
+        fines = np.r_[inicios[1:], len(ordenadas)]
+        for ini, fin in zip(inicios, fines):
+            if fin - ini > 1:
+                yield orden[ini:fin]
+
+    def analizar(self, tamano_pagina=1000, max_workers=4, progreso=True):
+        """Recorre el índice y devuelve clusters de duplicados y pares de documentos duplicados"""
+        ids, fuentes, paginas = [], [], []
+        firmas = []
+        codigos = []
+        tmp = tempfile.NamedTemporaryFile(prefix="vectores_", suffix=".f16", delete=False)
+        n_vectores = 0
+        con_vector = []
+
+        try:
+            # 1. Streaming: firmas MinHash, códigos SimHash y vectores a disco (float16)
+            for pagina in recorrer_paginas(
+                self.search_client,
+                select=["id", "source", "page", "content", "content_vector"],
+                tamano_pagina=tamano_pagina,
+                max_workers=max_workers
+            ):
+                vecs = []
+                for doc in pagina:
+                    ids.append(doc["id"])
+                    fuentes.append(doc.get("source"))
+                    paginas.append(doc.get("page"))
+                    firmas.append(self.firma_minhash(doc.get("content", "")))
+                    vector = doc.get("content_vector")
+                    if vector is not None and len(vector) == self.dimensiones:
+                        vecs.append(vector)
+                        con_vector.append(len(ids) - 1)
+
+                if vecs:
+                    bloque = np.asarray(vecs, dtype=np.float32)
+                    bloque /= np.linalg.norm(bloque, axis=1, keepdims=True) + 1e-12
+                    codigos.append(self.codigos_simhash(bloque))
+                    tmp.write(bloque.astype(np.float16).tobytes())
+                    n_vectores += len(bloque)
+
+                if progreso:
+                    print(f"   Leídos {len(ids)} chunks...")
+            tmp.close()
+
+            n = len(ids)
+            uf = UnionFind(n)
+            pares_texto = 0
+            pares_vector = 0
+
+            # 2. LSH por bandas sobre las firmas MinHash
+            if n:
+                matriz = np.vstack(firmas)
+                filas = self.num_permutaciones // self.bandas
+                for banda in range(self.bandas):
+                    trozo = np.ascontiguousarray(matriz[:, banda * filas:(banda + 1) * filas])
+                    claves = np.frombuffer(trozo.tobytes(), dtype=f"V{trozo.shape[1] * 4}")
+                    for grupo in self._candidatos_por_clave(claves):
+                        lider = grupo[0]
+                        similitud = (matriz[grupo[1:]] == matriz[lider]).mean(axis=1)
+                        for miembro, s in zip(grupo[1:], similitud):
+                            if s >= self.umbral_texto and uf.unir(int(lider), int(miembro)):
+                                pares_texto += 1
+
+            # 3. Similitud coseno por bloques dentro de cada cubeta SimHash
+            if n_vectores:
+                vectores = np.memmap(tmp.name, dtype=np.float16, mode="r",
+                                     shape=(n_vectores, self.dimensiones))
+                codigos_todos = np.vstack(codigos)
+                posicion = np.asarray(con_vector)
+                for tabla in range(self.tablas_simhash):
+                    for grupo in self._candidatos_por_clave(codigos_todos[:, tabla]):
+                        pares_vector += self._comparar_bloque(vectores, grupo, posicion, uf)
+                del vectores
+        finally:
+            tmp.close()
+            os.unlink(tmp.name)
+
+        return self._construir_reporte(uf, ids, fuentes, paginas, pares_texto, pares_vector)
+
+    def _comparar_bloque(self, vectores, grupo, posicion, uf, tamano_bloque=2048):
+        """Producto punto por teselas dentro de una cubeta (memoria acotada aunque la cubeta sea grande)"""
+        unidos = 0
+        grupo = np.sort(grupo)
+        for i in range(0, len(grupo), tamano_bloque):
+            gi = grupo[i:i + tamano_bloque]
+            vi = np.asarray(vectores[gi], dtype=np.float32)
+            for j in range(i, len(grupo), tamano_bloque):
+                gj = grupo[j:j + tamano_bloque]
+                vj = vi if j == i else np.asarray(vectores[gj], dtype=np.float32)
+                sim = vi @ vj.T
+                if j == i:
+                    sim = np.triu(sim, k=1)
+                for a, b in zip(*np.nonzero(sim >= self.umbral_vector)):
+                    if uf.unir(int(posicion[gi[a]]), int(posicion[gj[b]])):
+                        unidos += 1
+        return unidos
+
+    def _construir_reporte(self, uf, ids, fuentes, paginas, pares_texto, pares_vector):
+        """Agrupa por raíz y deriva los documentos casi duplicados"""
+        grupos = defaultdict(list)
+        for i in range(len(ids)):
+            grupos[uf.buscar(i)].append(i)
+
+        clusters = []
+        for miembros in grupos.values():
+            if len(miembros) < 2:
+                continue
+            miembros.sort(key=lambda i: (fuentes[i] or "", paginas[i] or 0, ids[i]))
+            clusters.append([
+                {"id": ids[i], "source": fuentes[i], "page": paginas[i]}
+                for i in miembros
+            ])
+        clusters.sort(key=len, reverse=True)
+
+        # Documento A ~ B si la mayoría de los chunks de A tienen un duplicado en B
+        chunks_por_fuente = defaultdict(int)
+        for f in fuentes:
+            chunks_por_fuente[f] += 1
+        compartidos = defaultdict(int)
+        for cluster in clusters:
+            por_fuente = defaultdict(int)
+            for c in cluster:
+                por_fuente[c["source"]] += 1
+            for fa, na in por_fuente.items():
+                for fb in por_fuente:
+                    if fa != fb:
+                        compartidos[(fa, fb)] += na
+
+        documentos = []
+        for (fa, fb), n in sorted(compartidos.items(), key=lambda x: (x[0][0] or "", x[0][1] or "")):
+            proporcion = n / chunks_por_fuente[fa]
+            if proporcion < self.umbral_documento:
+                continue
+            inversa = compartidos.get((fb, fa), 0) / chunks_por_fuente[fb]
+            if inversa >= self.umbral_documento and (fb or "") < (fa or ""):
+                continue  # ya reportado en el otro sentido
+            documentos.append({"documento": fa, "duplicado_de": fb, "proporcion": round(proporcion, 3)})
+
+        return {
+            "total_chunks": len(ids),
+            "clusters": clusters,
+            "chunks_redundantes": sum(len(c) - 1 for c in clusters),
+            "pares_texto": pares_texto,
+            "pares_vector": pares_vector,
+            "documentos_duplicados": documentos
+        }
+
+    def eliminar_redundantes(self, reporte, batch_size=1000):
+        """Borra todos los miembros de cada cluster excepto el primero (el representante)"""
+        ids = [{"id": c["id"]} for cluster in reporte["clusters"] for c in cluster[1:]]
+        eliminados = 0
+        for i in range(0, len(ids), batch_size):
+            self.search_client.delete_documents(documents=ids[i:i + batch_size])
+            eliminados += len(ids[i:i + batch_size])
+            print(f"   Eliminados {eliminados}/{len(ids)} chunks...")
+        return eliminados
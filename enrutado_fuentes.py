@@ -0,0 +1,224 @@
+"""
+enrutado_fuentes.py - Enrutado en dos etapas por documento (source)
+Por cada documento se guarda un centroide y unos pocos representantes k-means de
+sus vectores en un índice pequeño '<índice>-fuentes'. Al consultar, la pregunta
+se enruta primero a los documentos más cercanos y la búsqueda principal se
+restringe a ellos con search.in(source, ...).
+"""
+
+import os
+import hashlib
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import numpy as np
+from azure.search.documents import SearchClient
+from azure.search.documents.indexes import SearchIndexClient
+from azure.search.documents.indexes.models import (
+    SearchIndex,
+    SearchField,
+    SearchFieldDataType,
+    VectorSearch,
+    HnswAlgorithmConfiguration,
+    VectorSearchProfile,
+)
+from azure.search.documents.models import VectorizedQuery
+from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import ResourceNotFoundError
+
+from estadisticas_indice import escapar_odata
+from recorrido_indice import recorrer_paginas
+
+
+def construir_indice_fuentes(nombre, dimensiones=1536):
+    """Esquema del índice de enrutado: un documento por centroide/representante"""
+    fields = [
+        SearchField(name="id", type=SearchFieldDataType.String, key=True, filterable=True),
+        SearchField(name="source", type=SearchFieldDataType.String, filterable=True, facetable=True),
+        SearchField(name="tipo", type=SearchFieldDataType.String, filterable=True),
+        SearchField(name="chunks", type=SearchFieldDataType.Int32, filterable=True),
+        SearchField(
+            name="vector",
+            type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
+            searchable=True,
+            vector_search_dimensions=dimensiones,
+            vector_search_profile_name="vector-profile"
+        ),
+        SearchField(name="fecha_actualizacion", type=SearchFieldDataType.DateTimeOffset, filterable=True)
+    ]
+
+    vector_search = VectorSearch(
+        algorithms=[
+            HnswAlgorithmConfiguration(
+                name="hnsw-algo",
+                parameters={"m": 4, "efConstruction": 400, "efSearch": 500, "metric": "cosine"}
+            )
+        ],
+        profiles=[VectorSearchProfile(name="vector-profile", algorithm_configuration_name="hnsw-algo")]
+    )
+    return SearchIndex(name=nombre, fields=fields, vector_search=vector_search)
+
+
+def calcular_representantes(vectores, k=4, iteraciones=10, semilla=0):
+    """Centroide normalizado + k representantes (k-means esférico) y tamaño de cada grupo"""
+    X = np.asarray(vectores, dtype=np.float32)
+    X = X / (np.linalg.norm(X, axis=1, keepdims=True) + 1e-12)
+    centroide = X.mean(axis=0)
+    centroide /= np.linalg.norm(centroide) + 1e-12
+
+    k = min(k, len(X))
+    if k <= 1:
+        return centroide, np.zeros((0, X.shape[1]), dtype=np.float32), []
+
+    rng = np.random.default_rng(semilla)
+    C = X[rng.choice(len(X), k, replace=False)].copy()
+    for _ in range(iteraciones):
+        asignacion = np.argmax(X @ C.T, axis=1)
+        for j in range(k):
+            miembros = X[asignacion == j]
+            if len(miembros):
+                C[j] = miembros.mean(axis=0)
+        C /= np.linalg.norm(C, axis=1, keepdims=True) + 1e-12
+
+    tamanos = np.bincount(np.argmax(X @ C.T, axis=1), minlength=k)
+    return centroide, C, tamanos.tolist()
+
+
+class EnrutadorFuentes:
+    def __init__(self, index_name, search_endpoint=None, search_key=None,
+                 representantes=4, dimensiones=1536):
+        self.search_endpoint = search_endpoint or os.getenv("AZURE_SEARCH_ENDPOINT")
+        self.search_key = search_key or os.getenv("AZURE_SEARCH_KEY")
+        self.nombre = f"{index_name}-fuentes"
+        self.representantes = representantes
+        self.dimensiones = dimensiones
+
+        self.index_client = SearchIndexClient(
+            endpoint=self.search_endpoint,
+            credential=AzureKeyCredential(self.search_key)
+        )
+        self.search_client = SearchClient(
+            endpoint=self.search_endpoint,
+            index_name=self.nombre,
+            credential=AzureKeyCredential(self.search_key)
+        )
+
+    def asegurar_indice(self):
+        """Crea el índice de enrutado si no existe"""
+        try:
+            self.index_client.get_index(self.nombre)
+        except ResourceNotFoundError:
+            self.index_client.create_or_update_index(construir_indice_fuentes(self.nombre, self.dimensiones))
+
+    def _id(self, source, i):
+        return hashlib.md5(f"{source}_{i}".encode()).hexdigest()
+
+    def actualizar_fuente(self, source, vectores):
+        """Recalcula y guarda el centroide y los representantes de un documento"""
+        if not len(vectores):
+            return 0
+        centroide, representantes, tamanos = calcular_representantes(vectores, self.representantes)
+        fecha = datetime.now(timezone.utc)
+
+        docs = [{
+            "id": self._id(source, 0),
+            "source": source,
+            "tipo": "centroide",
+            "chunks": len(vectores),
+            "vector": centroide.tolist(),
+            "fecha_actualizacion": fecha
+        }]
+        for i, (vector, tamano) in enumerate(zip(representantes, tamanos), 1):
+            docs.append({
+                "id": self._id(source, i),
+                "source": source,
+                "tipo": "representante",
+                "chunks": int(tamano),
+                "vector": vector.tolist(),
+                "fecha_actualizacion": fecha
+            })
+
+        # Representantes sobrantes de una versión anterior del documento
+        sobrantes = [{"id": self._id(source, i)} for i in range(len(docs), self.representantes + 1)]
+        if sobrantes:
+            self.search_client.delete_documents(documents=sobrantes)
+        self.search_client.merge_or_upload_documents(documents=docs)
+        return len(docs)
+
+    def eliminar_fuente(self, source):
+        ids = [{"id": self._id(source, i)} for i in range(self.representantes + 1)]
+        self.search_client.delete_documents(documents=ids)
+
+    def vaciar(self):
+        """Elimina el índice de enrutado (se vuelve a crear al cargar o reconstruir)"""
+        try:
+            self.index_client.delete_index(self.nombre)
+            return True
+        except ResourceNotFoundError:
+            return False
+
+    def rutear(self, vector, max_fuentes=3):
+        """Documentos más cercanos a la pregunta, ordenados por su mejor similitud"""
+        consulta = VectorizedQuery(
+            vector=vector,
+            k_nearest_neighbors=max_fuentes * (self.representantes + 1),
+            fields="vector"
+        )
+        results = self.search_client.search(
+            search_text=None,
+            vector_queries=[consulta],
+            select=["source"],
+            top=max_fuentes * (self.representantes + 1)
+        )
+        mejores = {}
+        for r in results:
+            puntaje = r.get("@search.score") or 0.0
+            if puntaje > mejores.get(r["source"], -1.0):
+                mejores[r["source"]] = puntaje
+        return sorted(mejores, key=mejores.get, reverse=True)[:max_fuentes]
+
+    def reconstruir(self, search_client_chunks):
+        """Recalcula el enrutado de todos los documentos a partir del índice principal
+
+        Se parte de un índice vacío para no dejar documentos que ya no existen.
+        """
+        self.vaciar()
+        self.asegurar_indice()
+        vectores = defaultdict(list)
+        actual = None
+        total = 0
+
+        # Con un solo hilo las particiones llegan de una en una (un documento cada vez)
+        for pagina in recorrer_paginas(search_client_chunks, select=["source", "content_vector"]):
+            for doc in pagina:
+                source = doc.get("source")
+                if source is None or doc.get("content_vector") is None:
+                    continue
+                if actual is not None and source != actual:
+                    self.actualizar_fuente(actual, vectores.pop(actual))
+                    total += 1
+                actual = source
+                vectores[source].append(doc["content_vector"])
+        if actual is not None:
+            self.actualizar_fuente(actual, vectores.pop(actual))
+            total += 1
+        return total
+
+
+# Separadores posibles para search.in, en orden de preferencia
+SEPARADORES = "|,;#~^"
+
+
+def filtro_fuentes(fuentes):
+    """Filtro OData search.in para una lista de documentos
+
+    El separador es el primero de SEPARADORES que no aparece en ningún nombre (un
+    nombre con el separador se partiría en dos); si aparecen todos, se usa una
+    disyunción de 'source eq'.
+    """
+    fuentes = list(fuentes)
+    separador = next((s for s in SEPARADORES if not any(s in f for f in fuentes)), None)
+    if separador is None:
+        return "(" + " or ".join(f"source eq '{escapar_odata(f)}'" for f in fuentes) + ")"
+    valores = separador.join(escapar_odata(f) for f in fuentes)
+    return f"search.in(source, '{valores}', '{separador}')"
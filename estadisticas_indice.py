@@ -0,0 +1,136 @@
+"""
+estadisticas_indice.py - Recolección de estadísticas exactas del índice de Azure AI Search
+Usado por gestionar-indice.py (y cualquier script que necesite listar todas las fuentes)
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+def escapar_odata(valor):
+    """Escapa comillas simples para usar un valor dentro de un filtro OData"""
+    return str(valor).replace("'", "''")
+
+
+def listar_facetas(search_client, campo="source", tamano_pagina=1000, filtro=None):
+    """Recorre TODOS los valores de una faceta, paginando por valor
+
+    Azure AI Search devuelve por defecto solo 10 valores por faceta. Se piden
+    páginas ordenadas por valor y se continúa con `campo gt 'último valor'`
+    hasta que una página llega incompleta.
+    """
+    valores = []
+    ultimo = None
+
+    while True:
+        condiciones = []
+        if filtro:
+            condiciones.append(f"({filtro})")
+        if ultimo is not None:
+            condiciones.append(f"{campo} gt '{escapar_odata(ultimo)}'")
+
+        results = search_client.search(
+            search_text="*",
+            facets=[f"{campo},count:{tamano_pagina},sort:value"],
+            filter=" and ".join(condiciones) or None,
+            top=0
+        )
+
+        pagina = (results.get_facets() or {}).get(campo, [])
+        valores.extend({"value": f["value"], "count": f["count"]} for f in pagina)
+
+        if len(pagina) < tamano_pagina:
+            break
+        ultimo = pagina[-1]["value"]
+
+    return valores
+
+
+def _leer_valor(objeto, nombre):
+    """Lee un atributo tanto de modelos del SDK como de diccionarios"""
+    if isinstance(objeto, dict):
+        return objeto.get(nombre)
+    return getattr(objeto, nombre, None)
+
+
+class RecolectorEstadisticas:
+    """Recolecta en paralelo esquema, conteos, almacenamiento real y fuentes del índice"""
+
+    def __init__(self, index_client, search_client, index_name, ttl_segundos=60, max_workers=4):
+        self.index_client = index_client
+        self.search_client = search_client
+        self.index_name = index_name
+        self.ttl_segundos = ttl_segundos
+        self.max_workers = max_workers
+
+        self._cache = None
+        self._cache_expira = 0.0
+        self._lock = threading.Lock()
+
+    def _contar_chunks(self):
+        """Conteo exacto de chunks visibles para búsqueda"""
+        results = self.search_client.search("*", include_total_count=True, top=0)
+        return results.get_count()
+
+    def invalidar(self):
+        """Descarta la caché (llamar tras cargar o eliminar documentos)"""
+        with self._lock:
+            self._cache = None
+            self._cache_expira = 0.0
+
+    def recolectar(self, forzar=False):
+        """Devuelve las estadísticas del índice en una sola llamada, cacheadas durante el TTL"""
+        with self._lock:
+            if not forzar and self._cache is not None and time.monotonic() < self._cache_expira:
+                return self._cache
+
+            inicio = time.perf_counter()
+
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                f_esquema = executor.submit(self.index_client.get_index, self.index_name)
+                f_stats = executor.submit(self.index_client.get_index_statistics, self.index_name)
+                f_total = executor.submit(self._contar_chunks)
+                f_fuentes = executor.submit(listar_facetas, self.search_client, "source")
+
+                index = f_esquema.result()
+                index_stats = f_stats.result()
+                total_chunks = f_total.result()
+                fuentes = f_fuentes.result()
+
+            storage_bytes = _leer_valor(index_stats, "storage_size") or 0
+            vector_bytes = _leer_valor(index_stats, "vector_index_size") or 0
+            document_count = _leer_valor(index_stats, "document_count")
+
+            # El servicio solo reporta almacenamiento a nivel de índice; se reparte
+            # entre documentos de forma proporcional a su número de chunks
+            total_facetas = sum(f["count"] for f in fuentes) or 1
+            documentos = []
+            for fuente in fuentes:
+                proporcion = fuente["count"] / total_facetas
+                documentos.append({
+                    "nombre": fuente["value"],
+                    "chunks": fuente["count"],
+                    "tamaño_estimado_kb": storage_bytes * proporcion / 1024,
+                    "vectores_estimado_kb": vector_bytes * proporcion / 1024
+                })
+
+            campos = []
+            for field in index.fields:
+                tipo = field.type.value if hasattr(field.type, 'value') else str(field.type)
+                campos.append({"nombre": field.name, "tipo": tipo})
+
+            self._cache = {
+                "fecha": datetime.now().isoformat(),
+                "index_name": self.index_name,
+                "campos": campos,
+                "total_chunks": total_chunks,
+                "document_count": document_count,
+                "storage_bytes": storage_bytes,
+                "vector_index_bytes": vector_bytes,
+                "documentos": documentos,
+                "duracion_ms": (time.perf_counter() - inicio) * 1000
+            }
+            self._cache_expira = time.monotonic() + self.ttl_segundos
+            return self._cache
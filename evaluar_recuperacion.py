@@ -0,0 +1,283 @@
+"""
+evaluar_recuperacion.py - Evaluación offline de calidad vs. costo de la recuperación
+Construye un IndiceLocal por cada variante de chunking (tamaño, overlap, longitud
+mínima) a partir de los PDFs, ejecuta un conjunto de preguntas con sus páginas
+esperadas y, para cada top_k, informa:
+
+    recall@k, MRR, chunks, bytes del índice, tokens de embedding del corpus,
+    tokens de prompt por respuesta y latencia de búsqueda
+
+Las preguntas van en JSONL: {"pregunta": "...", "esperado": [{"source": "a.pdf", "page": 3}]}
+(sin "page" cuenta cualquier página del documento).
+
+Los embeddings se guardan en caché por texto, así que las variantes que comparten
+chunks y las ejecuciones repetidas no vuelven a pagar por ellos. Con
+RAG_EVAL_EMBEDDINGS=local se usa un embedding por hashing sin llamadas a Azure.
+
+Uso: python evaluar_recuperacion.py <preguntas.jsonl> <carpeta_o_pdf> [variantes.json]
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+from datetime import datetime
+
+import numpy as np
+from azure.search.documents.models import VectorizedQuery
+
+from cargar_pdf import dividir_pagina, extraer_paginas
+from consultar import construir_mensajes
+from consumo_tokens import estimar_tokens
+from indice_local import IndiceLocal, tokenizar
+from limpieza_texto import limpiar_paginas
+
+VARIANTES_POR_DEFECTO = [
+    {"chunk_size": 300, "overlap": 50, "min_longitud": 50},
+    {"chunk_size": 500, "overlap": 100, "min_longitud": 50},  # configuración actual
+    {"chunk_size": 500, "overlap": 0, "min_longitud": 50},
+    {"chunk_size": 800, "overlap": 100, "min_longitud": 50},
+    {"chunk_size": 1200, "overlap": 200, "min_longitud": 100},
+]
+TOP_K_POR_DEFECTO = [3, 5, 8]
+
+
+def embedding_hash(textos, dimensiones=256):
+    """Embedding local por hashing de palabras y bigramas (para pruebas sin Azure)"""
+    matriz = np.zeros((len(textos), dimensiones), dtype=np.float32)
+    for fila, texto in enumerate(textos):
+        palabras = tokenizar(texto)
+        for termino in palabras + [f"{a} {b}" for a, b in zip(palabras, palabras[1:])]:
+            h = int(hashlib.md5(termino.encode()).hexdigest()[:8], 16)
+            matriz[fila, h % dimensiones] += 1.0 if (h >> 31) & 1 else -1.0
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    return matriz / np.where(normas == 0, 1, normas)
+
+
+class CacheEmbeddings:
+    """Embeddings por texto, persistidos en <ruta>.npy + <ruta>.json"""
+
+    def __init__(self, ruta, funcion):
+        self.ruta = ruta
+        self.funcion = funcion
+        self.filas = {}
+        self.vectores = []
+        if os.path.exists(f"{ruta}.json"):
+            with open(f"{ruta}.json", "r", encoding="utf-8") as f:
+                self.filas = {clave: i for i, clave in enumerate(json.load(f))}
+            self.vectores = list(np.load(f"{ruta}.npy"))
+        self.nuevos = 0
+
+    @staticmethod
+    def _clave(texto):
+        return hashlib.sha1(texto.encode("utf-8")).hexdigest()
+
+    def obtener(self, textos):
+        faltantes = list(dict.fromkeys(t for t in textos if self._clave(t) not in self.filas))
+        if faltantes:
+            for texto, vector in zip(faltantes, self.funcion(faltantes)):
+                self.filas[self._clave(texto)] = len(self.vectores)
+                self.vectores.append(np.asarray(vector, dtype=np.float32))
+            self.nuevos += len(faltantes)
+        return np.stack([self.vectores[self.filas[self._clave(t)]] for t in textos])
+
+    def guardar(self):
+        carpeta = os.path.dirname(self.ruta)
+        if carpeta:
+            os.makedirs(carpeta, exist_ok=True)
+        claves = sorted(self.filas, key=self.filas.get)
+        np.save(f"{self.ruta}.npy", np.stack(self.vectores) if self.vectores else np.zeros((0, 1)))
+        with open(f"{self.ruta}.json", "w", encoding="utf-8") as f:
+            json.dump(claves, f)
+
+
+def funcion_embeddings(modo):
+    """Función textos -> vectores según el modo ('azure' o 'local')"""
+    if modo == "local":
+        return embedding_hash
+
+    from pool_openai import crear_cliente_openai
+    cliente = crear_cliente_openai()
+    lote = int(os.getenv("RAG_LOTE_EMBEDDINGS", "256"))
+
+    def embeddings_azure(textos):
+        vectores = []
+        for i in range(0, len(textos), lote):
+            respuesta = cliente.embeddings.create(
+                input=textos[i:i + lote],
+                model=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+            )
+            vectores.extend(d.embedding for d in sorted(respuesta.data, key=lambda d: d.index))
+        return vectores
+
+    return embeddings_azure
+
+
+def leer_paginas_pdfs(ruta):
+    """{nombre_pdf: [texto de cada página]} de un PDF o de todos los de una carpeta"""
+    if os.path.isdir(ruta):
+        pdfs = [os.path.join(ruta, f) for f in sorted(os.listdir(ruta)) if f.endswith(".pdf")]
+    else:
+        pdfs = [ruta]
+
+    import PyPDF2
+    paginas = {}
+    for pdf in pdfs:
+        with open(pdf, "rb") as f:
+            total = len(PyPDF2.PdfReader(f).pages)
+        textos = extraer_paginas(pdf, 0, total)
+        # Igual que en la carga: sin cabeceras ni pies repetidos (salvo RAG_LIMPIEZA=0)
+        if os.getenv("RAG_LIMPIEZA", "1") == "1":
+            textos, _ = limpiar_paginas(textos)
+        paginas[os.path.basename(pdf)] = textos
+    return paginas
+
+
+def leer_preguntas_evaluacion(ruta):
+    with open(ruta, "r", encoding="utf-8") as f:
+        return [json.loads(linea) for linea in f if linea.strip()]
+
+
+def es_relevante(resultado, esperados):
+    for e in esperados:
+        if resultado.get("source") == e.get("source") and e.get("page") in (None, resultado.get("page")):
+            return True
+    return False
+
+
+class EvaluadorRecuperacion:
+    def __init__(self, paginas, preguntas, cache):
+        self.paginas = paginas
+        self.preguntas = preguntas
+        self.cache = cache
+
+    def construir(self, variante):
+        """Chunks de la variante y su IndiceLocal"""
+        fecha = datetime.now()
+        chunks = []
+        for nombre, textos in self.paginas.items():
+            for num, texto in enumerate(textos):
+                chunks.extend(dividir_pagina(
+                    texto, num, nombre, fecha,
+                    chunk_size=variante["chunk_size"],
+                    overlap=variante["overlap"],
+                    min_longitud=variante["min_longitud"]
+                ))
+        vectores = self.cache.obtener([c["content"] for c in chunks])
+        documentos = [{k: c[k] for k in ("id", "content", "source", "page")} for c in chunks]
+        return chunks, IndiceLocal.desde_arrays(documentos, vectores, nombre="evaluacion")
+
+    def evaluar(self, variante, top_ks):
+        inicio = time.perf_counter()
+        chunks, indice = self.construir(variante)
+        construccion = time.perf_counter() - inicio
+
+        vectores_preguntas = self.cache.obtener([p["pregunta"] for p in self.preguntas])
+        bytes_indice = (indice.matriz().nbytes
+                        + sum(len(c["content"].encode("utf-8")) for c in chunks))
+        base = {
+            **variante,
+            "chunks": len(chunks),
+            "bytes_indice": bytes_indice,
+            "tokens_embedding_corpus": sum(estimar_tokens(c["content"]) for c in chunks),
+            "construccion_s": round(construccion, 2)
+        }
+
+        filas = []
+        k_max = max(top_ks)
+        for k in top_ks:
+            recall, mrr, tokens_prompt, latencias = [], [], [], []
+            for pregunta, vector in zip(self.preguntas, vectores_preguntas):
+                t0 = time.perf_counter()
+                resultados = list(indice.search(
+                    search_text=pregunta["pregunta"],
+                    vector_queries=[VectorizedQuery(vector=vector.tolist(), k_nearest_neighbors=k_max,
+                                                    fields="content_vector")],
+                    select=["content", "source", "page"],
+                    top=k
+                ))
+                latencias.append((time.perf_counter() - t0) * 1000)
+
+                esperados = pregunta.get("esperado", [])
+                relevantes = [es_relevante(r, esperados) for r in resultados]
+                encontrados = sum(
+                    any(es_relevante(r, [e]) for r in resultados) for e in esperados
+                )
+                recall.append(encontrados / len(esperados) if esperados else 0.0)
+                mrr.append(next((1 / (i + 1) for i, ok in enumerate(relevantes) if ok), 0.0))
+                tokens_prompt.append(sum(
+                    estimar_tokens(m["content"]) for m in construir_mensajes(pregunta["pregunta"], resultados)
+                ))
+
+            filas.append(dict(
+                base,
+                top_k=k,
+                recall=round(float(np.mean(recall)), 4),
+                mrr=round(float(np.mean(mrr)), 4),
+                tokens_prompt=round(float(np.mean(tokens_prompt)), 1),
+                latencia_ms=round(float(np.mean(latencias)), 2),
+                latencia_p95_ms=round(float(np.percentile(latencias, 95)), 2)
+            ))
+        return filas
+
+    def ejecutar(self, variantes, top_ks):
+        filas = []
+        for variante in variantes:
+            print(f"   🧪 chunk_size={variante['chunk_size']} overlap={variante['overlap']} "
+                  f"min={variante['min_longitud']}")
+            filas.extend(self.evaluar(variante, top_ks))
+        self.cache.guardar()
+        return filas
+
+
+def recomendar(filas, tolerancia=0.02):
+    """La configuración más barata (tokens de prompt, luego índice) con recall cercano al mejor"""
+    if not filas:
+        return None
+    mejor = max(f["recall"] for f in filas)
+    aceptables = [f for f in filas if f["recall"] >= mejor - tolerancia]
+    return min(aceptables, key=lambda f: (f["tokens_prompt"], f["bytes_indice"], -f["mrr"]))
+
+
+def imprimir_informe(filas, recomendada):
+    print(f"\n{'chunk':>6}{'overlap':>8}{'min':>5}{'top_k':>6}{'recall':>8}{'MRR':>7}"
+          f"{'chunks':>8}{'índice KB':>11}{'tok emb':>9}{'tok prompt':>11}{'ms':>7}")
+    print("-" * 86)
+    for f in filas:
+        marca = " ⭐" if f is recomendada else ""
+        print(f"{f['chunk_size']:>6}{f['overlap']:>8}{f['min_longitud']:>5}{f['top_k']:>6}"
+              f"{f['recall']:>8.3f}{f['mrr']:>7.3f}{f['chunks']:>8}{f['bytes_indice']/1024:>11.0f}"
+              f"{f['tokens_embedding_corpus']:>9}{f['tokens_prompt']:>11.0f}{f['latencia_ms']:>7.1f}{marca}")
+    if recomendada:
+        print(f"\n⭐ Recomendada: chunk_size={recomendada['chunk_size']}, overlap={recomendada['overlap']}, "
+              f"min={recomendada['min_longitud']}, top_k={recomendada['top_k']} "
+              f"(recall {recomendada['recall']:.3f}, {recomendada['tokens_prompt']:.0f} tokens de prompt)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Uso: python evaluar_recuperacion.py <preguntas.jsonl> <carpeta_o_pdf> [variantes.json]")
+        sys.exit(1)
+
+    variantes = VARIANTES_POR_DEFECTO
+    if len(sys.argv) > 3:
+        with open(sys.argv[3], "r", encoding="utf-8") as f:
+            variantes = json.load(f)
+    top_ks = [int(k) for k in os.getenv("RAG_EVAL_TOP_K", ",".join(map(str, TOP_K_POR_DEFECTO))).split(",")]
+    modo = os.getenv("RAG_EVAL_EMBEDDINGS", "azure")
+
+    print(f"\n📏 EVALUACIÓN DE RECUPERACIÓN ({len(variantes)} variantes, top_k={top_ks}, embeddings {modo})")
+    preguntas = leer_preguntas_evaluacion(sys.argv[1])
+    paginas = leer_paginas_pdfs(sys.argv[2])
+    cache = CacheEmbeddings(os.path.join("evaluacion_cache", f"embeddings_{modo}"), funcion_embeddings(modo))
+
+    filas = EvaluadorRecuperacion(paginas, preguntas, cache).ejecutar(variantes, top_ks)
+    recomendada = recomendar(filas)
+    imprimir_informe(filas, recomendada)
+
+    archivo = f"evaluacion_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(archivo, "w", encoding="utf-8") as f:
+        json.dump({"preguntas": len(preguntas), "embeddings": modo, "resultados": filas,
+                   "recomendada": recomendada}, f, indent=2, ensure_ascii=False)
+    print(f"\n📄 Informe guardado en: {archivo} ({cache.nuevos} embeddings nuevos)")
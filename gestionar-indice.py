@@ -9,6 +9,14 @@ from azure.core.credentials import AzureKeyCredential
 from dotenv import load_dotenv
 from datetime import datetime
 import json
+from estadisticas_indice import RecolectorEstadisticas, listar_facetas
+from duplicados import DetectorDuplicados
+from migrar_indice import MigradorIndice
+from snapshot_indice import exportar_snapshot, restaurar_snapshot
+from cargar_pdf import asegurar_indice
+from enrutado_fuentes import EnrutadorFuentes
+from almacen_chunks import AlmacenChunks
+from diario_carga import DiarioCarga
 
 load_dotenv()
 
@@ -28,6 +36,22 @@ class GestorIndice:
             index_name=self.index_name,
             credential=AzureKeyCredential(self.search_key)
         )
+        
+        self.enrutador = EnrutadorFuentes(self.index_name, self.search_endpoint, self.search_key)
+        
+        # Texto y orden de los chunks para la ampliación con vecinos (ver almacen_chunks.py)
+        self.almacen = AlmacenChunks()
+        
+        # Diario de carga de cargar_pdf.py: un documento borrado aquí debe poder recargarse
+        self.diario = DiarioCarga()
+        
+        # Estadísticas exactas en paralelo, cacheadas unos segundos
+        self.estadisticas = RecolectorEstadisticas(
+            self.index_client,
+            self.search_client,
+            self.index_name,
+            ttl_segundos=int(os.getenv("ESTADISTICAS_TTL_SEGUNDOS", "60"))
+        )
     
     def info_indice(self):
         """Muestra información detallada del índice"""
@@ -36,41 +60,30 @@ class GestorIndice:
         print("="*60)
         
         try:
-            # Información básica
-            index = self.index_client.get_index(self.index_name)
+            stats = self.estadisticas.recolectar()
             print(f"\n📌 Nombre: {self.index_name}")
             print(f"📌 Endpoint: {self.search_endpoint}")
             
             # Campos
-            print(f"\n📋 Campos del índice ({len(index.fields)} campos):")
-            for field in index.fields:
-                tipo = field.type.value if hasattr(field.type, 'value') else str(field.type)
-                print(f"   • {field.name}: {tipo}")
+            print(f"\n📋 Campos del índice ({len(stats['campos'])} campos):")
+            for campo in stats["campos"]:
+                print(f"   • {campo['nombre']}: {campo['tipo']}")
             
             # Estadísticas
-            results = self.search_client.search("*", include_total_count=True, top=0)
-            total = results.get_count()
-            print(f"\n📈 Total de chunks: {total}")
-            
-            # Documentos únicos
-            facet_results = self.search_client.search(
-                search_text="*",
-                facets=["source"],
-                top=0
-            )
+            print(f"\n📈 Total de chunks: {stats['total_chunks']}")
             
-            if facet_results.get_facets():
-                print("\n📚 Documentos indexados:")
-                total_size = 0
-                for source in facet_results.get_facets().get("source", []):
-                    chunks = source['count']
-                    size_est = chunks * 500 / 1024  # Estimación en KB
-                    total_size += size_est
-                    print(f"   • {source['value']}")
-                    print(f"     - Chunks: {chunks}")
-                    print(f"     - Tamaño estimado: {size_est:.1f} KB")
-                
-                print(f"\n💾 Tamaño total estimado: {total_size:.1f} KB ({total_size/1024:.2f} MB)")
+            if stats["documentos"]:
+                print(f"\n📚 Documentos indexados ({len(stats['documentos'])}):")
+                for doc in stats["documentos"]:
+                    print(f"   • {doc['nombre']}")
+                    print(f"     - Chunks: {doc['chunks']}")
+                    print(f"     - Tamaño (proporcional): {doc['tamaño_estimado_kb']:.1f} KB")
+            
+            storage_kb = stats["storage_bytes"] / 1024
+            vector_kb = stats["vector_index_bytes"] / 1024
+            print(f"\n💾 Almacenamiento total: {storage_kb:.1f} KB ({storage_kb/1024:.2f} MB)")
+            print(f"🧮 Índice vectorial: {vector_kb:.1f} KB ({vector_kb/1024:.2f} MB)")
+            print(f"⏱️ Estadísticas obtenidas en {stats['duracion_ms']:.0f} ms")
             
         except Exception as e:
             print(f"❌ Error obteniendo información: {e}")
@@ -105,8 +118,17 @@ class GestorIndice:
                     print(f"   Eliminados {total_deleted}/{len(ids_to_delete)} chunks...")
                 
                 print(f"✅ Documento eliminado: {len(ids_to_delete)} chunks")
+                self.estadisticas.invalidar()
+                try:
+                    self.enrutador.eliminar_fuente(nombre_documento)
+                except Exception as e:
+                    print(f"⚠️ No se pudo actualizar el enrutado: {e}")
             else:
                 print("❌ No se encontró el documento")
+            
+            # Sin esto, cargar_pdf --reanudar lo daría por cargado y no lo volvería a subir
+            self.diario.olvidar(nombre_documento)
+            self.almacen.eliminar_documento(nombre_documento)
                 
         except Exception as e:
             print(f"❌ Error eliminando documento: {e}")
@@ -151,8 +173,20 @@ class GestorIndice:
                     self.search_client.delete_documents(documents=batch)
                 
                 print(f"✅ Eliminados {len(ids_to_delete)} documentos")
+                self.estadisticas.invalidar()
             else:
                 print("El índice ya está vacío")
+            
+            # Diario de carga y almacén de chunks: los PDFs se podrán volver a cargar
+            self.diario.vaciar()
+            self.almacen.vaciar()
+            
+            # Sin documentos, los centroides del enrutado apuntarían a fuentes inexistentes
+            try:
+                if self.enrutador.vaciar():
+                    print(f"✅ Enrutado vaciado ('{self.enrutador.nombre}')")
+            except Exception as e:
+                print(f"⚠️ No se pudo vaciar el enrutado: {e}")
                 
         except Exception as e:
             print(f"❌ Error: {e}")
@@ -163,32 +197,17 @@ class GestorIndice:
         
         try:
             # Recopilar estadísticas
+            datos = self.estadisticas.recolectar()
             stats = {
                 "fecha_exportacion": datetime.now().isoformat(),
                 "index_name": self.index_name,
                 "endpoint": self.search_endpoint,
-                "documentos": []
+                "total_chunks": datos["total_chunks"],
+                "storage_bytes": datos["storage_bytes"],
+                "vector_index_bytes": datos["vector_index_bytes"],
+                "documentos": datos["documentos"]
             }
             
-            # Obtener información de documentos
-            facet_results = self.search_client.search(
-                search_text="*",
-                facets=["source"],
-                top=0
-            )
-            
-            if facet_results.get_facets():
-                for source in facet_results.get_facets().get("source", []):
-                    stats["documentos"].append({
-                        "nombre": source['value'],
-                        "chunks": source['count'],
-                        "tamaño_estimado_kb": source['count'] * 500 / 1024
-                    })
-            
-            # Total de chunks
-            results = self.search_client.search("*", include_total_count=True, top=0)
-            stats["total_chunks"] = results.get_count()
-            
             # Guardar a archivo
             with open(filename, "w", encoding="utf-8") as f:
                 json.dump(stats, f, indent=2, ensure_ascii=False)
@@ -198,44 +217,112 @@ class GestorIndice:
         except Exception as e:
             print(f"❌ Error exportando: {e}")
     
-    def buscar_duplicados(self):
-        """Busca posibles documentos duplicados"""
+    def buscar_duplicados(self, eliminar=None):
+        """Busca documentos y chunks duplicados (por nombre y por contenido)"""
         print("\n🔍 Buscando posibles duplicados...")
         
         try:
-            # Obtener todos los documentos
-            facet_results = self.search_client.search(
-                search_text="*",
-                facets=["source"],
-                top=0
-            )
+            # 1. Nombres de archivo similares (rápido)
+            sources = listar_facetas(self.search_client, "source")
+            nombres = [s['value'] for s in sources]
+            duplicados = []
             
-            if facet_results.get_facets():
-                sources = facet_results.get_facets().get("source", [])
-                
-                # Buscar nombres similares
-                nombres = [s['value'] for s in sources]
-                duplicados = []
-                
-                for i, nombre1 in enumerate(nombres):
-                    for nombre2 in nombres[i+1:]:
-                        # Comparar nombres sin extensión
-                        base1 = os.path.splitext(nombre1)[0].lower()
-                        base2 = os.path.splitext(nombre2)[0].lower()
-                        
-                        if base1 == base2 or base1 in base2 or base2 in base1:
-                            duplicados.append((nombre1, nombre2))
-                
-                if duplicados:
-                    print("\n⚠️ Posibles duplicados encontrados:")
-                    for dup in duplicados:
-                        print(f"   • {dup[0]} <-> {dup[1]}")
-                else:
-                    print("✅ No se encontraron duplicados")
+            for i, nombre1 in enumerate(nombres):
+                for nombre2 in nombres[i+1:]:
+                    # Comparar nombres sin extensión
+                    base1 = os.path.splitext(nombre1)[0].lower()
+                    base2 = os.path.splitext(nombre2)[0].lower()
+                    
+                    if base1 == base2 or base1 in base2 or base2 in base1:
+                        duplicados.append((nombre1, nombre2))
+            
+            if duplicados:
+                print("\n⚠️ Nombres similares:")
+                for dup in duplicados:
+                    print(f"   • {dup[0]} <-> {dup[1]}")
+            
+            # 2. Contenido: MinHash/LSH sobre el texto + similitud vectorial por bloques
+            print("\n🧬 Analizando contenido de los chunks...")
+            detector = DetectorDuplicados(self.search_client)
+            reporte = detector.analizar()
+            
+            if reporte["documentos_duplicados"]:
+                print("\n⚠️ Documentos con contenido casi idéntico:")
+                for doc in reporte["documentos_duplicados"]:
+                    print(f"   • {doc['documento']} ≈ {doc['duplicado_de']} "
+                          f"({doc['proporcion']*100:.0f}% de sus chunks)")
+            
+            if reporte["clusters"]:
+                print(f"\n⚠️ {len(reporte['clusters'])} grupos de chunks casi duplicados "
+                      f"({reporte['chunks_redundantes']} chunks redundantes de {reporte['total_chunks']})")
+                for cluster in reporte["clusters"][:10]:
+                    miembros = ", ".join(f"{c['source']} p.{c['page']}" for c in cluster[:5])
+                    extra = f" (+{len(cluster) - 5})" if len(cluster) > 5 else ""
+                    print(f"   • {miembros}{extra}")
+            elif not duplicados:
+                print("✅ No se encontraron duplicados")
+                return reporte
+            
+            if reporte["clusters"]:
+                if eliminar is None:
+                    respuesta = input("\n¿Eliminar los chunks redundantes (se conserva uno por grupo)? (s/n): ")
+                    eliminar = respuesta.lower() == 's'
+                if eliminar:
+                    total = detector.eliminar_redundantes(reporte)
+                    self.estadisticas.invalidar()
+                    print(f"✅ Eliminados {total} chunks redundantes")
+            
+            return reporte
                     
         except Exception as e:
             print(f"❌ Error: {e}")
 
+    def migrar_indice(self, origen, destino, alias=None, source_por_defecto=None):
+        """Migra origen -> destino reutilizando los vectores ya calculados"""
+        migrador = MigradorIndice(self.index_client, self.search_endpoint, self.search_key)
+        valores = {"source": source_por_defecto} if source_por_defecto else None
+        
+        try:
+            resultado = migrador.migrar(
+                origen,
+                destino,
+                valores=valores,
+                alias=alias,
+                variable_config=None if alias else "AZURE_SEARCH_INDEX_NAME_V2"
+            )
+            self.estadisticas.invalidar()
+            return resultado
+        except Exception as e:
+            print(f"❌ Error migrando: {e}")
+
+    def exportar_snapshot(self, ruta=None):
+        """Exporta todos los chunks (con vectores) a un snapshot binario"""
+        ruta = ruta or f"snapshot_{self.index_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        try:
+            exportar_snapshot(self.search_client, ruta, index_name=self.index_name,
+                              index_client=self.index_client)
+        except Exception as e:
+            print(f"❌ Error exportando snapshot: {e}")
+    
+    def restaurar_snapshot(self, ruta):
+        """Restaura un snapshot en el índice actual (lo crea si no existe)"""
+        try:
+            asegurar_indice(self.index_client, self.index_name)
+            resultado = restaurar_snapshot(ruta, self.search_client, almacen=self.almacen)
+            self.estadisticas.invalidar()
+            return resultado
+        except Exception as e:
+            print(f"❌ Error restaurando snapshot: {e}")
+
+    def reconstruir_enrutado(self):
+        """Recalcula los centroides de todos los documentos (p. ej. tras una migración)"""
+        print("\n🧭 Reconstruyendo enrutado por documento...")
+        try:
+            total = self.enrutador.reconstruir(self.search_client)
+            print(f"✅ Enrutado actualizado para {total} documentos")
+        except Exception as e:
+            print(f"❌ Error reconstruyendo enrutado: {e}")
+
 def main():
     gestor = GestorIndice()
     
@@ -249,9 +336,13 @@ def main():
         print("4. Limpiar TODO el índice")
         print("5. Exportar estadísticas")
         print("6. Buscar duplicados")
-        print("7. Salir")
+        print("7. Migrar a un nuevo índice (sin regenerar embeddings)")
+        print("8. Exportar snapshot (chunks + vectores)")
+        print("9. Restaurar snapshot")
+        print("10. Reconstruir enrutado por documento")
+        print("11. Salir")
         
-        opcion = input("\nSelecciona opción (1-7): ")
+        opcion = input("\nSelecciona opción (1-11): ")
         
         if opcion == "1":
             gestor.info_indice()
@@ -273,6 +364,24 @@ def main():
             gestor.buscar_duplicados()
             
         elif opcion == "7":
+            origen = input(f"\nÍndice origen [{gestor.index_name}]: ") or gestor.index_name
+            destino = input("Índice destino: ")
+            alias = input("Alias a actualizar (vacío = actualizar .env): ") or None
+            source = input("Valor de 'source' para documentos sin él (opcional): ") or None
+            gestor.migrar_indice(origen, destino, alias, source)
+            
+        elif opcion == "8":
+            ruta = input("\nCarpeta destino (vacío = automática): ") or None
+            gestor.exportar_snapshot(ruta)
+            
+        elif opcion == "9":
+            ruta = input("\nCarpeta del snapshot: ")
+            gestor.restaurar_snapshot(ruta)
+            
+        elif opcion == "10":
+            gestor.reconstruir_enrutado()
+            
+        elif opcion == "11":
             print("\n👋 ¡Hasta luego!")
             break
             
@@ -0,0 +1,451 @@
+"""
+indice_local.py - Índice local en memoria compatible con la interfaz de SearchClient
+Búsqueda híbrida (BM25 + coseno, fusionadas con RRF como hace Azure AI Search)
+para usar como shard local, entorno de desarrollo o sustituto en pruebas.
+"""
+
+import os
+import re
+import json
+import math
+from collections import defaultdict, namedtuple
+
+import numpy as np
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+_FILTRO_CMP = re.compile(r"^\s*(\w+)\s+(eq|ne|gt|ge|lt|le)\s+(?:'((?:[^']|'')*)'|(null)|(-?\d+))\s*$")
+_COMPARADORES = {
+    "eq": lambda a, b: a == b,
+    "ne": lambda a, b: a != b,
+    "gt": lambda a, b: a is not None and a > b,
+    "ge": lambda a, b: a is not None and a >= b,
+    "lt": lambda a, b: a is not None and a < b,
+    "le": lambda a, b: a is not None and a <= b,
+}
+_FILTRO_IN = re.compile(r"^\s*search\.in\(\s*(\w+)\s*,\s*'((?:[^']|'')*)'\s*(?:,\s*'([^']*)'\s*)?\)\s*$")
+
+
+# Misma forma que azure.search.documents.models.IndexingResult
+ResultadoIndexacion = namedtuple("ResultadoIndexacion", "key succeeded status_code error_message")
+
+
+def tokenizar(texto):
+    """Tokens en minúsculas"""
+    return _TOKEN.findall((texto or "").lower())
+
+
+def fusion_rrf(listas, k=60):
+    """Reciprocal Rank Fusion: {clave: puntaje} a partir de listas ordenadas de claves"""
+    puntajes = defaultdict(float)
+    for lista in listas:
+        for rango, clave in enumerate(lista):
+            puntajes[clave] += 1.0 / (k + rango + 1)
+    return puntajes
+
+
+def compilar_filtro(filtro):
+    """Convierte un filtro OData simple (comparaciones, search.in, and, or) en una función sobre el documento"""
+    if not filtro:
+        return lambda doc: True
+
+    texto = filtro.strip()
+    while texto.startswith("(") and texto.endswith(")") and _parentesis_balanceados(texto[1:-1]):
+        texto = texto[1:-1].strip()
+
+    for operador, combinar in ((" or ", any), (" and ", all)):
+        partes = _dividir_nivel_superior(texto, operador)
+        if len(partes) > 1:
+            funciones = [compilar_filtro(p) for p in partes]
+            return lambda doc, fs=funciones, c=combinar: c(f(doc) for f in fs)
+
+    m = _FILTRO_CMP.match(texto)
+    if m:
+        campo, operador, cadena, nulo, numero = m.groups()
+        if nulo:
+            es_nulo = operador == "eq"
+            return lambda doc: (doc.get(campo) is None) == es_nulo
+        valor = int(numero) if numero is not None else cadena.replace("''", "'")
+        comparar = _COMPARADORES[operador]
+        return lambda doc: comparar(doc.get(campo), valor)
+
+    m = _FILTRO_IN.match(texto)
+    if m:
+        campo, valores, separador = m.groups()
+        separadores = separador or " ,"
+        conjunto = set(v for v in re.split("[" + re.escape(separadores) + "]", valores.replace("''", "'")) if v)
+        return lambda doc: doc.get(campo) in conjunto
+
+    raise ValueError(f"Filtro no soportado por el índice local: {filtro}")
+
+
+def fuentes_de_filtro(filtro):
+    """Documentos a los que limita un filtro (source eq / search.in(source)) y si no limita nada más
+
+    Devuelve (conjunto o None, True si el filtro es solo sobre source). Sirve al
+    índice ANN para buscar directamente en esos documentos.
+    """
+    if not filtro:
+        return None, True
+    fuentes, solo_fuentes = None, True
+    for parte in _dividir_nivel_superior(filtro.strip(), " and "):
+        conjunto = None
+        m = _FILTRO_CMP.match(parte)
+        if m and m.group(1) == "source" and m.group(2) == "eq" and m.group(3) is not None:
+            conjunto = {m.group(3).replace("''", "'")}
+        m = _FILTRO_IN.match(parte)
+        if m and m.group(1) == "source":
+            separadores = m.group(3) or " ,"
+            conjunto = set(v for v in re.split("[" + re.escape(separadores) + "]",
+                                               m.group(2).replace("''", "'")) if v)
+        if conjunto is None:
+            solo_fuentes = False
+        else:
+            fuentes = conjunto if fuentes is None else fuentes & conjunto
+    return fuentes, solo_fuentes
+
+
+def _parentesis_balanceados(texto):
+    nivel = 0
+    for c in texto:
+        nivel += (c == "(") - (c == ")")
+        if nivel < 0:
+            return False
+    return nivel == 0
+
+
+def _dividir_nivel_superior(texto, operador):
+    """Divide por un operador lógico ignorando paréntesis y cadenas"""
+    partes, nivel, en_cadena, inicio, i = [], 0, False, 0, 0
+    while i < len(texto):
+        c = texto[i]
+        if c == "'":
+            en_cadena = not en_cadena
+        elif not en_cadena:
+            if c == "(":
+                nivel += 1
+            elif c == ")":
+                nivel -= 1
+            elif nivel == 0 and texto.startswith(operador, i):
+                partes.append(texto[inicio:i])
+                i += len(operador)
+                inicio = i
+                continue
+        i += 1
+    partes.append(texto[inicio:])
+    return partes
+
+
+class ResultadosLocales(list):
+    """Lista de resultados con la misma interfaz que SearchItemPaged"""
+
+    def __init__(self, items, count=None, facets=None):
+        super().__init__(items)
+        self._count = count
+        self._facets = facets
+
+    def get_count(self):
+        return self._count
+
+    def get_facets(self):
+        return self._facets
+
+
+class IndiceLocal:
+    """Índice híbrido en memoria con el mismo esquema de chunks que Azure"""
+
+    def __init__(self, nombre="local", dimensiones=1536, campo_vector="content_vector", k1=1.2, b=0.75):
+        self.nombre = nombre
+        self.dimensiones = dimensiones
+        self.campo_vector = campo_vector
+        self.k1 = k1
+        self.b = b
+
+        self.documentos = []            # dicts sin el vector
+        self.posicion = {}              # id -> fila
+        self.vivos = []                 # False si la fila fue eliminada
+        self._vectores = []             # filas pendientes de apilar
+        self._matriz = np.zeros((0, dimensiones), dtype=np.float32)
+        self._postings = defaultdict(dict)  # término -> {fila: frecuencia}
+        self._longitudes = {}
+        self._sin_indexar = []          # filas cuyo texto aún no está en los postings
+        self.ann = None                 # IndiceANN opcional para la búsqueda vectorial
+
+    # ------------------------------------------------------------------ carga
+    def __len__(self):
+        return sum(self.vivos)
+
+    def campos(self):
+        """Nombres de campo presentes en los documentos"""
+        nombres = {self.campo_vector}
+        for doc in self.documentos[:100]:
+            nombres.update(doc)
+        return nombres
+
+    def usar_ann(self, ann):
+        """Búsqueda vectorial aproximada con un IndiceANN (ver ann_local.py)"""
+        self.ann = ann
+        return self
+
+    def upload_documents(self, documents):
+        """Agrega o reemplaza documentos (clave: id)"""
+        resultados = []
+        con_vector = []
+        for doc in documents:
+            if doc["id"] in self.posicion:
+                self.delete_documents([{"id": doc["id"]}])
+
+            fila = len(self.documentos)
+            vector = doc.get(self.campo_vector)
+            datos = {k: v for k, v in doc.items() if k != self.campo_vector}
+
+            self.documentos.append(datos)
+            self.posicion[doc["id"]] = fila
+            self.vivos.append(True)
+            self._vectores.append(
+                np.zeros(self.dimensiones, dtype=np.float32) if vector is None
+                else np.asarray(vector, dtype=np.float32)
+            )
+
+            if vector is not None:
+                con_vector.append(doc)
+
+            self._sin_indexar.append(fila)
+            resultados.append(ResultadoIndexacion(doc["id"], True, 201, None))
+
+        if self.ann is not None and con_vector:
+            self.ann.agregar(
+                [doc["id"] for doc in con_vector],
+                np.array([doc[self.campo_vector] for doc in con_vector], dtype=np.float32),
+                [doc.get("source") for doc in con_vector]
+            )
+        return resultados
+
+    merge_or_upload_documents = upload_documents
+
+    def delete_documents(self, documents):
+        """Marca documentos como eliminados"""
+        resultados = []
+        for doc in documents:
+            fila = self.posicion.pop(doc["id"], None)
+            if fila is not None:
+                self.vivos[fila] = False
+                if self.ann is not None:
+                    self.ann.eliminar([doc["id"]])
+            resultados.append(ResultadoIndexacion(doc["id"], True, 200, None))
+        return resultados
+
+    def _indexar_texto(self):
+        """Construye los postings BM25 de forma perezosa (la carga masiva queda instantánea)"""
+        for fila in self._sin_indexar:
+            tokens = tokenizar(self.documentos[fila].get("content", ""))
+            self._longitudes[fila] = len(tokens)
+            for t in tokens:
+                self._postings[t][fila] = self._postings[t].get(fila, 0) + 1
+        self._sin_indexar = []
+
+    def matriz(self):
+        """Matriz (n, dimensiones) de vectores normalizados"""
+        if self._vectores:
+            nuevos = np.vstack(self._vectores)
+            nuevos /= np.linalg.norm(nuevos, axis=1, keepdims=True) + 1e-12
+            self._matriz = np.vstack([self._matriz, nuevos])
+            self._vectores = []
+        return self._matriz
+
+    # ---------------------------------------------------------------- búsqueda
+    def _filas_validas(self, filtro):
+        if not filtro:
+            return np.array(self.vivos, dtype=bool)
+        condicion = compilar_filtro(filtro)
+        return np.array(
+            [vivo and condicion(doc) for vivo, doc in zip(self.vivos, self.documentos)],
+            dtype=bool
+        )
+
+    def _ranking_texto(self, search_text, validas, limite):
+        """BM25 sobre las filas válidas"""
+        if not search_text or search_text.strip() == "*":
+            return [], {}
+        self._indexar_texto()
+        n = len(self.documentos)
+        media = (sum(self._longitudes.values()) / n) if n else 0.0
+        puntajes = defaultdict(float)
+        for t in set(tokenizar(search_text)):
+            postings = self._postings.get(t)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for fila, tf in postings.items():
+                if not validas[fila]:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self._longitudes[fila] / (media or 1))
+                puntajes[fila] += idf * tf * (self.k1 + 1) / (tf + norm)
+        orden = sorted(puntajes, key=puntajes.get, reverse=True)[:limite]
+        return orden, {fila: puntajes[fila] for fila in orden}
+
+    def _ranking_vector(self, consulta, validas):
+        """Coseno exacto sobre las filas válidas"""
+        matriz = self.matriz()
+        if not len(matriz) or not validas.any():
+            return [], {}
+        # Sin modificar el vector de quien llama (asarray no copia un float32)
+        q = np.asarray(consulta.vector, dtype=np.float32)
+        q = q / (np.linalg.norm(q) + 1e-12)
+        filas = np.flatnonzero(validas)
+        sims = matriz[filas] @ q
+        k = min(getattr(consulta, "k_nearest_neighbors", None) or 50, len(filas))
+        mejores = np.argpartition(-sims, k - 1)[:k]
+        mejores = mejores[np.argsort(-sims[mejores])]
+        return [int(filas[i]) for i in mejores], {int(filas[i]): float(sims[i]) for i in mejores}
+
+    def _ranking_ann(self, consulta, filtro):
+        """Candidatos del índice ANN, filtrados y reordenados con el coseno exacto"""
+        k = getattr(consulta, "k_nearest_neighbors", None) or 50
+        fuentes, solo_fuentes = fuentes_de_filtro(filtro)
+        # Si el filtro restringe algo más que source, se piden más candidatos para filtrarlos
+        n = k * self.ann.reordenar * (1 if solo_fuentes else 4)
+        ids, _ = self.ann.candidatos(consulta.vector, n, fuentes)
+
+        filas = [self.posicion[i] for i in ids if i in self.posicion]
+        if filtro and not solo_fuentes:
+            condicion = compilar_filtro(filtro)
+            filas = [f for f in filas if condicion(self.documentos[f])]
+        if not filas:
+            return [], {}
+        q = np.asarray(consulta.vector, dtype=np.float32)
+        q = q / (np.linalg.norm(q) + 1e-12)
+        sims = self.matriz()[filas] @ q
+        mejores = np.argsort(-sims)[:k]
+        return [filas[i] for i in mejores], {filas[i]: float(sims[i]) for i in mejores}
+
+    def search(self, search_text=None, vector_queries=None, filter=None, select=None,
+               top=None, skip=None, include_total_count=None, facets=None, order_by=None, **kwargs):
+        """Misma firma básica que SearchClient.search"""
+        top = 50 if top is None else top
+        skip = skip or 0
+        usar_ann = bool(self.ann is not None and len(self.ann) and vector_queries)
+        con_texto = bool(search_text and search_text.strip() != "*")
+        # Con ANN una búsqueda solo vectorial no recorre todas las filas para filtrar
+        if usar_ann and not (con_texto or include_total_count or facets):
+            validas = None
+        else:
+            validas = self._filas_validas(filter)
+
+        rankings = []
+        puntajes = {}
+        texto, puntajes_texto = [], {}
+        if con_texto:
+            texto, puntajes_texto = self._ranking_texto(search_text, validas, limite=max(top + skip, 50))
+        if texto:
+            rankings.append(texto)
+            puntajes = puntajes_texto
+        for consulta in vector_queries or []:
+            if usar_ann:
+                filas, sims = self._ranking_ann(consulta, filter)
+            else:
+                filas, sims = self._ranking_vector(consulta, validas)
+            rankings.append(filas)
+            puntajes = sims
+
+        if len(rankings) > 1:
+            puntajes = fusion_rrf(rankings)
+        if rankings:
+            orden = sorted(puntajes, key=puntajes.get, reverse=True)
+        else:
+            orden = [int(f) for f in np.flatnonzero(validas)]
+            puntajes = {f: 1.0 for f in orden}
+
+        # order_by ("campo asc|desc", los nulos primero en ascendente como en Azure)
+        for especificacion in reversed(order_by or []):
+            campo, _, sentido = especificacion.strip().partition(" ")
+            valor = lambda fila, c=campo: (self.documentos[fila].get(c) is not None, self.documentos[fila].get(c))
+            orden = sorted(orden, key=valor, reverse=sentido.strip().lower() == "desc")
+
+        items = []
+        matriz = self.matriz()
+        for fila in orden[skip:skip + top]:
+            doc = dict(self.documentos[fila])
+            if select is None or self.campo_vector in select:
+                doc[self.campo_vector] = matriz[fila].tolist()
+            if select is not None:
+                doc = {k: v for k, v in doc.items() if k in select}
+            doc["@search.score"] = puntajes[fila]
+            items.append(doc)
+
+        conteo = int(validas.sum()) if include_total_count else None
+        facetas = None
+        if facets:
+            facetas = {}
+            for especificacion in facets:
+                campo, *opciones = especificacion.split(",")
+                opciones = dict(o.split(":", 1) for o in opciones if ":" in o)
+                cuentas = defaultdict(int)
+                for fila in np.flatnonzero(validas):
+                    valor = self.documentos[fila].get(campo)
+                    if valor is not None:
+                        cuentas[valor] += 1
+                if opciones.get("sort") == "value":
+                    ordenadas = sorted(cuentas.items())
+                else:
+                    ordenadas = sorted(cuentas.items(), key=lambda x: (-x[1], str(x[0])))
+                facetas[campo] = [
+                    {"value": v, "count": c}
+                    for v, c in ordenadas[:int(opciones.get("count", 10))]
+                ]
+        return ResultadosLocales(items, conteo, facetas)
+
+    @classmethod
+    def desde_arrays(cls, documentos, vectores, nombre="local"):
+        """Crea un índice sin copiar los vectores (p. ej. desde un np.memmap)
+
+        Si los vectores ya vienen normalizados (caso de los embeddings de Azure
+        OpenAI) se usan tal cual; si no, se normaliza una copia.
+        """
+        indice = cls(nombre=nombre, dimensiones=vectores.shape[1])
+        muestra = np.asarray(vectores[:1000], dtype=np.float32)
+        normas = np.linalg.norm(muestra, axis=1)
+        if len(muestra) and np.allclose(normas[normas > 0], 1.0, atol=1e-3):
+            indice._matriz = vectores
+        else:
+            copia = np.array(vectores, dtype=np.float32)
+            copia /= np.linalg.norm(copia, axis=1, keepdims=True) + 1e-12
+            indice._matriz = copia
+
+        indice.documentos = list(documentos)
+        indice.posicion = {doc["id"]: i for i, doc in enumerate(indice.documentos)}
+        indice.vivos = [True] * len(indice.documentos)
+        indice._sin_indexar = list(range(len(indice.documentos)))
+        return indice
+
+    def get_document_count(self):
+        return len(self)
+
+    # ------------------------------------------------------------ persistencia
+    def guardar(self, ruta):
+        """Guarda el índice en <ruta>.npy (vectores) y <ruta>.json (metadatos)
+
+        Si tiene índice ANN, se guarda junto a él en <ruta>.ann/.
+        """
+        filas = [i for i, vivo in enumerate(self.vivos) if vivo]
+        np.save(f"{ruta}.npy", self.matriz()[filas])
+        with open(f"{ruta}.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "nombre": self.nombre,
+                "dimensiones": self.dimensiones,
+                "documentos": [self.documentos[i] for i in filas]
+            }, f, ensure_ascii=False, default=str)
+        if self.ann is not None:
+            self.ann.guardar(f"{ruta}.ann")
+
+    @classmethod
+    def cargar(cls, ruta, con_ann=True):
+        """Carga un índice guardado con guardar() (y su ANN en <ruta>.ann/, si existe)"""
+        with open(f"{ruta}.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        vectores = np.load(f"{ruta}.npy", mmap_mode="r")
+        indice = cls.desde_arrays(meta["documentos"], vectores, nombre=meta["nombre"])
+        if con_ann and os.path.isdir(f"{ruta}.ann"):
+            from ann_local import IndiceANN
+            indice.usar_ann(IndiceANN.cargar(f"{ruta}.ann"))
+        return indice
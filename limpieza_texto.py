@@ -0,0 +1,102 @@
+"""
+limpieza_texto.py - Limpieza del texto extraído de los PDFs antes de dividirlo en chunks
+Las presentaciones y la documentación de fabricantes repiten en cada página el
+título, el pie, el número de página y líneas legales. Aquí se detectan las
+líneas que se repiten entre páginas de un mismo documento, por frecuencia y
+posición, y se eliminan; también se normalizan los espacios en blanco. Menos
+texto repetido son menos chunks, menos embeddings y menos tokens de prompt.
+
+    cabecera / pie   líneas de las primeras o últimas `zona` líneas de la página
+                     que aparecen en al menos `min_fraccion` de las páginas
+    cuerpo           líneas largas que aparecen en casi todas las páginas, en
+                     cualquier posición (avisos legales, marcas de agua)
+
+En cabeceras y pies los números se ignoran al comparar, así que "Página 3 de 20"
+cuenta como repetida; en el cuerpo solo se quitan líneas idénticas, para no
+borrar filas de tablas ni pasos numerados. Una página nunca queda vacía: si todo
+parecería repetido se conserva su texto.
+"""
+
+import re
+from collections import Counter
+
+_ESPACIOS = re.compile(r"[ \t\u00a0\u2000-\u200b\u202f\u205f\u3000]+")
+_NUMEROS = re.compile(r"\d+")
+_INVISIBLES = dict.fromkeys(map(ord, "\u200c\u200d\u2060\ufeff\u00ad"))
+
+
+def normalizar_espacios(texto):
+    """Espacios seguidos a uno, sin espacios al borde de cada línea ni líneas vacías"""
+    texto = (texto or "").translate(_INVISIBLES).replace("\r", "\n")
+    lineas = (_ESPACIOS.sub(" ", linea).strip() for linea in texto.split("\n"))
+    return "\n".join(linea for linea in lineas if linea)
+
+
+def texto_linea(linea):
+    """Forma de comparación exacta: minúsculas y sin espacios extra"""
+    return " ".join(linea.lower().split())
+
+
+def clave_linea(linea):
+    """Forma de comparación de cabeceras y pies: además, los números como '#'"""
+    return _NUMEROS.sub("#", texto_linea(linea))
+
+
+def detectar_repetidas(paginas, zona=3, min_fraccion=0.5, min_paginas=3,
+                       fraccion_cuerpo=0.8, longitud_cuerpo=15):
+    """Claves de línea a quitar por posición: {"cabecera", "pie", "cuerpo"}
+
+    paginas: lista de listas de líneas (ya normalizadas).
+    """
+    vacio = {"cabecera": set(), "pie": set(), "cuerpo": set()}
+    if len(paginas) < min_paginas:
+        return vacio
+
+    arriba, abajo, cualquiera = Counter(), Counter(), Counter()
+    for lineas in paginas:
+        arriba.update({clave_linea(l) for l in lineas[:zona]})
+        abajo.update({clave_linea(l) for l in lineas[-zona:]})
+        cualquiera.update({texto_linea(l) for l in lineas})
+
+    n = len(paginas)
+    minimo = max(min_paginas, min_fraccion * n)
+    return {
+        "cabecera": {c for c, veces in arriba.items() if veces >= minimo},
+        "pie": {c for c, veces in abajo.items() if veces >= minimo},
+        "cuerpo": {c for c, veces in cualquiera.items()
+                   if veces >= max(min_paginas, fraccion_cuerpo * n) and len(c) >= longitud_cuerpo},
+    }
+
+
+def _limpiar_pagina(lineas, repetidas, zona):
+    """Quita cabeceras y pies desde los bordes hacia dentro y las líneas de cuerpo repetidas"""
+    inicio, fin = 0, len(lineas)
+    while inicio < min(zona, fin) and clave_linea(lineas[inicio]) in repetidas["cabecera"]:
+        inicio += 1
+    while fin > max(inicio, len(lineas) - zona) and clave_linea(lineas[fin - 1]) in repetidas["pie"]:
+        fin -= 1
+    return [l for l in lineas[inicio:fin] if texto_linea(l) not in repetidas["cuerpo"]]
+
+
+def limpiar_paginas(textos, zona=3, min_fraccion=0.5):
+    """Textos de página limpios y un resumen de lo eliminado
+
+    Devuelve (textos, {"caracteres_antes", "caracteres_despues", "lineas_eliminadas",
+    "patrones"}); las páginas conservan su posición aunque queden vacías.
+    """
+    paginas = [normalizar_espacios(t).split("\n") for t in textos]
+    paginas = [[l for l in lineas if l] for lineas in paginas]
+    repetidas = detectar_repetidas(paginas, zona=zona, min_fraccion=min_fraccion)
+
+    limpias, eliminadas = [], 0
+    for lineas in paginas:
+        restantes = _limpiar_pagina(lineas, repetidas, zona) or lineas
+        eliminadas += len(lineas) - len(restantes)
+        limpias.append("\n".join(restantes))
+
+    return limpias, {
+        "caracteres_antes": sum(len(t or "") for t in textos),
+        "caracteres_despues": sum(len(t) for t in limpias),
+        "lineas_eliminadas": eliminadas,
+        "patrones": sum(len(c) for c in repetidas.values()),
+    }
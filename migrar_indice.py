@@ -0,0 +1,202 @@
+"""
+migrar_indice.py - Migración de un índice a un nuevo esquema sin regenerar embeddings
+Copia los documentos (vectores incluidos) del índice origen al destino, verifica
+conteos y cambia a los consumidores mediante un alias o la variable del .env.
+"""
+
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+from azure.search.documents import SearchClient
+from azure.search.documents.indexes import SearchIndexClient
+from azure.search.documents.indexes.models import SearchAlias
+from azure.core.credentials import AzureKeyCredential
+from dotenv import load_dotenv
+
+from cargar_pdf import asegurar_indice
+from enrutado_fuentes import EnrutadorFuentes
+from recorrido_indice import recorrer_paginas
+from subida_indice import SubidorDocumentos
+
+load_dotenv()
+
+
+def actualizar_puntero_config(variable, valor, archivo=".env"):
+    """Actualiza (o agrega) VARIABLE=valor en el archivo de configuración"""
+    lineas = []
+    if os.path.exists(archivo):
+        with open(archivo, "r", encoding="utf-8") as f:
+            lineas = f.read().splitlines()
+
+    encontrada = False
+    for i, linea in enumerate(lineas):
+        if linea.split("=", 1)[0].strip() == variable:
+            lineas[i] = f"{variable}={valor}"
+            encontrada = True
+    if not encontrada:
+        lineas.append(f"{variable}={valor}")
+
+    with open(archivo, "w", encoding="utf-8") as f:
+        f.write("\n".join(lineas) + "\n")
+
+
+class MigradorIndice:
+    def __init__(self, index_client=None, search_endpoint=None, search_key=None):
+        self.search_endpoint = search_endpoint or os.getenv("AZURE_SEARCH_ENDPOINT")
+        self.search_key = search_key or os.getenv("AZURE_SEARCH_KEY")
+        self.index_client = index_client or SearchIndexClient(
+            endpoint=self.search_endpoint,
+            credential=AzureKeyCredential(self.search_key)
+        )
+
+    def cliente(self, nombre):
+        """SearchClient para un índice"""
+        return SearchClient(
+            endpoint=self.search_endpoint,
+            index_name=nombre,
+            credential=AzureKeyCredential(self.search_key)
+        )
+
+    def contar(self, search_client):
+        results = search_client.search("*", include_total_count=True, top=0)
+        return results.get_count()
+
+    def migrar(self, origen, destino, renombrar=None, valores=None, alias=None,
+               variable_config=None, max_workers=4, esquema=None, enrutado=True):
+        """Copia origen -> destino con los vectores existentes y cambia el puntero
+
+        renombrar: {campo_origen: campo_destino}
+        valores: valores por defecto para campos ausentes (p. ej. {"source": "doc.pdf"})
+        alias: nombre del alias a apuntar al destino
+        variable_config: variable del .env a actualizar (p. ej. AZURE_SEARCH_INDEX_NAME_V2)
+        enrutado: reconstruir el índice de enrutado por documento para el destino
+        """
+        renombrar = renombrar or {}
+        valores = dict(valores or {})
+        valores.setdefault("fecha_carga", datetime.now(timezone.utc).isoformat())
+        inicio = time.perf_counter()
+
+        print(f"\n🚚 Migrando '{origen}' -> '{destino}'")
+
+        # 1. Esquemas
+        campos_origen = [f.name for f in self.index_client.get_index(origen).fields]
+        # Un destino que ya existe conserva sus campos (los atributos no se pueden cambiar)
+        if esquema is not None:
+            indice_destino = esquema
+            self.index_client.create_or_update_index(indice_destino)
+        else:
+            indice_destino = asegurar_indice(self.index_client, destino)
+        campos_destino = {f.name for f in indice_destino.fields}
+        print(f"   ✅ Esquema destino listo ({len(campos_destino)} campos)")
+
+        cliente_origen = self.cliente(origen)
+        cliente_destino = self.cliente(destino)
+
+        def transformar(doc):
+            nuevo = {}
+            for campo, valor in doc.items():
+                if campo.startswith("@search."):
+                    continue
+                campo_destino = renombrar.get(campo, campo)
+                if campo_destino in campos_destino:
+                    nuevo[campo_destino] = valor
+            for campo, valor in valores.items():
+                if campo in campos_destino and nuevo.get(campo) is None:
+                    nuevo[campo] = valor
+            return nuevo
+
+        # 2. Lectura paralela por partición + subida paralela por lotes de tamaño adaptativo
+        leidos = 0
+        particion = "source" if "source" in campos_origen else None
+        subidor = SubidorDocumentos(
+            cliente_destino,
+            max_workers=max_workers,
+            accion="merge_or_upload",
+            log=print
+        )
+
+        for pagina in recorrer_paginas(
+            cliente_origen,
+            select=campos_origen,
+            max_workers=max_workers,
+            campo_particion=particion
+        ):
+            leidos += len(pagina)
+            subidor.agregar_muchos(transformar(doc) for doc in pagina)
+            print(f"   📦 Leídos {leidos} documentos...")
+
+        resumen = subidor.finalizar()
+        fallidos = [f["key"] for f in resumen["fallidos"]]
+
+        print(f"   ✅ Copiados {resumen['subidos']}/{leidos} documentos "
+              f"({resumen['docs_s']:.0f} docs/s, {resumen['bytes_s']/1024/1024:.1f} MB/s)")
+        if fallidos:
+            print(f"   ❌ {len(fallidos)} documentos fallaron: {fallidos[:10]}")
+
+        # 3. Verificación de conteos (el índice tarda unos segundos en reflejar las subidas)
+        total_origen = self.contar(cliente_origen)
+        total_destino = 0
+        for _ in range(15):
+            total_destino = self.contar(cliente_destino)
+            if total_destino >= total_origen:
+                break
+            time.sleep(2)
+
+        verificado = total_destino == total_origen and not fallidos
+        estado = "✅" if verificado else "❌"
+        print(f"   {estado} Conteo origen: {total_origen} | destino: {total_destino}")
+
+        # 4. Enrutado por documento del nombre que usarán los consumidores
+        #    ('<alias>-fuentes' o '<destino>-fuentes'), reconstruido desde el destino
+        if verificado and enrutado:
+            enrutador = EnrutadorFuentes(alias or destino, self.search_endpoint, self.search_key)
+            try:
+                total = enrutador.reconstruir(cliente_destino)
+                print(f"   🧭 Enrutado '{enrutador.nombre}' reconstruido ({total} documentos)")
+            except Exception as e:
+                print(f"   ⚠️ No se pudo reconstruir el enrutado: {e}")
+
+        # 5. Cambio de consumidores solo si la copia es completa
+        if verificado:
+            if alias:
+                self.index_client.create_or_update_alias(SearchAlias(name=alias, indexes=[destino]))
+                print(f"   🔀 Alias '{alias}' apunta ahora a '{destino}'")
+            if variable_config:
+                actualizar_puntero_config(variable_config, destino)
+                print(f"   🔀 {variable_config}={destino} actualizado en .env")
+        elif alias or variable_config:
+            print("   ⚠️ No se cambió el puntero: la verificación no coincide")
+
+        duracion = time.perf_counter() - inicio
+        print(f"⏱️ Migración completada en {duracion:.1f}s (sin regenerar embeddings)")
+
+        return {
+            "origen": origen,
+            "destino": destino,
+            "leidos": leidos,
+            "fallidos": fallidos,
+            "total_origen": total_origen,
+            "total_destino": total_destino,
+            "verificado": verificado,
+            "duracion_s": duracion
+        }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Uso: python migrar_indice.py <origen> <destino> [alias] [source_por_defecto]")
+        sys.exit(1)
+
+    origen, destino = sys.argv[1], sys.argv[2]
+    alias = sys.argv[3] if len(sys.argv) > 3 and sys.argv[3] else None
+    valores = {"source": sys.argv[4]} if len(sys.argv) > 4 else None
+
+    MigradorIndice().migrar(
+        origen,
+        destino,
+        valores=valores,
+        alias=alias,
+        variable_config=None if alias else "AZURE_SEARCH_INDEX_NAME_V2"
+    )
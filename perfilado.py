@@ -0,0 +1,193 @@
+"""
+perfilado.py - Perfilado opcional de memoria y CPU por etapas
+Con RAG_PERFILADO=1 registra por etapa el tiempo, el CPU y el pico de memoria
+(tracemalloc, del proceso: con varias etapas en curso en distintos hilos incluye
+lo que asignan todas y se marca como compartido), muestrea las pilas de todos los hilos (tiempo de pared) para un
+flamegraph y sigue el RSS del proceso. Al terminar escribe:
+
+    perfil_<nombre>_<fecha>.json     informe compacto (etapas + RSS en el tiempo)
+    perfil_<nombre>_<fecha>.folded   pilas colapsadas (flamegraph.pl, speedscope)
+
+Desactivado, etapa() devuelve un contexto vacío compartido (sin costo apreciable).
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import nullcontext, contextmanager
+from datetime import datetime
+
+_NULO = nullcontext()
+
+
+def rss_actual():
+    """RSS del proceso en bytes (Linux: /proc; otros: pico vía getrusage)"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+            maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return maximo if sys.platform == "darwin" else maximo * 1024
+        except ImportError:
+            return 0
+
+
+def _pila(frame, limite=64):
+    """Pila de un frame como lista raíz -> hoja de 'funcion (archivo:línea de la definición)'"""
+    marcos = []
+    while frame is not None and len(marcos) < limite:
+        codigo = frame.f_code
+        marcos.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+        frame = frame.f_back
+    return marcos[::-1]
+
+
+class Perfilador:
+    def __init__(self, nombre, activo=None, intervalo_muestreo=None, intervalo_rss=None, carpeta="."):
+        self.nombre = nombre
+        self.activo = os.getenv("RAG_PERFILADO", "0") == "1" if activo is None else activo
+        self.intervalo_muestreo = intervalo_muestreo or float(os.getenv("RAG_PERFILADO_MUESTREO_MS", "10")) / 1000
+        self.intervalo_rss = intervalo_rss or 0.5
+        self.carpeta = carpeta
+        if not self.activo:
+            return
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._etapa_hilo = {}        # id de hilo -> ruta de etapas activa (para las pilas)
+        self._pilas = {}             # id de hilo -> etapas en curso (para marcar picos compartidos)
+        self.etapas = {}             # ruta -> métricas acumuladas
+        self.pilas = Counter()
+        self.rss = []
+        self._inicio = time.perf_counter()
+        self._detener = threading.Event()
+        self._finalizado = False
+
+        tracemalloc.start()
+        self._muestreador = threading.Thread(target=self._muestrear, name="perfilador", daemon=True)
+        self._muestreador.start()
+        atexit.register(self.finalizar)
+
+    # ---------------------------------------------------------------- etapas
+    def etapa(self, nombre):
+        """Contexto que mide una etapa; las etapas anidadas se nombran 'padre/hija'"""
+        if not self.activo:
+            return _NULO
+        return self._medir(nombre)
+
+    @contextmanager
+    def _medir(self, nombre):
+        pila = getattr(self._local, "pila", None)
+        if pila is None:
+            pila = self._local.pila = []
+        ruta = "/".join([p["ruta"] for p in pila[-1:]] + [nombre])
+        hilo = threading.get_ident()
+
+        # El pico de tracemalloc es del proceso: solo se reinicia si ningún otro
+        # hilo está dentro de una etapa (borraría su pico). Con etapas en curso
+        # en otros hilos el pico incluye lo de todas y se marca como compartido
+        with self._lock:
+            otras = [e for h, p in self._pilas.items() if h != hilo for e in p]
+            for e in otras:
+                e["compartido"] = True
+            _, pico_previo = tracemalloc.get_traced_memory()
+            if pila:
+                pila[-1]["pico"] = max(pila[-1]["pico"], pico_previo)
+            if not otras:
+                tracemalloc.reset_peak()
+            actual = {"ruta": ruta, "pico": 0, "compartido": bool(otras)}
+            pila.append(actual)
+            self._pilas[hilo] = pila
+            self._etapa_hilo[hilo] = ruta
+
+        inicio, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            duracion = time.perf_counter() - inicio
+            cpu = time.thread_time() - cpu
+            with self._lock:
+                _, pico = tracemalloc.get_traced_memory()
+                pico = max(pico, actual["pico"])
+                pila.pop()
+                if pila:
+                    pila[-1]["pico"] = max(pila[-1]["pico"], pico)
+                    pila[-1]["compartido"] = pila[-1]["compartido"] or actual["compartido"]
+                    self._etapa_hilo[hilo] = pila[-1]["ruta"]
+                else:
+                    self._etapa_hilo.pop(hilo, None)
+                    self._pilas.pop(hilo, None)
+
+                e = self.etapas.setdefault(ruta, {"llamadas": 0, "segundos": 0.0, "cpu_s": 0.0,
+                                                  "pico_tracemalloc_bytes": 0, "pico_compartido": 0,
+                                                  "rss_fin_bytes": 0})
+                e["llamadas"] += 1
+                e["segundos"] += duracion
+                e["cpu_s"] += cpu
+                e["pico_tracemalloc_bytes"] = max(e["pico_tracemalloc_bytes"], pico)
+                e["pico_compartido"] += actual["compartido"]
+                e["rss_fin_bytes"] = rss_actual()
+
+    # ------------------------------------------------------------- muestreo
+    def _muestrear(self):
+        propio = threading.get_ident()
+        nombres = {}
+        proximo_rss = 0.0
+        while not self._detener.wait(self.intervalo_muestreo):
+            ahora = time.perf_counter()
+            if ahora >= proximo_rss:
+                self.rss.append((round(ahora - self._inicio, 3), rss_actual()))
+                proximo_rss = ahora + self.intervalo_rss
+                nombres = {h.ident: h.name for h in threading.enumerate()}
+
+            for hilo, frame in sys._current_frames().items():
+                if hilo == propio:
+                    continue
+                etapa = self._etapa_hilo.get(hilo)
+                raiz = [nombres.get(hilo, str(hilo))] + ([f"[{etapa}]"] if etapa else [])
+                self.pilas[";".join(raiz + _pila(frame))] += 1
+
+    # -------------------------------------------------------------- informe
+    def finalizar(self):
+        """Detiene el muestreo y escribe el informe y las pilas colapsadas"""
+        if not self.activo or self._finalizado:
+            return None
+        self._finalizado = True
+        self._detener.set()
+        self._muestreador.join(timeout=1)
+        tracemalloc.stop()
+
+        base = os.path.join(self.carpeta, f"perfil_{self.nombre}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        informe = {
+            "nombre": self.nombre,
+            "duracion_s": round(time.perf_counter() - self._inicio, 3),
+            "muestras_cpu": sum(self.pilas.values()),
+            "intervalo_muestreo_ms": self.intervalo_muestreo * 1000,
+            "rss_pico_bytes": max((r for _, r in self.rss), default=rss_actual()),
+            "etapas": self.etapas,
+            "rss": self.rss
+        }
+        with open(f"{base}.json", "w", encoding="utf-8") as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+        with open(f"{base}.folded", "w", encoding="utf-8") as f:
+            for pila, muestras in self.pilas.most_common():
+                f.write(f"{pila} {muestras}\n")
+
+        print(f"\n🔬 PERFIL ({self.nombre}) - {informe['duracion_s']:.1f}s, "
+              f"RSS pico {informe['rss_pico_bytes']/1024/1024:.0f} MB")
+        print(f"   {'Etapa':<32}{'llamadas':>9}{'tiempo s':>10}{'CPU s':>9}{'pico MB':>9}")
+        for ruta, e in sorted(self.etapas.items()):
+            marca = "*" if e["pico_compartido"] else ""
+            print(f"   {ruta:<32}{e['llamadas']:>9}{e['segundos']:>10.2f}{e['cpu_s']:>9.2f}"
+                  f"{e['pico_tracemalloc_bytes']/1024/1024:>9.1f}{marca}")
+        if any(e["pico_compartido"] for e in self.etapas.values()):
+            print("   * pico del proceso: coincidió con etapas de otros hilos")
+        print(f"   📄 {base}.json | 🔥 {base}.folded")
+        return informe
@@ -0,0 +1,273 @@
+"""
+planificador.py - Planificador de llamadas a Azure OpenAI compartido entre procesos
+Cuando consultar.py y una carga masiva de cargar_pdf.py usan el mismo despliegue,
+los embeddings de la carga agotan la cuota y las preguntas reciben 429. El
+planificador reparte los tokens por minuto (TPM) del despliegue entre clases
+de prioridad:
+
+    interactiva   preguntas de consultar.py en modo interactivo
+    lote          consultar.py --batch
+    ingesta       cargar_pdf.py (carga, reanudación y vigilancia)
+
+Cada llamada pide turno antes de salir. Se admite si cabe en la ventana del
+último minuto (total y cuota de su clase) y no hay ninguna llamada de una
+clase más prioritaria esperando; así las preguntas pasan primero y la carga
+aprovecha la capacidad que sobra. Una parte del TPM queda reservada a las
+preguntas interactivas para que no esperen a que se vacíe la ventana. El estado vive en un SQLite (modo WAL) que
+comparten todos los procesos de la máquina.
+
+Se activa con RAG_PLANIFICADOR_TPM; `python planificador.py` muestra el estado.
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import threading
+from itertools import count
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+from plazos import SIN_PLAZO
+
+CLASES = ("interactiva", "lote", "ingesta")
+
+# Fracción máxima del TPM que puede ocupar cada clase en la ventana de un minuto
+CUOTAS_POR_DEFECTO = {"interactiva": 1.0, "lote": 0.7, "ingesta": 0.6}
+
+# Fracción del TPM que solo pueden usar las preguntas interactivas: aunque la
+# carga y los lotes llenen el resto, una pregunta nueva encuentra hueco
+RESERVA_POR_DEFECTO = 0.2
+
+VENTANA_S = 60
+LATIDO_MAXIMO_S = 5  # una espera sin latido más antiguo es de un proceso que ya no existe
+
+
+class _TurnoNulo:
+    def ajustar(self, tokens_reales):
+        pass
+
+
+SIN_TURNO = nullcontext(_TurnoNulo())
+
+
+def leer_cuotas(texto):
+    """'interactiva=1,lote=0.7,ingesta=0.6' -> dict (las clases omitidas, por defecto)"""
+    cuotas = dict(CUOTAS_POR_DEFECTO)
+    for parte in (texto or "").split(","):
+        if "=" in parte:
+            clase, valor = parte.split("=", 1)
+            if clase.strip() in CLASES:
+                cuotas[clase.strip()] = float(valor)
+    return cuotas
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(int(len(ordenados) * p), len(ordenados) - 1)]
+
+
+class Turno:
+    """Tokens admitidos para una llamada; ajustar() corrige la estimación con el uso real"""
+
+    def __init__(self, planificador, fila):
+        self._planificador = planificador
+        self._fila = fila
+
+    def ajustar(self, tokens_reales):
+        if tokens_reales:
+            self._planificador._ajustar(self._fila, tokens_reales)
+
+
+class Planificador:
+    def __init__(self, ruta=None, tpm=None, cuotas=None, reserva=None):
+        tpm = tpm or os.getenv("RAG_PLANIFICADOR_TPM")
+        self.tpm = int(tpm) if tpm else None
+        self.activo = bool(self.tpm)
+        self.ruta = ruta or os.getenv("RAG_PLANIFICADOR", "planificador.db")
+        self.cuotas = cuotas or leer_cuotas(os.getenv("RAG_PLANIFICADOR_CUOTAS"))
+        if reserva is None:
+            reserva = float(os.getenv("RAG_PLANIFICADOR_RESERVA", RESERVA_POR_DEFECTO))
+        self.reserva = reserva
+        # Segundos en cola de las últimas llamadas de este proceso
+        self.esperas = {clase: deque(maxlen=10000) for clase in CLASES}
+        if not self.activo:
+            return
+
+        self._lock = threading.Lock()
+        self._ids = count()
+        self._conexion = sqlite3.connect(self.ruta, timeout=30, isolation_level=None,
+                                         check_same_thread=False)
+        with self._lock:
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute("PRAGMA synchronous=NORMAL")
+            self._conexion.execute(
+                "CREATE TABLE IF NOT EXISTS uso ("
+                " fila INTEGER PRIMARY KEY AUTOINCREMENT, momento REAL NOT NULL,"
+                " clase TEXT NOT NULL, tokens INTEGER NOT NULL)"
+            )
+            self._conexion.execute(
+                "CREATE TABLE IF NOT EXISTS esperas ("
+                " id TEXT PRIMARY KEY, clase TEXT NOT NULL, prioridad INTEGER NOT NULL,"
+                " desde REAL NOT NULL, latido REAL NOT NULL)"
+            )
+            self._conexion.execute(
+                "CREATE TABLE IF NOT EXISTS estadisticas ("
+                " clase TEXT PRIMARY KEY, admitidas INTEGER NOT NULL,"
+                " espera_total_s REAL NOT NULL, espera_max_s REAL NOT NULL)"
+            )
+
+    # ------------------------------------------------------------------ turno
+    def turno(self, clase, tokens, plazo=SIN_PLAZO):
+        """Contexto que espera turno para una llamada de `tokens` estimados"""
+        if not self.activo:
+            return SIN_TURNO
+        return self._turno(clase, tokens, plazo)
+
+    @contextmanager
+    def _turno(self, clase, tokens, plazo):
+        fila = self.adquirir(clase, tokens, plazo)
+        yield Turno(self, fila)
+
+    def adquirir(self, clase, tokens, plazo=SIN_PLAZO):
+        """Bloquea hasta que la llamada cabe; devuelve su fila en la ventana de uso
+
+        Si el plazo vence (o se cancela) mientras espera, deja la cola y lanza PlazoVencido.
+        """
+        if clase not in CLASES:
+            raise ValueError(f"Clase de prioridad desconocida: {clase}")
+        prioridad = CLASES.index(clase)
+        limite_clase = self.tpm * self.cuotas[clase]
+        limite_total = self.tpm if prioridad == 0 else self.tpm * (1 - self.reserva)
+        id_espera = f"{os.getpid()}-{threading.get_ident()}-{next(self._ids)}"
+        inicio = time.time()
+
+        while True:
+            ahora = time.time()
+            with self._lock:
+                self._conexion.execute("BEGIN IMMEDIATE")
+                try:
+                    fila = self._intentar(clase, prioridad, tokens, limite_total, limite_clase,
+                                         id_espera, inicio, ahora)
+                    self._conexion.execute("COMMIT")
+                except BaseException:
+                    self._conexion.execute("ROLLBACK")
+                    raise
+            if fila is not None:
+                espera = time.time() - inicio
+                self.esperas[clase].append(espera)
+                return fila
+            if plazo.vencido():
+                with self._lock:
+                    self._conexion.execute("DELETE FROM esperas WHERE id = ?", (id_espera,))
+                plazo.comprobar(f"la cola del planificador ({clase})")
+            # Las preguntas sondean más a menudo; nadie pasa más de un latido sin renovarlo
+            pausa = 0.05 if prioridad == 0 else 0.25
+            restante = plazo.restante()
+            time.sleep(pausa if restante is None else min(pausa, restante))
+
+    def _intentar(self, clase, prioridad, tokens, limite_total, limite_clase, id_espera, inicio, ahora):
+        """Una comprobación dentro de la transacción; None si aún no hay turno"""
+        c = self._conexion
+        c.execute("DELETE FROM uso WHERE momento < ?", (ahora - VENTANA_S,))
+        c.execute("DELETE FROM esperas WHERE latido < ?", (ahora - LATIDO_MAXIMO_S,))
+
+        delante = c.execute(
+            "SELECT COUNT(*) FROM esperas WHERE prioridad < ?", (prioridad,)
+        ).fetchone()[0]
+        total, de_clase = c.execute(
+            "SELECT COALESCE(SUM(tokens), 0), COALESCE(SUM(CASE WHEN clase = ? THEN tokens END), 0) FROM uso",
+            (clase,)
+        ).fetchone()
+
+        # Una llamada mayor que la cuota entra si su clase (o la ventana) está vacía
+        cabe_total = total == 0 or total + tokens <= limite_total
+        cabe_clase = de_clase == 0 or de_clase + tokens <= limite_clase
+        if delante or not (cabe_total and cabe_clase):
+            c.execute(
+                "INSERT INTO esperas VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(id) DO UPDATE SET latido = excluded.latido",
+                (id_espera, clase, prioridad, inicio, ahora)
+            )
+            return None
+
+        c.execute("DELETE FROM esperas WHERE id = ?", (id_espera,))
+        fila = c.execute(
+            "INSERT INTO uso (momento, clase, tokens) VALUES (?, ?, ?)", (ahora, clase, tokens)
+        ).lastrowid
+        espera = ahora - inicio
+        c.execute(
+            "INSERT INTO estadisticas VALUES (?, 1, ?, ?) ON CONFLICT(clase) DO UPDATE SET"
+            " admitidas = admitidas + 1, espera_total_s = espera_total_s + excluded.espera_total_s,"
+            " espera_max_s = MAX(espera_max_s, excluded.espera_max_s)",
+            (clase, espera, espera)
+        )
+        return fila
+
+    def _ajustar(self, fila, tokens_reales):
+        with self._lock:
+            self._conexion.execute("UPDATE uso SET tokens = ? WHERE fila = ?", (int(tokens_reales), fila))
+
+    # ----------------------------------------------------------------- estado
+    def resumen(self):
+        """Espera en cola de este proceso por clase (llamadas, p50, p95, máximo)"""
+        partes = [
+            f"{clase}: {len(esperas)} llamadas, p50 {percentil(esperas, 0.5):.2f}s, "
+            f"p95 {percentil(esperas, 0.95):.2f}s, máx {max(esperas):.2f}s"
+            for clase, esperas in self.esperas.items() if esperas
+        ]
+        return "; ".join(partes) if partes else "sin llamadas"
+
+    def estado(self):
+        """Uso de la ventana, esperas actuales y estadísticas acumuladas de todos los procesos"""
+        ahora = time.time()
+        with self._lock:
+            uso = dict(self._conexion.execute(
+                "SELECT clase, SUM(tokens) FROM uso WHERE momento >= ? GROUP BY clase", (ahora - VENTANA_S,)
+            ).fetchall())
+            esperando = {
+                clase: (n, ahora - desde) for clase, n, desde in self._conexion.execute(
+                    "SELECT clase, COUNT(*), MIN(desde) FROM esperas WHERE latido >= ? GROUP BY clase",
+                    (ahora - LATIDO_MAXIMO_S,)
+                )
+            }
+            estadisticas = {
+                clase: (n, total, maximo) for clase, n, total, maximo in self._conexion.execute(
+                    "SELECT clase, admitidas, espera_total_s, espera_max_s FROM estadisticas"
+                )
+            }
+
+        clases = {}
+        for clase in CLASES:
+            n, total, maximo = estadisticas.get(clase, (0, 0.0, 0.0))
+            en_cola, mas_antigua = esperando.get(clase, (0, 0.0))
+            clases[clase] = {
+                "tokens_ultimo_minuto": uso.get(clase, 0),
+                "cuota_tokens": int(self.tpm * self.cuotas[clase]),
+                "en_cola": en_cola,
+                "espera_mas_antigua_s": round(mas_antigua, 2),
+                "admitidas": n,
+                "espera_media_s": round(total / n, 3) if n else 0.0,
+                "espera_max_s": round(maximo, 3)
+            }
+        return {"tpm": self.tpm, "tokens_ultimo_minuto": sum(uso.values()), "clases": clases}
+
+
+def mostrar_estado(planificador):
+    estado = planificador.estado()
+    print(f"\n🚦 Planificador: {estado['tokens_ultimo_minuto']}/{estado['tpm']} tokens en el último minuto")
+    for clase, datos in estado["clases"].items():
+        print(f"   • {clase:<12} {datos['tokens_ultimo_minuto']:>8}/{datos['cuota_tokens']} tokens, "
+              f"{datos['en_cola']} en cola (la más antigua {datos['espera_mas_antigua_s']}s), "
+              f"{datos['admitidas']} admitidas, espera media {datos['espera_media_s']}s, "
+              f"máx {datos['espera_max_s']}s")
+
+
+if __name__ == "__main__":
+    planificador = Planificador()
+    if not planificador.activo:
+        print("ℹ️ Planificador desactivado: configura RAG_PLANIFICADOR_TPM")
+        sys.exit(0)
+    mostrar_estado(planificador)
@@ -0,0 +1,199 @@
+"""
+plazos.py - Plazo por consulta y peticiones cubiertas (hedged requests)
+Una llamada lenta a Azure (embedding, búsqueda o chat) no debe colgar la
+sesión. Cada consulta recibe un Plazo que se reparte entre sus etapas: cada
+petición sale con el tiempo que queda como timeout y quien la espera deja de
+hacerlo al vencer el plazo (las que aún no empezaron se cancelan).
+
+El plazo llega también a las esperas previas al envío (límite TPM de
+RegistroConsumo y turno del Planificador): una llamada en cola se abandona
+cuando vence, sin llegar a enviarse.
+
+Las llamadas idempotentes (embeddings y búsquedas) se cubren: si la primera
+petición, una vez enviada, tarda más que el percentil configurado de las
+latencias recientes de esa operación, sale una segunda igual y se usa la que
+responda antes. Una llamada que aún espera turno no se cubre: duplicarla solo
+añadiría carga cuando no hay capacidad.
+"""
+
+import os
+import time
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+
+class PlazoVencido(Exception):
+    """Se agotó el tiempo de la consulta"""
+
+
+class Plazo:
+    """Límite de tiempo de una consulta (segundos=None o 0: sin límite)"""
+
+    def __init__(self, segundos=None):
+        self.segundos = segundos or None
+        self.limite = time.monotonic() + segundos if segundos else None
+        self.cancelado = False
+
+    def derivado(self):
+        """Mismo límite, pero cancelable por separado (un intento de una llamada)"""
+        plazo = Plazo()
+        plazo.segundos, plazo.limite = self.segundos, self.limite
+        return plazo
+
+    def cancelar(self):
+        self.cancelado = True
+
+    def restante(self):
+        """Segundos que quedan (None si no hay límite)"""
+        if self.cancelado:
+            return 0.0
+        if self.limite is None:
+            return None
+        return max(self.limite - time.monotonic(), 0.0)
+
+    def vencido(self):
+        return self.cancelado or (self.limite is not None and time.monotonic() >= self.limite)
+
+    def comprobar(self, etapa):
+        if self.cancelado:
+            raise PlazoVencido(f"Llamada cancelada en {etapa}")
+        if self.vencido():
+            raise PlazoVencido(f"Plazo de {self.segundos:g}s agotado en {etapa}")
+
+
+SIN_PLAZO = Plazo()
+
+
+def opciones_timeout(timeout, *nombres):
+    """Argumentos de timeout por petición ({} si no hay límite: None en OpenAI sería 'sin timeout')"""
+    if timeout is None:
+        return {}
+    return {nombre: max(timeout, 0.001) for nombre in nombres}
+
+
+class Intento:
+    """Un intento de una llamada: su plazo y el momento en que la petición sale
+
+    La función cubierta llama a enviar() justo antes de la petición HTTP; devuelve
+    el timeout que le queda. Hasta entonces el intento está esperando turno.
+    """
+
+    def __init__(self, plazo):
+        self.plazo = plazo
+        self.inicio = None
+        self.enviado = threading.Event()
+
+    def enviar(self):
+        self.inicio = time.perf_counter()
+        self.enviado.set()
+        return self.plazo.restante()
+
+
+class Cobertura:
+    def __init__(self, activa=None, percentil=None, retraso_inicial=None, min_muestras=20, max_workers=16):
+        if activa is None:
+            activa = os.getenv("RAG_COBERTURA", "1") == "1"
+        self.activa = activa
+        self.percentil = float(percentil or os.getenv("RAG_COBERTURA_PERCENTIL", "0.95"))
+        self.retraso_inicial = float(retraso_inicial or os.getenv("RAG_COBERTURA_RETRASO_S", "1.0"))
+        self.min_muestras = min_muestras
+        self._lock = threading.Lock()
+        self.latencias = defaultdict(lambda: deque(maxlen=500))
+        self.contadores = defaultdict(lambda: {"llamadas": 0, "cubiertas": 0, "ganadas": 0, "vencidas": 0})
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cobertura")
+
+    def retraso(self, operacion):
+        """Espera antes de la petición de respaldo: percentil de las latencias recientes"""
+        with self._lock:
+            latencias = list(self.latencias[operacion])
+        if len(latencias) < self.min_muestras:
+            return self.retraso_inicial
+        return float(np.percentile(latencias, self.percentil * 100))
+
+    def _medir(self, operacion, funcion, intento):
+        """Ejecuta un intento; la latencia se mide desde el envío, sin la espera de turno"""
+        resultado = funcion(intento)
+        if intento.inicio is not None:
+            with self._lock:
+                self.latencias[operacion].append(time.perf_counter() - intento.inicio)
+        return resultado
+
+    def _lanzar(self, operacion, funcion, plazo):
+        intento = Intento(plazo.derivado())
+        return intento, self._executor.submit(self._medir, operacion, funcion, intento)
+
+    def _esperar_envio(self, intento, futuro, plazo):
+        """Espera a que el intento salga (o termine); False si vence antes el plazo"""
+        while not (intento.enviado.is_set() or futuro.done()):
+            restante = plazo.restante()
+            if restante == 0:
+                return False
+            intento.enviado.wait(0.05 if restante is None else min(0.05, restante))
+        return True
+
+    def ejecutar(self, operacion, funcion, plazo=SIN_PLAZO, cubrir=True):
+        """Resultado de funcion(intento) dentro del plazo, con respaldo si tarda
+
+        funcion recibe un Intento: pasa intento.plazo a las esperas de turno y usa
+        intento.enviar() como timeout de la petición. cubrir=False para llamadas
+        no idempotentes o caras (chat). Lanza PlazoVencido si no hay respuesta a tiempo.
+        """
+        cubrir = cubrir and self.activa
+        with self._lock:
+            self.contadores[operacion]["llamadas"] += 1
+        if plazo.limite is None and not cubrir:
+            return self._medir(operacion, funcion, Intento(plazo.derivado()))
+
+        plazo.comprobar(operacion)
+        intento, primero = self._lanzar(operacion, funcion, plazo)
+        intentos = {primero: intento}
+        # El temporizador del respaldo empieza cuando la petición sale, no en la cola
+        if cubrir and self._esperar_envio(intento, primero, plazo) and not primero.done():
+            retraso = self.retraso(operacion) - (time.perf_counter() - intento.inicio)
+            restante = plazo.restante()
+            espera = max(retraso, 0) if restante is None else min(max(retraso, 0), restante)
+            hechos, _ = wait([primero], timeout=espera)
+            if not hechos and not plazo.vencido():
+                respaldo, futuro = self._lanzar(operacion, funcion, plazo)
+                intentos[futuro] = respaldo
+                with self._lock:
+                    self.contadores[operacion]["cubiertas"] += 1
+
+        pendientes, error = set(intentos), None
+        try:
+            while pendientes:
+                hechos, pendientes = wait(pendientes, timeout=plazo.restante(), return_when=FIRST_COMPLETED)
+                if not hechos:
+                    break
+                for futuro in hechos:
+                    if futuro.exception() is None:
+                        if futuro is not primero:
+                            with self._lock:
+                                self.contadores[operacion]["ganadas"] += 1
+                        return futuro.result()
+                    error = futuro.exception()
+        finally:
+            # Los intentos que siguen en cola se abandonan; los ya enviados terminan por su timeout
+            for futuro in pendientes:
+                futuro.cancel()
+                intentos[futuro].plazo.cancelar()
+
+        if pendientes or isinstance(error, PlazoVencido):
+            with self._lock:
+                self.contadores[operacion]["vencidas"] += 1
+        if pendientes:
+            raise PlazoVencido(f"Plazo de {plazo.segundos:g}s agotado en {operacion}")
+        raise error
+
+    def resumen(self):
+        """Llamadas por operación, cuántas se cubrieron, cuántas ganó el respaldo y cuántas vencieron"""
+        with self._lock:
+            partes = [
+                f"{operacion}: {c['llamadas']} llamadas, {c['cubiertas']} cubiertas "
+                f"({c['ganadas']} ganadas por el respaldo), {c['vencidas']} fuera de plazo"
+                for operacion, c in self.contadores.items() if c["llamadas"]
+            ]
+        return "; ".join(partes) if partes else "sin llamadas"
@@ -0,0 +1,251 @@
+"""
+pool_openai.py - Reparto de llamadas entre varios despliegues de Azure OpenAI
+Permite superar la cuota (TPM) de un solo despliegue: cada llamada va al miembro
+del pool con más peso y más cuota restante (según las cabeceras x-ratelimit-*),
+los miembros que responden 429 o fallan se expulsan durante un enfriamiento y
+la llamada se reintenta de forma transparente en otro miembro.
+
+El `timeout` de una llamada (el plazo de la consulta, ver plazos.py) limita la
+llamada entera: cada intento sale con el tiempo que queda, las esperas a que
+vuelva un miembro no lo superan y un timeout no cuenta como fallo del miembro
+(un despliegue lento pero sano no se expulsa) ni se reintenta en otro.
+
+El pool se configura con AZURE_OPENAI_POOL (JSON en línea o ruta a un .json):
+
+    [{"nombre": "eastus", "endpoint": "https://...", "key": "...",
+      "embedding_deployment": "embeddings", "chat_deployment": "chat", "peso": 2},
+     {"nombre": "westeu", "endpoint": "https://...", "key": "...",
+      "embedding_deployment": "embeddings", "peso": 1}]
+
+Sin AZURE_OPENAI_POOL se usa el cliente de siempre (AZURE_OPENAI_ENDPOINT/KEY).
+"""
+
+import os
+import json
+import time
+import random
+import threading
+from types import SimpleNamespace
+
+from openai import (
+    AzureOpenAI,
+    RateLimitError,
+    APITimeoutError,
+    APIConnectionError,
+    InternalServerError,
+)
+
+from plazos import PlazoVencido
+
+API_VERSION = "2024-02-15-preview"
+
+# Cabeceras de cuota que Azure OpenAI devuelve en cada respuesta
+CABECERAS_CUOTA = {
+    "restantes_tokens": "x-ratelimit-remaining-tokens",
+    "restantes_peticiones": "x-ratelimit-remaining-requests",
+    "limite_tokens": "x-ratelimit-limit-tokens",
+}
+
+
+def segundos_reintento(cabeceras):
+    """Espera sugerida por el servicio (retry-after-ms / retry-after), o None"""
+    if cabeceras is None:
+        return None
+    for nombre, escala in (("retry-after-ms", 1000), ("retry-after", 1)):
+        valor = cabeceras.get(nombre)
+        if valor:
+            try:
+                return float(valor) / escala
+            except ValueError:
+                pass
+    return None
+
+
+class MiembroPool:
+    def __init__(self, nombre, endpoint, key, embedding_deployment=None, chat_deployment=None, peso=1.0):
+        self.nombre = nombre
+        self.peso = float(peso)
+        self.despliegues = {"embedding": embedding_deployment, "chat": chat_deployment}
+        # Sin reintentos del SDK: el pool decide si reintentar en otro miembro
+        self.cliente = AzureOpenAI(azure_endpoint=endpoint, api_key=key,
+                                   api_version=API_VERSION, max_retries=0)
+
+        self.expulsado_hasta = 0.0
+        self.fallos_seguidos = 0
+        self.llamadas = 0
+        self.errores = 0
+        self.cuota = {}
+        self.cuota_actualizada = 0.0
+
+    def disponible(self, tipo, ahora):
+        return bool(self.despliegues.get(tipo)) and ahora >= self.expulsado_hasta
+
+    def fraccion_restante(self, ahora):
+        """Cuota de tokens restante en la ventana actual (1.0 si no se conoce)"""
+        # Las cuotas se reponen cada minuto: una lectura antigua ya no sirve
+        if ahora - self.cuota_actualizada > 60:
+            return 1.0
+        restantes, limite = self.cuota.get("restantes_tokens"), self.cuota.get("limite_tokens")
+        if restantes is None or not limite:
+            return 1.0
+        return max(restantes / limite, 0.0)
+
+    def actualizar_cuota(self, cabeceras, ahora):
+        for clave, cabecera in CABECERAS_CUOTA.items():
+            valor = cabeceras.get(cabecera)
+            if valor is not None:
+                try:
+                    self.cuota[clave] = float(valor)
+                except ValueError:
+                    pass
+        self.cuota_actualizada = ahora
+
+
+class PoolOpenAI:
+    """Sustituto de AzureOpenAI para embeddings.create y chat.completions.create"""
+
+    def __init__(self, miembros, enfriamiento=None, max_fallos=None, espera_maxima=None):
+        self.miembros = miembros
+        self.enfriamiento = enfriamiento or float(os.getenv("RAG_POOL_ENFRIAMIENTO", "30"))
+        self.max_fallos = max_fallos or int(os.getenv("RAG_POOL_MAX_FALLOS", "2"))
+        self.espera_maxima = espera_maxima or float(os.getenv("RAG_POOL_ESPERA_MAXIMA", "60"))
+        self._lock = threading.Lock()
+
+        self.embeddings = SimpleNamespace(create=lambda **kw: self.llamar("embedding", kw))
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=lambda **kw: self.llamar("chat", kw))
+        )
+
+    @classmethod
+    def desde_config(cls, config):
+        """Crea el pool a partir de JSON en línea o de la ruta a un archivo JSON"""
+        if os.path.exists(config):
+            with open(config, "r", encoding="utf-8") as f:
+                entradas = json.load(f)
+        else:
+            entradas = json.loads(config)
+        miembros = [
+            MiembroPool(
+                nombre=e.get("nombre") or f"miembro-{i}",
+                endpoint=e["endpoint"],
+                key=e["key"],
+                embedding_deployment=e.get("embedding_deployment"),
+                chat_deployment=e.get("chat_deployment"),
+                peso=e.get("peso", 1)
+            )
+            for i, e in enumerate(entradas)
+        ]
+        return cls(miembros)
+
+    # -------------------------------------------------------------- elección
+    def elegir(self, tipo, excluidos=()):
+        """Sorteo ponderado por peso x cuota restante entre los miembros disponibles"""
+        ahora = time.monotonic()
+        with self._lock:
+            candidatos = [m for m in self.miembros if m not in excluidos and m.disponible(tipo, ahora)]
+            if not candidatos:
+                return None
+            pesos = [m.peso * max(m.fraccion_restante(ahora), 0.02) for m in candidatos]
+            return random.choices(candidatos, weights=pesos)[0]
+
+    def _expulsar(self, miembro, segundos, motivo):
+        with self._lock:
+            miembro.expulsado_hasta = time.monotonic() + segundos
+        print(f"⚠️ Pool OpenAI: '{miembro.nombre}' fuera durante {segundos:.0f}s ({motivo})")
+
+    def _registrar_fallo(self, miembro, error):
+        with self._lock:
+            miembro.fallos_seguidos += 1
+            miembro.errores += 1
+            expulsar = miembro.fallos_seguidos >= self.max_fallos
+        if expulsar:
+            self._expulsar(miembro, self.enfriamiento, type(error).__name__)
+
+    # --------------------------------------------------------------- llamada
+    def llamar(self, tipo, argumentos):
+        """Ejecuta la llamada en un miembro; ante 429 o fallo de servicio prueba otro"""
+        inicio = time.monotonic()
+        limite = inicio + self.espera_maxima
+        # timeout = plazo de la consulta para toda la llamada, no por intento
+        fin_plazo = inicio + argumentos["timeout"] if argumentos.get("timeout") is not None else None
+        if fin_plazo is not None:
+            limite = min(limite, fin_plazo)
+        ultimo_error = None
+
+        while True:
+            intentados = set()
+            while True:
+                miembro = self.elegir(tipo, intentados)
+                if miembro is None:
+                    break
+                intentados.add(miembro)
+
+                api = miembro.cliente.embeddings if tipo == "embedding" else miembro.cliente.chat.completions
+                opciones = dict(argumentos, model=miembro.despliegues[tipo])
+                if fin_plazo is not None:
+                    restante = fin_plazo - time.monotonic()
+                    if restante <= 0:
+                        raise PlazoVencido(f"Plazo agotado en el pool ({tipo})")
+                    opciones["timeout"] = restante
+                try:
+                    crudo = api.with_raw_response.create(**opciones)
+                except APITimeoutError:
+                    # Agotó el plazo de quien llama: ni es fallo del miembro ni hay tiempo para otro
+                    raise
+                except RateLimitError as e:
+                    espera = segundos_reintento(getattr(e.response, "headers", None)) or self.enfriamiento
+                    with self._lock:
+                        miembro.errores += 1
+                    self._expulsar(miembro, espera, "429")
+                    ultimo_error = e
+                    continue
+                except (APIConnectionError, InternalServerError) as e:
+                    self._registrar_fallo(miembro, e)
+                    ultimo_error = e
+                    continue
+
+                with self._lock:
+                    miembro.llamadas += 1
+                    miembro.fallos_seguidos = 0
+                    miembro.actualizar_cuota(crudo.headers, time.monotonic())
+                return crudo.parse()
+
+            # Ningún miembro disponible: esperar al primero que vuelva (con un límite)
+            with self._lock:
+                regresos = [m.expulsado_hasta for m in self.miembros if m.despliegues.get(tipo)]
+            if not regresos:
+                raise ValueError(f"Ningún miembro del pool tiene despliegue de '{tipo}'")
+            ahora = time.monotonic()
+            espera = min(regresos) - ahora
+            if ahora + max(espera, 0) >= limite:
+                if fin_plazo is not None and limite == fin_plazo:
+                    raise PlazoVencido(f"Plazo agotado en el pool ({tipo}) esperando un miembro disponible")
+                raise ultimo_error or RuntimeError("Pool OpenAI sin miembros disponibles")
+            time.sleep(min(max(espera, 1.0), limite - ahora))
+
+    def estado(self):
+        """Resumen por miembro: llamadas, errores, cuota restante y expulsión"""
+        ahora = time.monotonic()
+        with self._lock:
+            return [{
+                "nombre": m.nombre,
+                "peso": m.peso,
+                "llamadas": m.llamadas,
+                "errores": m.errores,
+                "fraccion_restante": round(m.fraccion_restante(ahora), 3),
+                "expulsado_s": round(max(m.expulsado_hasta - ahora, 0), 1)
+            } for m in self.miembros]
+
+
+def crear_cliente_openai():
+    """Pool si AZURE_OPENAI_POOL está configurado; si no, el cliente de un solo despliegue"""
+    config = os.getenv("AZURE_OPENAI_POOL")
+    if config:
+        pool = PoolOpenAI.desde_config(config)
+        print(f"🔀 Pool de Azure OpenAI con {len(pool.miembros)} despliegues")
+        return pool
+    return AzureOpenAI(
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_key=os.getenv("AZURE_OPENAI_KEY"),
+        api_version=API_VERSION
+    )
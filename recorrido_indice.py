@@ -0,0 +1,179 @@
+"""
+recorrido_indice.py - Recorrido completo (streaming) de los chunks de un índice
+Cada partición (por `source`) se pagina por rangos de clave: orden por `id` y
+`id gt '<último>'`, sin depender de `skip` (Azure AI Search no admite skip >
+100000) y con un orden estable entre páginas. Si el índice no permite ordenar
+por `id` (índices creados antes de que fuera sortable) se pagina con `skip` y
+se lanza un error al llegar al límite en lugar de perder filas en silencio.
+Permite leer varias particiones en paralelo con memoria acotada.
+"""
+
+import queue
+import threading
+
+from azure.core.exceptions import HttpResponseError
+
+from estadisticas_indice import listar_facetas, escapar_odata
+
+# Azure AI Search no permite skip > 100000 dentro de una misma consulta
+MAX_SKIP = 100000
+
+_FIN = object()
+
+
+class LimiteRecorridoExcedido(RuntimeError):
+    """La partición tiene más filas de las que se pueden leer con skip"""
+
+
+def _paginas_por_clave(search_client, select, filtro, tamano_pagina, clave):
+    """Pagina por rangos de clave (`clave gt '<último>'`, orden ascendente por clave)"""
+    campos = select if select is None or clave in select else list(select) + [clave]
+    ultimo = None
+    while True:
+        condiciones = [f"({filtro})"] if filtro else []
+        if ultimo is not None:
+            condiciones.append(f"{clave} gt '{escapar_odata(ultimo)}'")
+        results = search_client.search(
+            search_text="*",
+            filter=" and ".join(condiciones) or None,
+            select=campos,
+            order_by=[f"{clave} asc"],
+            top=tamano_pagina
+        )
+        pagina = list(results)
+        if not pagina:
+            break
+        ultimo = pagina[-1][clave]
+        if campos is not select:
+            for doc in pagina:
+                doc.pop(clave, None)
+        yield pagina
+        if len(pagina) < tamano_pagina:
+            break
+
+
+def _paginas_skip(search_client, select, filtro, tamano_pagina):
+    """Pagina con skip hasta agotar la consulta; error si supera MAX_SKIP
+
+    Solo para índices sin clave ordenable: sin order_by Azure no garantiza que
+    el orden sea el mismo entre páginas.
+    """
+    skip = 0
+    while True:
+        results = search_client.search(
+            search_text="*",
+            filter=filtro,
+            select=select,
+            top=tamano_pagina,
+            skip=skip
+        )
+        pagina = list(results)
+        if not pagina:
+            break
+        yield pagina
+        if len(pagina) < tamano_pagina:
+            break
+        skip += tamano_pagina
+        if skip > MAX_SKIP:
+            raise LimiteRecorridoExcedido(
+                f"La partición '{filtro or 'todo el índice'}' tiene más de {MAX_SKIP} documentos y el "
+                f"índice no permite ordenar por clave: el recorrido quedaría incompleto"
+            )
+
+
+def _paginas_filtro(search_client, select, filtro, tamano_pagina, clave="id"):
+    """Páginas de una consulta: por rangos de clave o, si el índice no lo admite, con skip"""
+    paginas = _paginas_por_clave(search_client, select, filtro, tamano_pagina, clave)
+    try:
+        primera = next(paginas, None)
+    except HttpResponseError as e:
+        if getattr(e, "status_code", None) != 400:
+            raise
+        paginas = None  # la clave no es sortable en este índice
+    if paginas is None:
+        yield from _paginas_skip(search_client, select, filtro, tamano_pagina)
+    elif primera is not None:
+        yield primera
+        yield from paginas
+
+
+def filtros_particion(search_client, campo_particion="source", filtro=None):
+    """Construye un filtro por cada valor del campo de partición (más los nulos)"""
+    if not campo_particion:
+        return [filtro]
+
+    valores = [f["value"] for f in listar_facetas(search_client, campo_particion, filtro=filtro)]
+    filtros = [f"{campo_particion} eq '{escapar_odata(v)}'" for v in valores]
+    filtros.append(f"{campo_particion} eq null")
+
+    if filtro:
+        filtros = [f"({filtro}) and {f}" for f in filtros]
+    return filtros
+
+
+def recorrer_paginas(search_client, select=None, tamano_pagina=1000, max_workers=1,
+                     campo_particion="source", filtro=None):
+    """Genera páginas (listas de dicts) con todos los chunks del índice
+
+    Con max_workers > 1 cada partición se lee en su propio hilo; las páginas
+    llegan por una cola acotada, así que la memoria no depende del tamaño del índice.
+    El orden entre particiones no está garantizado.
+    """
+    filtros = filtros_particion(search_client, campo_particion, filtro)
+
+    if max_workers <= 1:
+        for f in filtros:
+            yield from _paginas_filtro(search_client, select, f, tamano_pagina)
+        return
+
+    cola = queue.Queue(maxsize=max_workers * 2)
+    pendientes = queue.Queue()
+    for f in filtros:
+        pendientes.put(f)
+    detener = threading.Event()
+
+    def trabajador():
+        try:
+            while not detener.is_set():
+                try:
+                    f = pendientes.get_nowait()
+                except queue.Empty:
+                    break
+                for pagina in _paginas_filtro(search_client, select, f, tamano_pagina):
+                    if detener.is_set():
+                        break
+                    cola.put(pagina)
+        except Exception as e:
+            cola.put(e)
+        finally:
+            cola.put(_FIN)
+
+    hilos = [threading.Thread(target=trabajador, daemon=True)
+             for _ in range(min(max_workers, len(filtros)))]
+    for h in hilos:
+        h.start()
+
+    activos = len(hilos)
+    try:
+        while activos:
+            item = cola.get()
+            if item is _FIN:
+                activos -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        detener.set()
+        # Vaciar la cola para desbloquear hilos que esperan espacio
+        while any(h.is_alive() for h in hilos):
+            try:
+                cola.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def recorrer_chunks(search_client, select=None, **kwargs):
+    """Igual que recorrer_paginas pero chunk a chunk"""
+    for pagina in recorrer_paginas(search_client, select=select, **kwargs):
+        yield from pagina
@@ -0,0 +1,235 @@
+"""
+snapshot_indice.py - Exportación y restauración del índice en un formato binario portable
+
+Formato (un directorio):
+    manifest.json          versión, índice de origen, número de chunks, dimensiones, columnas
+    vectores.f32           bloque float32 (n x dimensiones) en orden de fila, mapeable con np.memmap
+    <columna>.jsonl.gz     una columna por archivo (id, content, source, page, fecha_carga, ordinal),
+                           un valor JSON por línea, comprimida con gzip
+
+La restauración sube en lotes paralelos al índice de Azure y el mismo snapshot
+se carga de forma instantánea en un IndiceLocal para desarrollo.
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+from datetime import datetime
+
+import numpy as np
+
+from recorrido_indice import recorrer_paginas
+from indice_local import IndiceLocal
+from subida_indice import SubidorDocumentos
+
+VERSION_FORMATO = 1
+COLUMNAS = ["id", "content", "source", "page", "fecha_carga", "ordinal"]
+
+
+def _a_json(valor):
+    """Serializa valores no JSON (fechas) como texto ISO"""
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return str(valor)
+
+
+def exportar_snapshot(search_client, ruta, index_name=None, dimensiones=1536,
+                      columnas=None, max_workers=4, tamano_pagina=1000, index_client=None):
+    """Vuelca todos los chunks (vectores incluidos) a un snapshot en `ruta`
+
+    Con index_client, las columnas se limitan a los campos que tiene el índice
+    (los anteriores a 'ordinal' no lo tienen y la búsqueda lo rechazaría).
+    """
+    columnas = columnas or COLUMNAS
+    if index_client is not None and index_name:
+        campos = {f.name for f in index_client.get_index(index_name).fields}
+        columnas = [c for c in columnas if c in campos]
+    os.makedirs(ruta, exist_ok=True)
+    inicio = time.perf_counter()
+
+    print(f"\n💾 Exportando snapshot a: {ruta}")
+
+    archivos = {
+        c: gzip.open(os.path.join(ruta, f"{c}.jsonl.gz"), "wt", encoding="utf-8", compresslevel=6)
+        for c in columnas
+    }
+    total = 0
+    sin_vector = 0
+
+    try:
+        with open(os.path.join(ruta, "vectores.f32"), "wb") as f_vectores:
+            for pagina in recorrer_paginas(
+                search_client,
+                select=columnas + ["content_vector"],
+                tamano_pagina=tamano_pagina,
+                max_workers=max_workers
+            ):
+                bloque = np.zeros((len(pagina), dimensiones), dtype=np.float32)
+                for i, doc in enumerate(pagina):
+                    vector = doc.get("content_vector")
+                    if vector is not None and len(vector) == dimensiones:
+                        bloque[i] = vector
+                    else:
+                        sin_vector += 1
+                    for c in columnas:
+                        archivos[c].write(json.dumps(doc.get(c), ensure_ascii=False, default=_a_json) + "\n")
+
+                f_vectores.write(bloque.tobytes())
+                total += len(pagina)
+                print(f"   📦 {total} chunks exportados...")
+    finally:
+        for f in archivos.values():
+            f.close()
+
+    manifest = {
+        "version": VERSION_FORMATO,
+        "index_name": index_name,
+        "fecha": datetime.now().isoformat(),
+        "total_chunks": total,
+        "dimensiones": dimensiones,
+        "dtype": "float32",
+        "columnas": columnas,
+        "sin_vector": sin_vector
+    }
+    with open(os.path.join(ruta, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+    tamano = sum(os.path.getsize(os.path.join(ruta, a)) for a in os.listdir(ruta))
+    print(f"✅ Snapshot: {total} chunks, {tamano / 1024 / 1024:.1f} MB "
+          f"en {time.perf_counter() - inicio:.1f}s")
+    if sin_vector:
+        print(f"⚠️ {sin_vector} chunks sin vector (guardados como ceros)")
+    return manifest
+
+
+def leer_manifest(ruta):
+    with open(os.path.join(ruta, "manifest.json"), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != VERSION_FORMATO:
+        raise ValueError(f"Versión de snapshot no soportada: {manifest.get('version')}")
+    return manifest
+
+
+def abrir_vectores(ruta, manifest=None):
+    """Bloque de vectores como np.memmap de solo lectura (no se carga en memoria)"""
+    manifest = manifest or leer_manifest(ruta)
+    if not manifest["total_chunks"]:
+        return np.zeros((0, manifest["dimensiones"]), dtype=np.float32)
+    return np.memmap(
+        os.path.join(ruta, "vectores.f32"),
+        dtype=manifest["dtype"],
+        mode="r",
+        shape=(manifest["total_chunks"], manifest["dimensiones"])
+    )
+
+
+def iterar_documentos(ruta, manifest=None, con_vectores=True):
+    """Reconstruye los chunks fila a fila leyendo todas las columnas en paralelo"""
+    manifest = manifest or leer_manifest(ruta)
+    columnas = manifest["columnas"]
+    vectores = abrir_vectores(ruta, manifest) if con_vectores else None
+    archivos = [gzip.open(os.path.join(ruta, f"{c}.jsonl.gz"), "rt", encoding="utf-8") for c in columnas]
+
+    try:
+        for fila, lineas in enumerate(zip(*archivos)):
+            doc = {c: json.loads(l) for c, l in zip(columnas, lineas)}
+            if con_vectores:
+                doc["content_vector"] = vectores[fila].tolist()
+            yield doc
+    finally:
+        for f in archivos:
+            f.close()
+
+
+def restaurar_snapshot(ruta, search_client, max_workers=4, almacen=None):
+    """Sube todos los chunks del snapshot a un índice (que debe existir) con lotes paralelos
+
+    almacen: AlmacenChunks donde guardar el texto y el orden de los chunks, para
+    ampliar resultados con sus vecinos (los documentos del snapshot se reemplazan).
+    """
+    manifest = leer_manifest(ruta)
+    print(f"\n♻️ Restaurando {manifest['total_chunks']} chunks desde: {ruta}")
+
+    subidor = SubidorDocumentos(
+        search_client,
+        max_workers=max_workers,
+        accion="merge_or_upload",
+        log=print
+    )
+    vistos = set()
+    pendientes = []
+    for fila, doc in enumerate(iterar_documentos(ruta, manifest), 1):
+        subidor.agregar(doc)
+        if almacen is not None and doc.get("ordinal") is not None:
+            if doc.get("source") not in vistos:
+                vistos.add(doc.get("source"))
+                almacen.eliminar_documento(doc.get("source"))
+            pendientes.append({c: doc.get(c) for c in ("id", "source", "ordinal", "page", "content")})
+            if len(pendientes) >= 1000:
+                almacen.agregar(pendientes)
+                pendientes = []
+        if fila % 5000 == 0:
+            print(f"   📤 {fila}/{manifest['total_chunks']} chunks leídos...")
+    resumen = subidor.finalizar()
+    if pendientes:
+        almacen.agregar(pendientes)
+
+    print(f"✅ Restaurados {resumen['subidos']} chunks en {resumen['duracion_s']:.1f}s "
+          f"({resumen['docs_s']:.0f} docs/s, {resumen['bytes_s']/1024/1024:.1f} MB/s)")
+    if resumen["fallidos"]:
+        print(f"❌ {len(resumen['fallidos'])} chunks fallaron: {[f['key'] for f in resumen['fallidos'][:10]]}")
+    return resumen
+
+
+def cargar_snapshot_local(ruta, nombre=None, con_ann=True):
+    """Carga el snapshot en un IndiceLocal sin copiar los vectores (memmap)
+
+    Si el snapshot tiene un índice ANN en <ruta>/ann (ann_local.py), lo usa.
+    """
+    manifest = leer_manifest(ruta)
+    documentos = list(iterar_documentos(ruta, manifest, con_vectores=False))
+    indice = IndiceLocal.desde_arrays(
+        documentos,
+        abrir_vectores(ruta, manifest),
+        nombre=nombre or manifest.get("index_name") or "snapshot"
+    )
+    if con_ann and os.path.isdir(os.path.join(ruta, "ann")):
+        from ann_local import IndiceANN
+        indice.usar_ann(IndiceANN.cargar(os.path.join(ruta, "ann")))
+    return indice
+
+
+if __name__ == "__main__":
+    from azure.search.documents import SearchClient
+    from azure.search.documents.indexes import SearchIndexClient
+    from azure.core.credentials import AzureKeyCredential
+    from dotenv import load_dotenv
+    from cargar_pdf import asegurar_indice
+
+    load_dotenv()
+
+    if len(sys.argv) < 3 or sys.argv[1] not in ("exportar", "restaurar"):
+        print("Uso: python snapshot_indice.py exportar|restaurar <ruta> [indice]")
+        sys.exit(1)
+
+    accion, ruta = sys.argv[1], sys.argv[2]
+    indice = sys.argv[3] if len(sys.argv) > 3 else os.getenv("AZURE_SEARCH_INDEX_NAME_V2")
+    cliente = SearchClient(
+        endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"),
+        index_name=indice,
+        credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_KEY"))
+    )
+
+    index_client = SearchIndexClient(
+        endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"),
+        credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_KEY"))
+    )
+
+    if accion == "exportar":
+        exportar_snapshot(cliente, ruta, index_name=indice, index_client=index_client)
+    else:
+        from almacen_chunks import AlmacenChunks
+        asegurar_indice(index_client, indice)
+        restaurar_snapshot(ruta, cliente, almacen=AlmacenChunks())
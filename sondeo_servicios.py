@@ -0,0 +1,348 @@
+"""
+sondeo_servicios.py - Sondeo de latencia y capacidad de embeddings, chat y búsqueda
+Lo usa `python verificar_config.py --sondear` para dimensionar los workers antes
+de una carga o un lote grande. Para cada servicio mide:
+
+    conexión   primera llamada con un cliente nuevo menos la mediana en caliente
+    rampa      tras un calentamiento concurrente, pasos cortos de 1, 2, 4, ...
+               llamadas simultáneas con p50/p95 y peticiones por segundo
+    umbral     primera concurrencia con respuestas 429 (limitación)
+
+y sugiere la concurrencia para la ingesta y para las consultas en lote.
+Con un pool de despliegues (AZURE_OPENAI_POOL) cada miembro se sondea por
+separado con su cliente sin reintentos (el pool absorbería los 429) y la
+capacidad del pool es la suma de la de sus miembros.
+Funciona igual con los servicios de Azure que con sustitutos locales
+(IndiceLocal para la búsqueda y ClienteLocal para embeddings y chat).
+"""
+
+import os
+import time
+import threading
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+RAMPA_POR_DEFECTO = (1, 2, 4, 8, 16, 32)
+TEXTO_PRUEBA = "¿Qué requisitos de configuración tiene el sistema para cargar documentos PDF?"
+
+
+class LimiteLocal(Exception):
+    """429 simulado por ClienteLocal (misma señal que RateLimitError / HttpResponseError)"""
+    status_code = 429
+
+
+class ClienteLocal:
+    """Sustituto de AzureOpenAI para sondear sin red
+
+    Los embeddings se calculan de verdad con embedding_hash; latencia_ms añade
+    la espera de red y limite_rps (si se da) responde 429 por encima de ese ritmo.
+    """
+
+    def __init__(self, latencia_ms=None, limite_rps=None):
+        self.latencia = float(latencia_ms if latencia_ms is not None
+                              else os.getenv("RAG_SONDEO_LOCAL_MS", "20")) / 1000
+        limite_rps = limite_rps or os.getenv("RAG_SONDEO_LOCAL_RPS")
+        self.limite_rps = float(limite_rps) if limite_rps else None
+        self._lock = threading.Lock()
+        self._llamadas = []
+        self.embeddings = SimpleNamespace(create=self._embeddings)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+
+    def _admitir(self):
+        if self.limite_rps is None:
+            return
+        with self._lock:
+            ahora = time.monotonic()
+            self._llamadas = [t for t in self._llamadas if ahora - t < 1.0]
+            if len(self._llamadas) >= self.limite_rps:
+                raise LimiteLocal("Límite local de peticiones por segundo alcanzado")
+            self._llamadas.append(ahora)
+
+    def _embeddings(self, input, model=None, **kwargs):
+        from evaluar_recuperacion import embedding_hash
+        self._admitir()
+        textos = [input] if isinstance(input, str) else list(input)
+        time.sleep(self.latencia)
+        vectores = embedding_hash(textos)
+        return SimpleNamespace(
+            data=[SimpleNamespace(embedding=v.tolist()) for v in vectores],
+            usage=SimpleNamespace(prompt_tokens=sum(len(t) // 4 + 1 for t in textos), total_tokens=0)
+        )
+
+    def _chat(self, messages, model=None, max_tokens=None, **kwargs):
+        self._admitir()
+        time.sleep(self.latencia * 5)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="OK"))],
+            usage=SimpleNamespace(prompt_tokens=sum(len(m["content"]) // 4 + 1 for m in messages),
+                                  completion_tokens=1, total_tokens=0)
+        )
+
+
+def es_limitacion(error):
+    """True si el error indica limitación del servicio (429)"""
+    codigo = getattr(error, "status_code", None)
+    if codigo is None:
+        codigo = getattr(getattr(error, "response", None), "status_code", None)
+    return codigo == 429 or type(error).__name__ == "RateLimitError"
+
+
+def percentiles(latencias):
+    if not latencias:
+        return 0.0, 0.0
+    return float(np.percentile(latencias, 50)), float(np.percentile(latencias, 95))
+
+
+# ------------------------------------------------------------------- objetivos
+def objetivo_embeddings(fabrica, lote=1, modelo=None):
+    modelo = modelo or os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+    entrada = TEXTO_PRUEBA if lote == 1 else [TEXTO_PRUEBA] * lote
+    return fabrica, lambda cliente: cliente.embeddings.create(input=entrada, model=modelo)
+
+
+def objetivo_chat(fabrica, modelo=None):
+    modelo = modelo or os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT")
+    mensajes = [{"role": "user", "content": "Di 'OK'"}]
+    return fabrica, lambda cliente: cliente.chat.completions.create(model=modelo, messages=mensajes, max_tokens=1)
+
+
+def objetivo_busqueda(fabrica, dimensiones=1536):
+    from azure.search.documents.models import VectorizedQuery
+
+    vector = np.random.default_rng(0).normal(size=dimensiones)
+    vector = (vector / np.linalg.norm(vector)).tolist()
+
+    def buscar(cliente):
+        # SearchItemPaged es perezoso: hay que recorrerlo para que la petición salga
+        return list(cliente.search(
+            search_text=TEXTO_PRUEBA,
+            vector_queries=[VectorizedQuery(vector=vector, k_nearest_neighbors=5, fields="content_vector")],
+            select=["id"],
+            top=5
+        ))
+    return fabrica, buscar
+
+
+# ---------------------------------------------------------------------- sondeo
+class Sondeo:
+    def __init__(self, duracion_paso=None, rampa=None, max_limitadas=0.02):
+        self.duracion_paso = duracion_paso or float(os.getenv("RAG_SONDEO_DURACION", "5"))
+        maximo = int(os.getenv("RAG_SONDEO_MAX_CONCURRENCIA", "32"))
+        self.rampa = [c for c in (rampa or RAMPA_POR_DEFECTO) if c <= maximo]
+        self.max_limitadas = max_limitadas
+
+    def medir_conexion(self, fabrica, llamada, calientes=5):
+        """Primera llamada con cliente nuevo (DNS, TCP, TLS, token) frente a llamadas en caliente"""
+        inicio = time.perf_counter()
+        cliente = fabrica()
+        llamada(cliente)
+        frio = (time.perf_counter() - inicio) * 1000
+        tiempos = []
+        for _ in range(calientes):
+            inicio = time.perf_counter()
+            llamada(cliente)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        p50, _ = percentiles(tiempos)
+        return cliente, {"primera_ms": round(frio, 1), "caliente_p50_ms": round(p50, 1),
+                         "conexion_ms": round(max(frio - p50, 0.0), 1)}
+
+    def paso(self, cliente, llamada, concurrencia, duracion):
+        """concurrencia hilos llamando sin pausa durante `duracion` segundos"""
+        latencias, limitadas, errores = [], 0, 0
+        lock = threading.Lock()
+        fin = time.perf_counter() + duracion
+
+        def trabajador():
+            nonlocal limitadas, errores
+            while time.perf_counter() < fin:
+                inicio = time.perf_counter()
+                try:
+                    llamada(cliente)
+                except Exception as e:
+                    with lock:
+                        if es_limitacion(e):
+                            limitadas += 1
+                        else:
+                            errores += 1
+                    # Tras un 429 o un fallo se espera un poco para no convertir el sondeo en una avalancha
+                    time.sleep(0.2)
+                    continue
+                with lock:
+                    latencias.append((time.perf_counter() - inicio) * 1000)
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrencia) as executor:
+            for futuro in [executor.submit(trabajador) for _ in range(concurrencia)]:
+                futuro.result()
+        transcurrido = time.perf_counter() - inicio
+
+        total = len(latencias) + limitadas + errores
+        p50, p95 = percentiles(latencias)
+        return {
+            "concurrencia": concurrencia,
+            "ok": len(latencias),
+            "limitadas": limitadas,
+            "errores": errores,
+            "rps": round(len(latencias) / transcurrido, 2),
+            "p50_ms": round(p50, 1),
+            "p95_ms": round(p95, 1),
+            "fraccion_limitadas": round(limitadas / total, 3) if total else 0.0
+        }
+
+    def sondear(self, nombre, fabrica, llamada):
+        """Conexión, calentamiento concurrente y rampa hasta limitación o saturación"""
+        print(f"\n⏱️ Sondeando {nombre}...")
+        cliente, conexion = self.medir_conexion(fabrica, llamada)
+        print(f"   🔌 Conexión: {conexion['conexion_ms']} ms "
+              f"(primera {conexion['primera_ms']} ms, en caliente {conexion['caliente_p50_ms']} ms)")
+
+        # Calentamiento: abre las conexiones del pool antes de medir
+        self.paso(cliente, llamada, min(4, max(self.rampa)), min(2.0, self.duracion_paso))
+
+        pasos, umbral, mejor, sin_mejora = [], None, 0.0, 0
+        for concurrencia in self.rampa:
+            resultado = self.paso(cliente, llamada, concurrencia, self.duracion_paso)
+            pasos.append(resultado)
+            print(f"   • x{concurrencia:<3} {resultado['rps']:>7} req/s  p50 {resultado['p50_ms']:>7} ms  "
+                  f"p95 {resultado['p95_ms']:>7} ms  429: {resultado['limitadas']}  errores: {resultado['errores']}")
+            if resultado["fraccion_limitadas"] > self.max_limitadas:
+                umbral = concurrencia
+                print(f"   ⚠️ Limitación (429) desde {concurrencia} llamadas simultáneas")
+                break
+            # Dos pasos seguidos sin ganar un 10% de rendimiento: el servicio está saturado
+            if resultado["rps"] < mejor * 1.1:
+                sin_mejora += 1
+                if sin_mejora >= 2:
+                    break
+            else:
+                sin_mejora = 0
+            mejor = max(mejor, resultado["rps"])
+
+        validos = [p for p in pasos if p["fraccion_limitadas"] <= self.max_limitadas and p["ok"]]
+        sostenible = max((p["rps"] for p in validos), default=0.0)
+        # La menor concurrencia que ya da el 90% del máximo sin limitación
+        sugerida = next((p["concurrencia"] for p in validos if p["rps"] >= 0.9 * sostenible), 1)
+        return {
+            "servicio": nombre,
+            "conexion": conexion,
+            "pasos": pasos,
+            "umbral_limitacion": umbral,
+            "rps_sostenible": sostenible,
+            "concurrencia_sugerida": sugerida,
+            "p95_ms": next((p["p95_ms"] for p in validos if p["concurrencia"] == sugerida), None)
+        }
+
+
+def sumar_miembros(servicio, resultados):
+    """Capacidad de un pool: suma de la de sus miembros (servicio@miembro)"""
+    miembros = [r for nombre, r in resultados.items() if nombre.startswith(f"{servicio}@")]
+    if not miembros:
+        return None
+    limitados = any(r["umbral_limitacion"] for r in miembros)
+    return {
+        "servicio": f"{servicio} (pool de {len(miembros)})",
+        "pasos": [],
+        "umbral_limitacion": (sum(r["umbral_limitacion"] or r["concurrencia_sugerida"] for r in miembros)
+                              if limitados else None),
+        "rps_sostenible": round(sum(r["rps_sostenible"] for r in miembros), 2),
+        "concurrencia_sugerida": sum(r["concurrencia_sugerida"] for r in miembros),
+        "p95_ms": max((r["p95_ms"] for r in miembros if r["p95_ms"]), default=None)
+    }
+
+
+def imprimir_sugerencias(resultados):
+    """Concurrencia recomendada para la ingesta y las consultas en lote"""
+    print("\n💡 Sugerencias")
+    embeddings = resultados.get("embeddings")
+    chat = resultados.get("chat")
+    busqueda = resultados.get("busqueda")
+
+    for r in resultados.values():
+        umbral = f", 429 desde x{r['umbral_limitacion']}" if r["umbral_limitacion"] else ""
+        print(f"   • {r['servicio']}: {r['rps_sostenible']} req/s sostenibles con "
+              f"x{r['concurrencia_sugerida']}{umbral}")
+
+    if embeddings:
+        # cargar_pdf embebe en serie dentro de cada PDF: la concurrencia la dan los PDFs en paralelo
+        print(f"   📥 Ingesta: RAG_VIGILANCIA_WORKERS={embeddings['concurrencia_sugerida']} "
+              f"(PDFs en paralelo, una llamada de embeddings a la vez cada uno)")
+        if embeddings["umbral_limitacion"]:
+            print(f"      Con consultas al mismo tiempo, activa RAG_PLANIFICADOR_TPM para que "
+                  f"la carga no llegue al umbral de x{embeddings['umbral_limitacion']}")
+    if busqueda:
+        if busqueda["p95_ms"]:
+            print(f"   🔎 RAG_TIMEOUT_SHARD={max(1, int(np.ceil(busqueda['p95_ms'] * 3 / 1000)))} "
+                  f"(3 x p95 de búsqueda)")
+    limitantes = [r for r in (embeddings, busqueda, chat) if r]
+    if limitantes:
+        cuello = min(limitantes, key=lambda r: r["rps_sostenible"])
+        paralelas = min(r["concurrencia_sugerida"] for r in limitantes)
+        print(f"   📋 Consultas en lote: RAG_LOTE_CONCURRENCIA={paralelas}; "
+              f"el cuello de botella es {cuello['servicio']} ({cuello['rps_sostenible']} req/s)")
+
+
+def ejecutar_sondeo(servicios=("embeddings", "chat", "busqueda"), indice=None, local=False):
+    """Sondea los servicios pedidos; indice: nombre, 'local:<ruta>' o 'snapshot:<ruta>'"""
+    miembros = []
+    if local or not (os.getenv("AZURE_OPENAI_ENDPOINT") or os.getenv("AZURE_OPENAI_POOL")):
+        print("🧪 Azure OpenAI sustituido por ClienteLocal")
+        fabrica_openai = ClienteLocal
+    else:
+        from pool_openai import crear_cliente_openai, PoolOpenAI
+
+        cliente = crear_cliente_openai()
+        if isinstance(cliente, PoolOpenAI):
+            # El pool reintenta los 429 en otro miembro: se sondea cada miembro por su cuenta
+            # (sus clientes ya no reintentan) y el umbral del pool es la suma
+            miembros = cliente.miembros
+        else:
+            # Sin reintentos del SDK, para ver los 429
+            def fabrica_openai():
+                return crear_cliente_openai().with_options(max_retries=0)
+
+    objetivos = {}
+    for servicio, objetivo, despliegue in (("embeddings", objetivo_embeddings, "embedding"),
+                                           ("chat", objetivo_chat, "chat")):
+        if servicio not in servicios:
+            continue
+        if not miembros:
+            objetivos[servicio] = objetivo(fabrica_openai)
+        for m in miembros:
+            if m.despliegues.get(despliegue):
+                objetivos[f"{servicio}@{m.nombre}"] = objetivo(lambda m=m: m.cliente, modelo=m.despliegues[despliegue])
+    if "busqueda" in servicios:
+        indice = indice or os.getenv("AZURE_SEARCH_INDEX_NAME_V2")
+        if not indice:
+            print("⏭️ Sin índice que sondear (ni argumento ni AZURE_SEARCH_INDEX_NAME_V2): se omite la búsqueda")
+        elif indice.startswith("local:") or indice.startswith("snapshot:"):
+            from indice_local import IndiceLocal
+            from snapshot_indice import cargar_snapshot_local
+            ruta = indice.split(":", 1)[1]
+            local_indice = IndiceLocal.cargar(ruta) if indice.startswith("local:") else cargar_snapshot_local(ruta)
+            objetivos["busqueda"] = objetivo_busqueda(lambda: local_indice, local_indice.dimensiones)
+        else:
+            from azure.search.documents import SearchClient
+            from azure.core.credentials import AzureKeyCredential
+            objetivos["busqueda"] = objetivo_busqueda(lambda: SearchClient(
+                endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"),
+                index_name=indice,
+                credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_KEY")),
+                retry_total=0
+            ))
+
+    sondeo = Sondeo()
+    resultados = {}
+    for nombre, (fabrica, llamada) in objetivos.items():
+        try:
+            resultados[nombre] = sondeo.sondear(nombre, fabrica, llamada)
+        except Exception as e:
+            print(f"❌ No se pudo sondear {nombre}: {e}")
+    for servicio in ("embeddings", "chat"):
+        pool = sumar_miembros(servicio, resultados)
+        if pool:
+            resultados[servicio] = pool
+    if resultados:
+        imprimir_sugerencias(resultados)
+    return resultados
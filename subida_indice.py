@@ -0,0 +1,189 @@
+"""
+subida_indice.py - Subida de documentos al índice por lotes de tamaño adaptativo
+Los lotes se cortan por bytes serializados (no por número de documentos), varios
+lotes viajan en paralelo y solo se reintentan las claves que fallaron.
+"""
+
+import json
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from azure.core.exceptions import HttpResponseError
+
+# Azure AI Search acepta hasta 16 MB y 1000 acciones por petición
+MAX_BYTES_LOTE = 8 * 1024 * 1024
+MAX_DOCS_LOTE = 1000
+
+# Estados por documento que Azure recomienda reintentar
+ESTADOS_REINTENTABLES = {409, 422, 429, 503}
+ESTADOS_THROTTLING = {429, 503}
+
+
+def tamano_serializado(doc):
+    """Bytes aproximados del documento en el cuerpo JSON de la petición"""
+    return len(json.dumps(doc, default=str, ensure_ascii=False).encode("utf-8"))
+
+
+class SubidorDocumentos:
+    """Acumula documentos y los sube en segundo plano; finalizar() devuelve el resumen"""
+
+    def __init__(self, search_client, max_bytes=MAX_BYTES_LOTE, max_docs=MAX_DOCS_LOTE,
+                 max_workers=4, max_reintentos=5, backoff_base=1.0,
+                 accion="upload", log=print):
+        self.search_client = search_client
+        self.max_bytes = max_bytes
+        self.max_docs = max_docs
+        self.max_workers = max_workers
+        self.max_reintentos = max_reintentos
+        self.backoff_base = backoff_base
+        self.log = log
+        self._metodo = {
+            "upload": search_client.upload_documents,
+            "merge_or_upload": search_client.merge_or_upload_documents,
+        }[accion]
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futuros = set()
+        self._lote = []
+        self._bytes_lote = 0
+        self._numero_lote = 0
+
+        self._lock = threading.Lock()
+        self.subidos = 0
+        self.bytes_subidos = 0
+        self.reintentos = 0
+        self.throttling = 0
+        self.fallidos = []
+        self._inicio = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.finalizar()
+
+    # --------------------------------------------------------------- entrada
+    def agregar(self, doc):
+        """Encola un documento; cuando el lote llega al límite de bytes se envía"""
+        tamano = tamano_serializado(doc)
+        if self._lote and (self._bytes_lote + tamano > self.max_bytes or len(self._lote) >= self.max_docs):
+            self._enviar()
+        self._lote.append(doc)
+        self._bytes_lote += tamano
+
+    def agregar_muchos(self, docs):
+        for doc in docs:
+            self.agregar(doc)
+
+    def _enviar(self):
+        if not self._lote:
+            return
+        lote, tamano = self._lote, self._bytes_lote
+        self._lote, self._bytes_lote = [], 0
+        self._numero_lote += 1
+
+        # Contrapresión: como mucho 2 lotes en espera por hilo
+        while len(self._futuros) >= self.max_workers * 2:
+            hechos, self._futuros = wait(self._futuros, return_when=FIRST_COMPLETED)
+            for futuro in hechos:
+                futuro.result()
+
+        self._futuros.add(self._executor.submit(self._subir, lote, tamano, self._numero_lote))
+
+    # ---------------------------------------------------------------- subida
+    def _esperar(self, intento, throttling):
+        """Backoff exponencial con jitter (más largo si el servicio está limitando)"""
+        base = self.backoff_base * (2 if throttling else 1)
+        time.sleep(base * (2 ** (intento - 1)) * (0.5 + random.random()))
+
+    def _registrar_fallo(self, doc_id, estado, error):
+        with self._lock:
+            self.fallidos.append({"key": doc_id, "status": estado, "error": error})
+
+    def _subir(self, lote, tamano, numero):
+        pendientes = lote
+        intento = 0
+
+        while pendientes:
+            try:
+                resultados = self._metodo(documents=pendientes)
+            except HttpResponseError as e:
+                estado = e.status_code
+                if estado == 413 and len(pendientes) > 1:
+                    # Lote demasiado grande: partir en dos y reducir el límite para los siguientes
+                    self.max_bytes = max(64 * 1024, self.max_bytes // 2)
+                    mitad = len(pendientes) // 2
+                    self._subir(pendientes[:mitad], tamano // 2, numero)
+                    self._subir(pendientes[mitad:], tamano // 2, numero)
+                    return
+                if estado in ESTADOS_THROTTLING and intento < self.max_reintentos:
+                    intento += 1
+                    with self._lock:
+                        self.reintentos += len(pendientes)
+                        self.throttling += 1
+                    self._esperar(intento, throttling=True)
+                    continue
+                for doc in pendientes:
+                    self._registrar_fallo(doc.get("id"), estado, str(e))
+                self.log(f"   ❌ Error cargando lote {numero}: {e}")
+                return
+            except Exception as e:
+                for doc in pendientes:
+                    self._registrar_fallo(doc.get("id"), None, str(e))
+                self.log(f"   ❌ Error cargando lote {numero}: {e}")
+                return
+
+            por_clave = {doc["id"]: doc for doc in pendientes}
+            reintentar = []
+            ok = 0
+            hubo_throttling = False
+            for r in resultados:
+                if r.succeeded:
+                    ok += 1
+                elif r.status_code in ESTADOS_REINTENTABLES and intento < self.max_reintentos:
+                    reintentar.append(por_clave[r.key])
+                    hubo_throttling |= r.status_code in ESTADOS_THROTTLING
+                else:
+                    self._registrar_fallo(r.key, r.status_code, r.error_message)
+
+            bytes_ok = tamano * ok // max(len(pendientes), 1)
+            with self._lock:
+                self.subidos += ok
+                self.bytes_subidos += bytes_ok
+                self.reintentos += len(reintentar)
+                self.throttling += hubo_throttling
+
+            if intento == 0:
+                self.log(f"   ✅ Lote {numero}: {ok}/{len(pendientes)} documentos cargados ({tamano / 1024:.0f} KB)")
+            elif ok:
+                self.log(f"   ✅ Lote {numero}: {ok} documentos cargados en el reintento {intento}")
+
+            tamano -= bytes_ok
+            pendientes = reintentar
+            if pendientes:
+                intento += 1
+                self._esperar(intento, hubo_throttling)
+
+    # --------------------------------------------------------------- resumen
+    def finalizar(self):
+        """Envía el último lote, espera a todos y devuelve las métricas"""
+        self._enviar()
+        for futuro in self._futuros:
+            futuro.result()
+        self._futuros = set()
+        self._executor.shutdown(wait=True)
+
+        duracion = max(time.perf_counter() - self._inicio, 1e-9)
+        return {
+            "subidos": self.subidos,
+            "fallidos": list(self.fallidos),
+            "bytes": self.bytes_subidos,
+            "reintentos": self.reintentos,
+            "throttling": self.throttling,
+            "lotes": self._numero_lote,
+            "duracion_s": duracion,
+            "docs_s": self.subidos / duracion,
+            "bytes_s": self.bytes_subidos / duracion
+        }
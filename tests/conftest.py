@@ -0,0 +1,12 @@
+"""
+Pruebas sin conexión: usan IndiceLocal, ClienteLocal y archivos temporales,
+así que no necesitan Azure ni el archivo .env.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Scripts de comprobación manual contra Azure (se ejecutan a mano, no con pytest)
+collect_ignore = ["test_openAI.py", "chat_testAzure.py"]
@@ -0,0 +1,107 @@
+"""Índice aproximado IVF-PQ: recall, altas, bajas, filtros y persistencia (user-045)"""
+
+import numpy as np
+import pytest
+from azure.search.documents.models import VectorizedQuery
+
+from ann_local import IndiceANN, construir_desde_local
+from indice_local import IndiceLocal
+
+DIMENSIONES = 16
+FUENTES = ["a.pdf", "b.pdf", "c.pdf", "d.pdf"]
+
+
+@pytest.fixture(scope="module")
+def datos():
+    rng = np.random.default_rng(0)
+    vectores = rng.normal(size=(2000, DIMENSIONES)).astype(np.float32)
+    ids = [f"c{i}" for i in range(len(vectores))]
+    fuentes = [FUENTES[i % len(FUENTES)] for i in range(len(vectores))]
+    return ids, vectores, fuentes
+
+
+def construir(datos, **parametros):
+    ids, vectores, fuentes = datos
+    ann = IndiceANN(dimensiones=DIMENSIONES, nlist=16, m=4, nprobe=4, hilos=2, **parametros)
+    return ann.construir(ids, vectores, fuentes)
+
+
+def exactos(vectores, consulta, k):
+    x = vectores / np.linalg.norm(vectores, axis=1, keepdims=True)
+    return set(np.argsort(-(x @ (consulta / np.linalg.norm(consulta))))[:k])
+
+
+def test_recall_con_todas_las_listas(datos):
+    ids, vectores, _ = datos
+    ann = construir(datos)
+    consultas = np.random.default_rng(1).normal(size=(20, DIMENSIONES))
+    aciertos = 0
+    for q in consultas:
+        encontrados = {ids.index(i) for i, _ in ann.buscar(q, k=10, nprobe=ann.nlist)}
+        aciertos += len(encontrados & exactos(vectores, q, 10))
+    assert aciertos / (10 * len(consultas)) >= 0.9
+
+
+def test_filtro_por_fuente(datos):
+    ids, vectores, fuentes = datos
+    ann = construir(datos)
+    resultados = ann.buscar(vectores[0], k=10, fuentes={"b.pdf"})
+    assert resultados
+    assert all(fuentes[ids.index(i)] == "b.pdf" for i, _ in resultados)
+    assert ann.buscar(vectores[0], k=10, fuentes={"no-existe.pdf"}) == []
+
+
+def test_altas_y_bajas_sin_reconstruir(datos):
+    ids, vectores, _ = datos
+    ann = construir(datos)
+    assert ann.buscar(vectores[5], k=1)[0][0] == "c5"
+
+    ann.eliminar(["c5"])
+    assert "c5" not in [i for i, _ in ann.buscar(vectores[5], k=10, nprobe=ann.nlist)]
+
+    ann.agregar(["nuevo"], vectores[5:6] * 2, ["z.pdf"])
+    assert ann.buscar(vectores[5], k=1)[0][0] == "nuevo"
+    assert [i for i, _ in ann.buscar(vectores[5], k=5, fuentes={"z.pdf"})] == ["nuevo"]
+    assert len(ann) == len(ids)
+
+
+def test_guardar_y_cargar(datos, tmp_path):
+    _, vectores, _ = datos
+    ann = construir(datos)
+    ann.eliminar(["c7"])
+    ann.agregar(["nuevo"], vectores[7:8], ["a.pdf"])
+    esperado = ann.buscar(vectores[7], k=5)
+
+    ann.guardar(str(tmp_path / "indice.ann"))
+    cargado = IndiceANN.cargar(str(tmp_path / "indice.ann"))
+    assert len(cargado) == len(ann)
+    assert "c7" not in cargado.posicion
+    assert [i for i, _ in cargado.buscar(vectores[7], k=5)] == [i for i, _ in esperado]
+
+
+def test_indice_local_con_ann(datos, tmp_path):
+    ids, vectores, fuentes = datos
+    ix = IndiceLocal("ann", dimensiones=DIMENSIONES)
+    ix.upload_documents([
+        {"id": i, "content": f"chunk {i}", "source": f, "page": 1, "content_vector": v.tolist()}
+        for i, v, f in zip(ids, vectores, fuentes)
+    ])
+    ix.usar_ann(construir_desde_local(ix, nlist=16, m=4, nprobe=4, hilos=2))
+
+    consulta = VectorizedQuery(vector=vectores[3].tolist(), k_nearest_neighbors=5, fields="content_vector")
+    resultados = list(ix.search(vector_queries=[consulta], filter="search.in(source, 'd.pdf,a.pdf', ',')", top=5))
+    assert resultados[0]["id"] == "c3"
+    assert {r["source"] for r in resultados} <= {"a.pdf", "d.pdf"}
+
+    # Las bajas y altas del índice local llegan al ANN
+    ix.delete_documents([{"id": "c3"}])
+    ix.upload_documents([{"id": "otro", "content": "x", "source": "d.pdf", "page": 1,
+                          "content_vector": vectores[3].tolist()}])
+    resultados = list(ix.search(vector_queries=[consulta], top=5))
+    assert resultados[0]["id"] == "otro"
+    assert "c3" not in [r["id"] for r in resultados]
+
+    ix.guardar(str(tmp_path / "local"))
+    cargado = IndiceLocal.cargar(str(tmp_path / "local"))
+    assert cargado.ann is not None
+    assert list(cargado.search(vector_queries=[consulta], top=1))[0]["id"] == "otro"
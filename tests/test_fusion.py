@@ -0,0 +1,101 @@
+"""Consulta federada a varios índices y fusión de resultados (user-029)"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from azure.search.documents.models import VectorizedQuery
+
+from coalescencia import UnVuelo
+from consultar import ConsultorRAG, fusionar_resultados
+from enrutado_fuentes import filtro_fuentes
+from indice_local import IndiceLocal, fusion_rrf
+from plazos import Cobertura
+
+DIMENSIONES = 8
+
+
+def vector(semilla):
+    return np.random.default_rng(semilla).normal(size=DIMENSIONES).tolist()
+
+
+def indice(nombre, documentos, con_source=True):
+    ix = IndiceLocal(nombre, dimensiones=DIMENSIONES)
+    ix.upload_documents([
+        dict({"id": i, "content": texto, "page": 1, "content_vector": vector(semilla)},
+             **({"source": fuente} if con_source else {}))
+        for i, texto, fuente, semilla in documentos
+    ])
+    return ix
+
+
+def consultor(shards):
+    """ConsultorRAG solo con lo que usa buscar_en_shards (sin conectar a Azure)"""
+    c = ConsultorRAG.__new__(ConsultorRAG)
+    c.shards = shards
+    c.search_client = next(iter(shards.values()))
+    c.campos_shard = {nombre: set(cliente.campos()) for nombre, cliente in shards.items()}
+    c.fusion = "rrf"
+    c.timeout_shard = 5
+    c.executor = ThreadPoolExecutor(max_workers=4)
+    c.vuelos = UnVuelo()
+    c.cobertura = Cobertura(activa=False)
+    return c
+
+
+def test_fusion_rrf_premia_lo_que_aparece_en_varias_listas():
+    puntajes = fusion_rrf([["a", "b", "c"], ["c", "d"]])
+    assert max(puntajes, key=puntajes.get) == "c"
+    assert puntajes["a"] > puntajes["b"]
+
+
+def test_fusionar_resultados_rrf_une_duplicados_y_marca_el_shard():
+    listas = [
+        ("uno", [{"id": "x", "@search.score": 9.0}, {"id": "y", "@search.score": 5.0}]),
+        ("dos", [{"id": "z", "@search.score": 0.9}, {"id": "x", "@search.score": 0.8}]),
+    ]
+    resultados = fusionar_resultados(listas)
+    assert [r["id"] for r in resultados] == ["x", "z", "y"]
+    assert resultados[0]["shard"] == "uno"
+
+
+def test_fusionar_resultados_normalizado_conserva_el_mayor():
+    listas = [
+        ("uno", [{"id": "x", "@search.score": 10.0}, {"id": "y", "@search.score": 0.0}]),
+        ("dos", [{"id": "y", "@search.score": 0.5}, {"id": "z", "@search.score": 0.0}]),
+    ]
+    resultados = fusionar_resultados(listas, metodo="normalizado")
+    puntajes = {r["id"]: r["@search.score"] for r in resultados}
+    assert puntajes == {"x": 1.0, "y": 1.0, "z": 0.0}
+    assert next(r for r in resultados if r["id"] == "y")["shard"] == "dos"
+
+
+def test_busqueda_hibrida_local_fusiona_texto_y_vector():
+    ix = indice("a", [("1", "turbinas de gas", "t.pdf", 1), ("2", "bombas de agua", "b.pdf", 2)])
+    consulta = VectorizedQuery(vector=vector(2), k_nearest_neighbors=2, fields="content_vector")
+    resultados = list(ix.search(search_text="bombas", vector_queries=[consulta], top=2))
+    assert resultados[0]["id"] == "2"
+    # El vector de quien llama no se modifica
+    assert consulta.vector == vector(2)
+
+
+def test_buscar_en_shards_combina_indices_y_respeta_su_esquema():
+    a = indice("a", [("a1", "turbinas de gas", "t.pdf", 1), ("a2", "bombas de agua", "b.pdf", 2)])
+    b = indice("b", [("b1", "turbinas eólicas", "e.pdf", 3)], con_source=False)
+    c = consultor({"a": a, "b": b})
+
+    resultados = c.buscar_en_shards(search_text="turbinas", select=["id", "content", "source"], top=5)
+    assert {r["id"] for r in resultados} == {"a1", "b1"}
+    assert {r["shard"] for r in resultados} == {"a", "b"}
+    assert "source" not in next(r for r in resultados if r["id"] == "b1")
+
+    # Un índice sin 'source' no puede filtrar por documento y se omite
+    filtrados = c.buscar_en_shards(search_text="turbinas", filter="source eq 't.pdf'", top=5)
+    assert [r["id"] for r in filtrados] == ["a1"]
+
+
+def test_filtro_fuentes_con_separador_en_los_nombres():
+    nombres = ["a|b.pdf", "o'neil.pdf", "x|,;#~^.pdf"]
+    ix = indice("a", [(str(i), "texto", n, i) for i, n in enumerate(nombres + ["otro.pdf"])])
+    for fuentes in (nombres[:2], nombres):
+        encontrados = {r["source"] for r in ix.search(search_text="*", filter=filtro_fuentes(fuentes))}
+        assert encontrados == set(fuentes)
@@ -0,0 +1,51 @@
+"""Limpieza de cabeceras, pies y texto repetido antes de dividir en chunks (user-048)"""
+
+from limpieza_texto import limpiar_paginas, normalizar_espacios
+
+
+CAPITULOS = ["uno", "dos", "tres", "cuatro", "cinco", "seis", "siete"]
+TEMAS = ["turbinas", "bombas", "válvulas", "sensores", "motores", "filtros", "tuberías"]
+
+
+def paginas(n=6):
+    return [
+        f"Manual de la turbina X200\nEl capítulo {CAPITULOS[i % 7]} trata su propio tema\n"
+        f"Sección sobre {TEMAS[i % 7]}\n{i}. Ajustar la válvula {i}\n{i + 1}. Revisar la presión {i}\n"
+        f"Ver también {TEMAS[(i + 3) % 7]}\nConfidencial - Todos los derechos reservados\nPágina {i} de {n}"
+        for i in range(1, n + 1)
+    ]
+
+
+def test_quita_cabecera_pie_y_numero_de_pagina():
+    limpias, resumen = limpiar_paginas(paginas())
+    assert all("Manual de la turbina" not in t for t in limpias)
+    assert all("Página" not in t for t in limpias)
+    assert all("Confidencial" not in t for t in limpias)
+    assert limpias[2].startswith("El capítulo cuatro trata su propio tema")
+    assert resumen["lineas_eliminadas"] == 6 * 3
+    assert resumen["caracteres_despues"] < resumen["caracteres_antes"]
+
+
+def test_conserva_pasos_numerados_del_cuerpo():
+    limpias, _ = limpiar_paginas(paginas())
+    # En el cuerpo los números cuentan: los pasos de cada página son distintos
+    assert all(f"{i}. Ajustar la válvula {i}\n{i + 1}. Revisar la presión {i}" in t
+               for i, t in enumerate(limpias, start=1))
+
+
+def test_pocas_paginas_no_se_tocan():
+    textos = paginas(2)
+    limpias, resumen = limpiar_paginas(textos)
+    assert limpias == [normalizar_espacios(t) for t in textos]
+    assert resumen["lineas_eliminadas"] == 0
+
+
+def test_una_pagina_nunca_queda_vacia():
+    textos = ["Manual de la turbina X200\nPágina 1 de 4"] + paginas(4)[1:]
+    limpias, _ = limpiar_paginas(textos)
+    assert limpias[0] == "Manual de la turbina X200\nPágina 1 de 4"
+    assert len(limpias) == len(textos)
+
+
+def test_normaliza_espacios_e_invisibles():
+    assert normalizar_espacios("  hola   mundo‍ \r\n\n adiós  ") == "hola mundo\nadiós"
@@ -0,0 +1,81 @@
+"""Turnos por clase de prioridad sobre el TPM compartido (user-044)"""
+
+import threading
+import time
+
+import pytest
+
+from planificador import CUOTAS_POR_DEFECTO, SIN_TURNO, Planificador, leer_cuotas
+from plazos import Plazo, PlazoVencido
+
+
+@pytest.fixture
+def ruta(tmp_path):
+    return str(tmp_path / "planificador.db")
+
+
+def test_leer_cuotas():
+    assert leer_cuotas(None) == CUOTAS_POR_DEFECTO
+    assert leer_cuotas("lote=0.5, otra=1,ingesta=0.2") == dict(CUOTAS_POR_DEFECTO, lote=0.5, ingesta=0.2)
+
+
+def test_desactivado_sin_tpm(ruta, monkeypatch):
+    monkeypatch.delenv("RAG_PLANIFICADOR_TPM", raising=False)
+    planificador = Planificador(ruta=ruta)
+    assert not planificador.activo
+    assert planificador.turno("ingesta", 10 ** 9) is SIN_TURNO
+
+
+def test_cuota_de_clase_y_reserva_interactiva(ruta):
+    planificador = Planificador(ruta=ruta, tpm=1000, reserva=0.2)
+    planificador.adquirir("lote", 600)
+
+    # lote no pasa del 70 %, ingesta no entra en la reserva (600 + 300 > 800)
+    with pytest.raises(PlazoVencido):
+        planificador.adquirir("lote", 200, Plazo(0.2))
+    with pytest.raises(PlazoVencido):
+        planificador.adquirir("ingesta", 300, Plazo(0.3))
+
+    # Una pregunta sí usa la reserva
+    inicio = time.time()
+    planificador.adquirir("interactiva", 300, Plazo(1))
+    assert time.time() - inicio < 0.5
+    assert planificador.estado()["tokens_ultimo_minuto"] == 900
+    # Las esperas vencidas dejan la cola
+    assert all(c["en_cola"] == 0 for c in planificador.estado()["clases"].values())
+
+
+def test_una_pregunta_en_cola_adelanta_al_lote(ruta):
+    cuotas = dict(CUOTAS_POR_DEFECTO, interactiva=0.1)
+    preguntas = Planificador(ruta=ruta, tpm=1000, cuotas=cuotas)
+    lotes = Planificador(ruta=ruta, tpm=1000, cuotas=cuotas)  # otro proceso, mismo archivo
+    preguntas.adquirir("interactiva", 100)
+
+    # La segunda pregunta espera por su cuota; mientras tanto el lote no pasa aunque cabe
+    errores = []
+
+    def preguntar():
+        try:
+            preguntas.adquirir("interactiva", 100, Plazo(1.0))
+        except PlazoVencido as e:
+            errores.append(e)
+
+    espera = threading.Thread(target=preguntar)
+    espera.start()
+    time.sleep(0.3)
+    with pytest.raises(PlazoVencido):
+        lotes.adquirir("lote", 100, Plazo(0.3))
+    espera.join()
+    assert len(errores) == 1
+
+    # Sin preguntas en cola, el lote entra
+    lotes.adquirir("lote", 100, Plazo(1))
+    assert lotes.estado()["clases"]["lote"]["tokens_ultimo_minuto"] == 100
+
+
+def test_ajustar_corrige_la_estimacion(ruta):
+    planificador = Planificador(ruta=ruta, tpm=1000)
+    with planificador.turno("ingesta", 500) as turno:
+        turno.ajustar(120)
+    assert planificador.estado()["clases"]["ingesta"]["tokens_ultimo_minuto"] == 120
+    assert "ingesta: 1 llamadas" in planificador.resumen()
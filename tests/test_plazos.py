@@ -0,0 +1,103 @@
+"""Plazo por consulta y peticiones cubiertas (user-050)"""
+
+import time
+
+import pytest
+
+from plazos import Cobertura, Plazo, PlazoVencido, SIN_PLAZO, opciones_timeout
+from sondeo_servicios import ClienteLocal
+
+
+def test_plazo_restante_y_vencimiento():
+    assert SIN_PLAZO.restante() is None and not SIN_PLAZO.vencido()
+    plazo = Plazo(0.05)
+    assert 0 < plazo.restante() <= 0.05
+    time.sleep(0.06)
+    assert plazo.vencido() and plazo.restante() == 0
+    with pytest.raises(PlazoVencido):
+        plazo.comprobar("search")
+
+
+def test_derivado_se_cancela_por_separado():
+    plazo = Plazo(10)
+    intento = plazo.derivado()
+    intento.cancelar()
+    assert intento.vencido() and intento.restante() == 0
+    assert not plazo.vencido()
+
+
+def test_opciones_timeout():
+    assert opciones_timeout(None, "timeout") == {}
+    assert opciones_timeout(0, "timeout", "read_timeout") == {"timeout": 0.001, "read_timeout": 0.001}
+
+
+def test_respaldo_gana_a_un_intento_lento():
+    cobertura = Cobertura(activa=True, retraso_inicial=0.05)
+    llamadas = []
+
+    def funcion(intento):
+        intento.enviar()
+        llamadas.append(intento)
+        if len(llamadas) == 1:
+            time.sleep(1.0)
+            return "lento"
+        return "rápido"
+
+    inicio = time.perf_counter()
+    assert cobertura.ejecutar("embedding", funcion, Plazo(5)) == "rápido"
+    assert time.perf_counter() - inicio < 0.5
+    assert cobertura.contadores["embedding"]["cubiertas"] == 1
+    assert cobertura.contadores["embedding"]["ganadas"] == 1
+
+
+def test_sin_respaldo_mientras_espera_turno():
+    cobertura = Cobertura(activa=True, retraso_inicial=0.01)
+    llamadas = []
+
+    def funcion(intento):
+        llamadas.append(intento)
+        time.sleep(0.2)  # cola del planificador: la petición aún no sale
+        intento.enviar()
+        return "ok"
+
+    assert cobertura.ejecutar("search", funcion, Plazo(5)) == "ok"
+    assert len(llamadas) == 1
+
+
+def test_plazo_vencido_no_espera_al_intento():
+    cobertura = Cobertura(activa=True, retraso_inicial=10)
+
+    def funcion(intento):
+        intento.enviar()
+        time.sleep(1.0)
+        return "tarde"
+
+    inicio = time.perf_counter()
+    with pytest.raises(PlazoVencido):
+        cobertura.ejecutar("search", funcion, Plazo(0.1))
+    assert time.perf_counter() - inicio < 0.5
+    assert cobertura.contadores["search"]["vencidas"] == 1
+
+
+def test_errores_se_propagan():
+    cobertura = Cobertura(activa=False)
+
+    def funcion(intento):
+        raise ValueError("fallo")
+
+    with pytest.raises(ValueError):
+        cobertura.ejecutar("chat", funcion, Plazo(1), cubrir=False)
+
+
+def test_embedding_con_cliente_local_dentro_del_plazo():
+    cliente = ClienteLocal(latencia_ms=5)
+    cobertura = Cobertura(activa=True)
+    respuesta = cobertura.ejecutar(
+        "embedding",
+        lambda intento: cliente.embeddings.create(
+            input="hola", model="embeddings", **opciones_timeout(intento.enviar(), "timeout")
+        ),
+        Plazo(5)
+    )
+    assert len(respuesta.data) == 1 and len(respuesta.data[0].embedding) > 0
+    assert len(cobertura.latencias["embedding"]) == 1
@@ -1,8 +1,15 @@
 """
 verificar_config.py - Verifica que todo esté configurado correctamente
+
+Con --sondear mide además conexión, latencia p50/p95 y capacidad de embeddings,
+chat y búsqueda, y sugiere la concurrencia (ver sondeo_servicios.py):
+
+    python verificar_config.py --sondear [indice|local:<ruta>|snapshot:<ruta>]
+                                         [embeddings] [chat] [busqueda] [--local]
 """
 
 import os
+import sys
 from dotenv import load_dotenv
 from openai import AzureOpenAI
 from azure.search.documents.indexes import SearchIndexClient
@@ -10,6 +17,21 @@ from azure.core.credentials import AzureKeyCredential
 
 load_dotenv()
 
+if "--sondear" in sys.argv:
+    from sondeo_servicios import ejecutar_sondeo
+
+    argumentos = sys.argv[sys.argv.index("--sondear") + 1:]
+    servicios = [a for a in argumentos if a in ("embeddings", "chat", "busqueda")]
+    indices = [a for a in argumentos if not a.startswith("--") and a not in servicios]
+    print("⏱️ SONDEO DE LATENCIA Y CAPACIDAD")
+    print("="*50)
+    resultados = ejecutar_sondeo(
+        servicios=servicios or ("embeddings", "chat", "busqueda"),
+        indice=indices[0] if indices else None,
+        local="--local" in argumentos
+    )
+    sys.exit(0 if resultados else 1)
+
 print("🔍 VERIFICACIÓN DE CONFIGURACIÓN")
 print("="*50)
 
@@ -0,0 +1,258 @@
+"""
+vigilar_carpetas.py - Carga desatendida de PDFs vigilando una o más carpetas
+Detecta PDFs nuevos, modificados y eliminados por sondeo (tamaño + fecha de
+modificación), espera a que el archivo deje de cambiar antes de encolarlo y
+lo procesa con CargadorPDF en varios hilos, sin preguntas interactivas.
+
+Uso: python vigilar_carpetas.py <carpeta> [<carpeta> ...]
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from diario_carga import CARGA_INCOMPLETA
+
+
+class VigilanteCarpetas:
+    def __init__(self, cargador, carpetas, intervalo=None, espera_estable=None, max_workers=None,
+                 archivo_estado="vigilancia_estado.json", archivo_metricas="vigilancia_metricas.json"):
+        self.cargador = cargador
+        self.carpetas = [os.path.abspath(c) for c in carpetas]
+        self.intervalo = intervalo or float(os.getenv("RAG_VIGILANCIA_INTERVALO", "5"))
+        self.espera_estable = espera_estable or float(os.getenv("RAG_VIGILANCIA_ESPERA", "10"))
+        self.max_workers = max_workers or int(os.getenv("RAG_VIGILANCIA_WORKERS", "2"))
+        # Cada hilo puede extraer un PDF grande en varios procesos: los núcleos se
+        # reparten entre los hilos en lugar de lanzar un proceso por núcleo en cada uno
+        if not os.getenv("RAG_PROCESOS_EXTRACCION"):
+            cargador.procesos_extraccion = max(1, (os.cpu_count() or 1) // self.max_workers)
+        self.archivo_estado = archivo_estado
+        self.archivo_metricas = archivo_metricas
+
+        # ruta -> [tamaño, mtime] de la versión ya cargada
+        self.procesados = self._leer_estado()
+        # ruta -> (firma, instante en que se vio por primera vez esa firma)
+        self.candidatos = {}
+
+        self.cola = queue.Queue()
+        self._encolados = set()
+        self._en_curso = set()
+        self._reintentar_desde = {}
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self.contadores = {"cargados": 0, "incompletos": 0, "eliminados": 0, "errores": 0}
+
+    def _leer_estado(self):
+        if os.path.exists(self.archivo_estado):
+            try:
+                with open(self.archivo_estado, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                pass
+        return {}
+
+    def _guardar_estado(self):
+        with self._lock:
+            estado = dict(self.procesados)
+        with open(self.archivo_estado, "w", encoding="utf-8") as f:
+            json.dump(estado, f, indent=2, ensure_ascii=False)
+
+    # ------------------------------------------------------------- detección
+    def escanear(self):
+        """PDFs presentes en las carpetas vigiladas con su firma [tamaño, mtime]
+
+        Devuelve también las carpetas que se pudieron leer: una carpeta que falla
+        (recurso desmontado, permisos) no cuenta como vacía.
+        """
+        actuales = {}
+        leidas = set()
+        for carpeta in self.carpetas:
+            try:
+                entradas = list(os.scandir(carpeta))
+            except OSError as e:
+                self.cargador.log_actividad(f"⚠️ No se pudo leer {carpeta}: {e}")
+                continue
+            leidas.add(carpeta)
+            for entrada in entradas:
+                try:
+                    if entrada.is_file() and entrada.name.lower().endswith(".pdf"):
+                        info = entrada.stat()
+                        actuales[entrada.path] = [info.st_size, info.st_mtime]
+                except FileNotFoundError:
+                    continue  # borrado durante el escaneo
+        return actuales, leidas
+
+    def _ocupado(self, ruta):
+        with self._lock:
+            return ruta in self._en_curso or any(r == ruta for _, r in self._encolados)
+
+    def _encolar(self, accion, ruta, firma=None):
+        with self._lock:
+            self._encolados.add((accion, ruta))
+        self.cola.put((accion, ruta, firma))
+
+    def revisar(self, ahora=None):
+        """Un ciclo de sondeo: encola los archivos estables que cambiaron y los eliminados"""
+        ahora = ahora if ahora is not None else time.monotonic()
+        actuales, leidas = self.escanear()
+
+        for ruta, firma in actuales.items():
+            if self.procesados.get(ruta) == firma:
+                self.candidatos.pop(ruta, None)
+                continue
+            anterior = self.candidatos.get(ruta)
+            if anterior is None or anterior[0] != firma:
+                # Nuevo o aún escribiéndose: se reinicia la espera
+                self.candidatos[ruta] = (firma, ahora)
+            elif (ahora - anterior[1] >= self.espera_estable
+                  and ahora >= self._reintentar_desde.get(ruta, 0)
+                  and not self._ocupado(ruta)):
+                del self.candidatos[ruta]
+                self._encolar("cargar", ruta, firma)
+
+        for ruta in list(self.candidatos):
+            if ruta not in actuales:
+                del self.candidatos[ruta]
+        # Solo se eliminan documentos de carpetas vigiladas y leídas en este ciclo
+        # (no los de otras ejecuciones con otras carpetas ni los de una carpeta que falló)
+        with self._lock:
+            desaparecidos = [r for r in self.procesados
+                             if r not in actuales and os.path.dirname(r) in leidas]
+        for ruta in desaparecidos:
+            if ahora >= self._reintentar_desde.get(ruta, 0) and not self._ocupado(ruta):
+                self._encolar("eliminar", ruta)
+
+    # ----------------------------------------------------------- procesamiento
+    def procesar(self, accion, ruta, firma=None):
+        nombre = os.path.basename(ruta)
+        try:
+            if accion == "cargar":
+                cargado = self.cargador.cargar_pdf(ruta, interactivo=False, verificar_indice=False)
+                if cargado == CARGA_INCOMPLETA:
+                    # Sin anotar la firma: el próximo intento reanuda la carga desde el diario
+                    self.cargador.log_actividad(f"⏸️ {nombre}: carga incompleta, se reanuda en 60s")
+                    with self._lock:
+                        self.contadores["incompletos"] += 1
+                    self._reintentar_desde[ruta] = time.monotonic() + 60
+                    return
+                with self._lock:
+                    # Un PDF sin texto también se marca: no se reintenta hasta que cambie
+                    self.procesados[ruta] = firma
+                    self.contadores["cargados" if cargado else "errores"] += 1
+            else:
+                # El índice identifica los documentos por nombre de archivo: si otra
+                # carpeta tiene un PDF con el mismo nombre, se recarga en lugar de borrarlo
+                with self._lock:
+                    homonimos = [r for r in self.procesados
+                                 if r != ruta and os.path.basename(r) == nombre]
+                if homonimos:
+                    self.cargador.log_actividad(
+                        f"⚠️ {nombre} sigue en {os.path.dirname(homonimos[0])}: se recarga esa copia"
+                    )
+                else:
+                    self.cargador.eliminar_documento(nombre)
+                with self._lock:
+                    self.procesados.pop(ruta, None)
+                    for r in homonimos:
+                        self.procesados.pop(r, None)
+                    self.contadores["eliminados"] += 1
+            self._reintentar_desde.pop(ruta, None)
+            self._guardar_estado()
+        except Exception as e:
+            self.cargador.log_actividad(f"❌ Error procesando {nombre} ({accion}): {e}")
+            with self._lock:
+                self.contadores["errores"] += 1
+            # Error transitorio (red, cuota): se reintenta pasado un minuto
+            self._reintentar_desde[ruta] = time.monotonic() + 60
+
+    def _trabajador(self):
+        while not self._detener.is_set():
+            try:
+                accion, ruta, firma = self.cola.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self._lock:
+                self._encolados.discard((accion, ruta))
+                self._en_curso.add(ruta)
+            try:
+                self.procesar(accion, ruta, firma)
+            finally:
+                with self._lock:
+                    self._en_curso.discard(ruta)
+                self.cola.task_done()
+
+    # --------------------------------------------------------------- métricas
+    def metricas(self):
+        with self._lock:
+            return {
+                "fecha": datetime.now().isoformat(),
+                "en_cola": self.cola.qsize(),
+                "en_curso": len(self._en_curso),
+                "esperando_estabilidad": len(self.candidatos),
+                "documentos_vigilados": len(self.procesados),
+                **self.contadores
+            }
+
+    def publicar_metricas(self):
+        metricas = self.metricas()
+        with open(self.archivo_metricas, "w", encoding="utf-8") as f:
+            json.dump(metricas, f, indent=2, ensure_ascii=False)
+        return metricas
+
+    # ---------------------------------------------------------------- bucle
+    def ejecutar(self, duracion=None):
+        """Vigila hasta Ctrl+C (o durante `duracion` segundos)"""
+        self.cargador.verificar_crear_indice()
+        self.cargador.log_actividad(
+            f"👀 Vigilando {', '.join(self.carpetas)} "
+            f"(cada {self.intervalo:.0f}s, espera {self.espera_estable:.0f}s, {self.max_workers} hilos)"
+        )
+
+        # Un archivo en cola o en curso no se vuelve a encolar; si cambia
+        # mientras se carga, el siguiente ciclo lo detecta por su nueva firma
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        for _ in range(self.max_workers):
+            executor.submit(self._trabajador)
+
+        fin = time.monotonic() + duracion if duracion else None
+        ultimo = None
+        interrumpido = False
+        try:
+            while fin is None or time.monotonic() < fin:
+                self.revisar()
+                metricas = self.publicar_metricas()
+                resumen = (metricas["en_cola"], metricas["en_curso"], metricas["esperando_estabilidad"])
+                if resumen != ultimo:
+                    print(f"📊 En cola: {resumen[0]} | En curso: {resumen[1]} | "
+                          f"Esperando estabilidad: {resumen[2]}")
+                    ultimo = resumen
+                time.sleep(self.intervalo)
+        except KeyboardInterrupt:
+            interrumpido = True
+            print("\n⏹️ Deteniendo vigilancia (se terminan los documentos en curso)...")
+        finally:
+            # Con Ctrl+C no se vacía la cola: lo pendiente se detecta en la próxima ejecución
+            if not interrumpido:
+                self.cola.join()
+            self._detener.set()
+            executor.shutdown(wait=True)
+            self.publicar_metricas()
+            self.cargador.consumo.guardar()
+            self.cargador.log_actividad(f"🔗 Llamadas en vuelo compartidas: {self.cargador.vuelos.resumen()}")
+            if self.cargador.planificador.activo:
+                self.cargador.log_actividad(f"⏳ Espera en cola: {self.cargador.planificador.resumen()}")
+
+
+if __name__ == "__main__":
+    from cargar_pdf import CargadorPDF
+
+    if len(sys.argv) < 2:
+        print("Uso: python vigilar_carpetas.py <carpeta> [<carpeta> ...]")
+        sys.exit(1)
+
+    VigilanteCarpetas(CargadorPDF(), sys.argv[1:]).ejecutar()